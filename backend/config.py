@@ -32,6 +32,16 @@ class EmbedConfig(BaseModel):
     base_url: str = "http://172.16.0.211:10000/v1/embeddings"
     # base_url: str = "http://172.16.0.211:10000"
     config: Dict[str, Any] = Field(default_factory=dict)
+    # 每次请求的文本数
+    batch_size: int = 32
+    # 同时在途的请求数（同时也是连接池大小）
+    max_concurrency: int = 4
+    # 请求超时（秒）
+    timeout: float = 30.0
+    # embedding磁盘缓存（内存映射向量文件 + SQLite索引），超过容量上限时按最近访问时间淘汰
+    cache_enabled: bool = True
+    cache_path: str = "./data/embed_cache"
+    cache_max_mb: int = 2048
 
 class PgConfig(BaseModel):
     host: str = "192.168.0.197"
@@ -40,30 +50,97 @@ class PgConfig(BaseModel):
     password: str = "Kps@2025"
     database: str = "kb"
 
+class WorkerConfig(BaseModel):
+    # 分布式入库（Postgres任务表）：每次领取的文本块数
+    batch_size: int = 32
+    # 租约时长（秒），超时未完成的任务可被其他worker重新领取
+    lease_seconds: int = 600
+    # 每个任务最多尝试次数
+    max_attempts: int = 3
+    # 队列为空时的轮询间隔（秒）
+    poll_interval: float = 5.0
+
 class SplitConfig(BaseModel):
     chunk_size: int = 1500
     chunk_overlap: int = 150
 
+class IndexConfig(BaseModel):
+    # 实体抽取最大并发请求数（vLLM部署的Qwen3-32B可承载16~32并发）
+    extract_concurrency: int = 16
+    # 实体抽取结果本地缓存（SQLite）
+    extract_cache_enabled: bool = True
+    extract_cache_path: str = "./data/extract_cache.db"
+    # 抽取模式：single（每次请求一个文本块）/ packed（多个文本块打包为一次请求）/ lean（关闭思考、JSON约束输出）
+    extract_mode: str = "single"
+    # lean模式：每个文本块的生成token上限
+    extract_max_tokens: int = 512
+    # 打包模式：每次请求的文本token预算及最多文本块数
+    extract_pack_token_budget: int = 4000
+    extract_pack_max_chunks: int = 8
+    # 流式抽取（仅single模式）：边接收LLM输出边解析，实体/三元组逐行进入图数据库写入批次
+    stream_extract: bool = False
+
+class StageConfig(BaseModel):
+    # 工作线程数
+    workers: int = 1
+    # 每次处理的批大小
+    batch_size: int = 1
+    # 输入队列容量（队列满时上游阻塞，形成背压）
+    queue_size: int = 64
+
+class PipelineConfig(BaseModel):
+    # 入库流水线各阶段配置：分块 -> (向量化 -> 向量库写入) / (实体抽取 -> 图数据库写入)
+    chunk: StageConfig = Field(default_factory=lambda: StageConfig(workers=1, batch_size=1, queue_size=4))
+    embed: StageConfig = Field(default_factory=lambda: StageConfig(workers=2, batch_size=32, queue_size=256))
+    extract: StageConfig = Field(default_factory=lambda: StageConfig(workers=4, batch_size=16, queue_size=256))
+    vector_write: StageConfig = Field(default_factory=lambda: StageConfig(workers=1, batch_size=64, queue_size=256))
+    graph_write: StageConfig = Field(default_factory=lambda: StageConfig(workers=1, batch_size=50, queue_size=256))
+
 class SearchConfig(BaseModel):
     top_k: int = 3
     expand_depth: int = 2
     score: float = 0.5
+    # 查询向量缓存（进程内LRU）：最多缓存的查询数（0表示不缓存）及有效期（秒，0表示不过期）
+    query_cache_size: int = 1024
+    query_cache_ttl: float = 3600
+
+class ServiceConfig(BaseModel):
+    # 服务注册表最多缓存的知识库数量（LRU淘汰）
+    max_kbs: int = 8
+    # 知识库服务空闲多久（秒）后被淘汰
+    idle_ttl: int = 1800
+    # 后台入库任务的并发数
+    job_workers: int = 2
 
 class rerankConfig(BaseModel):
     model: str = "bge-rerank"
     base_url: str = "http://172.16.0.211:10000/v1/rerank"
+    # 重排后端：local（本地CrossEncoder）/ remote（调用base_url的重排服务）
+    backend: str = "local"
+    # 远程重排请求超时（秒），超时后回退到本地模型
+    timeout: float = 3.0
+    fallback_local: bool = True
+    # 本地CrossEncoder重排模型
+    local_model_path: str = "./backend/model/local_models/BAAI/bge-reranker-base"
+    batch_size: int = 32
+    # 服务启动时预加载并预热本地重排模型
+    warmup: bool = True
 
 
 class Settings(BaseSettings):
     split: SplitConfig = Field(default_factory=SplitConfig)
+    index: IndexConfig = Field(default_factory=IndexConfig)
     search: SearchConfig = Field(default_factory=SearchConfig)
     rerank: rerankConfig = Field(default_factory=rerankConfig)
+    service: ServiceConfig = Field(default_factory=ServiceConfig)
+    pipeline: PipelineConfig = Field(default_factory=PipelineConfig)
 
     llm: LLMConfig = Field(default_factory=LLMConfig)
     embed: EmbedConfig = Field(default_factory=EmbedConfig)
     graph_store: GraphStoreConfig = Field(default_factory=GraphStoreConfig)
     vector_store: VectorStoreConfig = Field(default_factory=VectorStoreConfig)
     pg: PgConfig = Field(default_factory=PgConfig)
+    worker: WorkerConfig = Field(default_factory=WorkerConfig)
 
 
 if __name__ == "__main__":
@@ -71,10 +148,14 @@ if __name__ == "__main__":
     print(st.split)
     st.split.chunk_size = 1100
     print(st.split)
+    print(st.index)
     print(st.search)
     print(st.rerank)
+    print(st.service)
+    print(st.pipeline)
     print(st.llm)
     print(st.embed)
     print(st.graph_store)
     print(st.vector_store)
     print(st.pg)
+    print(st.worker)
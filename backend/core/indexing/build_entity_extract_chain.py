@@ -1,7 +1,8 @@
 
 import os
+import re
 import json
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import requests  # 用于调用远程API（如GPT、文心一言）
 from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM  # 用于本地模型（如Llama）
 
@@ -199,6 +200,40 @@ def build_langchain_extract_chain(llm):
     return extract_chain
 
 
+# 思考过程行的关键词，含这些关键词的行不参与解析
+NOISE_KEYWORDS = ["思考", "分析", "首先", "需要", "说明", "解释"]
+# 实体列表行前缀（兼容多种格式：实体列表：xxx / 实体列表:xxx / 实体：xxx）
+ENTITY_LINE_PREFIXES = ["实体列表：", "实体列表:", "实体：", "实体:"]
+
+
+def clean_output_line(line: str) -> Optional[str]:
+    """去除首尾空白，空行和思考过程行返回None"""
+    line = line.strip()
+    if not line or any(key in line for key in NOISE_KEYWORDS):
+        return None
+    return line
+
+
+def is_entity_line(line: str) -> bool:
+    return any(prefix in line for prefix in ENTITY_LINE_PREFIXES)
+
+
+def parse_entity_line(line: str) -> List[str]:
+    """解析实体列表行：提取冒号后的内容（兼容中英文冒号），按逗号分割并过滤空值和无效字符"""
+    entity_part = line.split("：")[-1] if "：" in line else line.split(":")[-1]
+    return [e.strip() for e in entity_part.split(",") if e.strip() and len(e.strip()) >= 2]
+
+
+def parse_triple_line(line: str) -> Optional[str]:
+    """解析三元组行：仅保留含|且分割后为3部分的行，格式错误返回None"""
+    if "|" not in line:
+        return None
+    parts = [p.strip() for p in line.split("|")]
+    if len(parts) == 3 and all(parts) and all(len(p) >= 2 for p in parts):
+        return "|".join(parts)
+    return None
+
+
 def parse_llm_output(extract_result: str):
     """
     解析LLM输出，过滤思考过程，精准提取实体列表和三元组
@@ -208,46 +243,273 @@ def parse_llm_output(extract_result: str):
     3. 部分行格式错误（如少|的三元组）；
     """
     # 步骤1：过滤所有非目标行（仅保留实体列表和三元组相关行）
-    clean_lines = []
-    for line in extract_result.split("\n"):
-        line = line.strip()
-        # 跳过空行、思考过程行（含“思考/分析/首先/需要”等关键词）
-        if not line or any(key in line for key in ["思考", "分析", "首先", "需要", "说明", "解释"]):
-            continue
-        clean_lines.append(line)
-    
-    # 步骤2：解析实体列表（兼容多种格式：实体列表：xxx / 实体列表:xxx / 实体：xxx）
+    clean_lines = [line for line in map(clean_output_line, extract_result.split("\n")) if line]
+
+    # 步骤2：解析实体列表（取第一个实体列表行）
     entity_list = []
-    entity_line = None
     for line in clean_lines:
-        if any(prefix in line for prefix in ["实体列表：", "实体列表:", "实体：", "实体:"]):
-            entity_line = line
+        if is_entity_line(line):
+            entity_list = parse_entity_line(line)
             break
-    if entity_line:
-        # 提取冒号后的内容，兼容中英文冒号
-        entity_part = entity_line.split("：")[-1] if "：" in entity_line else entity_line.split(":")[-1]
-        # 按逗号分割，过滤空值和无效字符
-        entity_list = [e.strip() for e in entity_part.split(",") if e.strip() and len(e.strip()) >= 2]
-    
-    # 步骤3：解析三元组（仅保留含|且格式正确的行）
+
+    # 步骤3：解析三元组（跳过实体列表行）
     triples = []
     for line in clean_lines:
-        # 跳过实体列表行，仅处理三元组行
-        if any(prefix in line for prefix in ["实体列表：", "实体列表:", "实体：", "实体:"]):
+        if is_entity_line(line):
             continue
-        # 仅保留含|且分割后为3部分的行
-        if "|" in line:
-            parts = [p.strip() for p in line.split("|")]
-            if len(parts) == 3 and all(parts) and all(len(p) >= 2 for p in parts):
-                triples.append("|".join(parts))
-    
+        triple = parse_triple_line(line)
+        if triple:
+            triples.append(triple)
+
     # 步骤4：去重（避免重复实体/三元组）
     entity_list = list(set(entity_list))
     triples = list(set(triples))
-    
+
     return entity_list, triples
 
 
+class StreamingExtractParser:
+    """
+    流式解析抽取链的输出：按token片段喂入，每凑齐一整行即解析，产出事件
+    - ("entities", 实体列表)：第一个实体列表行解析完成时产出一次
+    - ("triple", "实体1|关系|实体2")：每个新三元组行解析完成时产出
+    实体列表行之前出现的三元组先缓存，待实体列表产出后再依次产出，
+    保证下游写入三元组时实体节点已存在；解析规则与 parse_llm_output 一致
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._entities: Optional[List[str]] = None
+        self._pending_triples: List[str] = []
+        self._triples: List[str] = []
+
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        """喂入一段输出文本，返回本次新完成的行产出的事件"""
+        self._buffer += text
+        events = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            events.extend(self._parse_line(line))
+        return events
+
+    def close(self) -> List[Tuple[str, object]]:
+        """输出结束：解析最后一行；若始终没有实体列表行，产出空实体列表和已缓存的三元组"""
+        events = self._parse_line(self._buffer)
+        self._buffer = ""
+        if self._entities is None:
+            events.extend(self._emit_entities([]))
+        return events
+
+    def result(self) -> Tuple[List[str], List[str]]:
+        """已解析的(实体列表, 三元组列表)"""
+        return list(self._entities or []), list(self._triples)
+
+    def _parse_line(self, line: str) -> List[Tuple[str, object]]:
+        line = clean_output_line(line)
+        if line is None:
+            return []
+        if is_entity_line(line):
+            if self._entities is not None:
+                return []
+            return self._emit_entities(list(dict.fromkeys(parse_entity_line(line))))
+        triple = parse_triple_line(line)
+        if triple is None or triple in self._triples:
+            return []
+        self._triples.append(triple)
+        if self._entities is None:
+            self._pending_triples.append(triple)
+            return []
+        return [("triple", triple)]
+
+    def _emit_entities(self, entity_list: List[str]) -> List[Tuple[str, object]]:
+        self._entities = entity_list
+        events = [("entities", entity_list)]
+        events.extend(("triple", triple) for triple in self._pending_triples)
+        self._pending_triples = []
+        return events
+
+
+
+# 打包模式：片段分隔标记，如「【片段1】」
+PACKED_SECTION_PATTERN = re.compile(r'^\s*【片段(\d+)】\s*$')
+
+
+def build_langchain_packed_extract_chain(llm):
+    """
+    打包抽取链：一次请求包含多个带编号的文本片段，指令前言只发送一次
+    输入文本由 format_packed_text 生成，输出由 parse_packed_llm_output 解析
+    """
+    from langchain_core.prompts import PromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    extract_prompt = PromptTemplate(
+        template="""
+        指令：下面有多个带编号的文本片段，请对每个片段分别抽取实体和三元组。
+        严格按照以下格式输出结果，**禁止添加任何思考过程、解释、说明文字**！
+        输出格式（每个片段一段，按编号顺序，片段无内容时实体列表留空）：
+        【片段1】
+        实体列表：实体1,实体2,实体3
+        三元组：
+        实体1|关系|实体2
+        【片段2】
+        实体列表：实体3,实体4
+        三元组：
+        实体3|关系|实体4
+        
+        要求：
+        1. 实体列表仅保留核心名词（如公司、产品、概念），长度≥2，去重；
+        2. 三元组仅保留高置信度直接关系（置信度≥0.75），格式为「实体1|关系|实体2」，无空格；
+        3. 每个片段只抽取该片段内的实体和关系，片段编号必须与输入一致；
+        4. 仅输出上述格式内容，不添加任何额外文字！
+        
+        文本片段：
+        {text}
+        """,
+        input_variables=["text"]
+    )
+    extract_chain = extract_prompt | llm | StrOutputParser()
+    return extract_chain
+
+
+# 精简模式输出的JSON Schema：e 为实体列表，t 为 [实体1, 关系, 实体2] 三元组列表
+LEAN_EXTRACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "e": {"type": "array", "items": {"type": "string"}},
+        "t": {
+            "type": "array",
+            "items": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 3}
+        }
+    },
+    "required": ["e", "t"],
+    "additionalProperties": False
+}
+
+
+def build_langchain_lean_extract_chain(llm, max_tokens: int = 512):
+    """
+    精简抽取链：关闭Qwen3思考过程，约束输出为紧凑JSON（response_format=json_schema），
+    并限制每个文本块的生成token数，输出由 parse_lean_llm_output 解析
+    """
+    from langchain_core.prompts import PromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    extract_prompt = PromptTemplate(
+        template="""/no_think
+抽取文本中的核心实体（长度≥2，去重）和高置信度直接关系，仅输出JSON：{{"e":["实体1","实体2"],"t":[["实体1","关系","实体2"]]}}
+文本：{text}""",
+        input_variables=["text"]
+    )
+    lean_llm = llm.bind(
+        max_tokens=max_tokens,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "entity_extract", "schema": LEAN_EXTRACT_SCHEMA, "strict": True}
+        },
+        # vLLM部署的Qwen3：关闭思考模式
+        extra_body={"chat_template_kwargs": {"enable_thinking": False}}
+    )
+    extract_chain = extract_prompt | lean_llm | StrOutputParser()
+    return extract_chain
+
+
+def parse_lean_llm_output(extract_result: str) -> Tuple[List[str], List[str]]:
+    """
+    严格解析精简模式的JSON输出，格式不符直接抛出ValueError（按抽取失败处理）
+    Returns:
+        (实体列表, 三元组列表)，三元组格式与parse_llm_output一致，为「实体1|关系|实体2」
+    """
+    try:
+        data = json.loads(extract_result)
+        raw_entities, raw_triples = data["e"], data["t"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ValueError(f"精简抽取输出格式错误：{extract_result[:200]}") from e
+    if not isinstance(raw_entities, list) or not isinstance(raw_triples, list):
+        raise ValueError(f"精简抽取输出格式错误（e/t应为数组）：{extract_result[:200]}")
+
+    entity_list = list(dict.fromkeys(
+        e.strip() for e in raw_entities if isinstance(e, str) and len(e.strip()) >= 2
+    ))
+    triples = []
+    for triple in raw_triples:
+        if not isinstance(triple, list) or len(triple) != 3:
+            continue
+        parts = [str(p).strip() for p in triple]
+        if all(len(p) >= 2 for p in parts):
+            triples.append("|".join(parts))
+    return entity_list, list(dict.fromkeys(triples))
+
+
+def build_extract_chain(llm, mode: str = "single", max_tokens: int = 512):
+    """
+    按抽取模式构建抽取链
+    Args:
+        mode: single（每次请求一个文本块）/ packed（每次请求打包多个文本块）/ lean（关闭思考、JSON约束输出）
+        max_tokens: lean模式下每个文本块的生成token上限
+    """
+    if mode == "packed":
+        return build_langchain_packed_extract_chain(llm)
+    if mode == "lean":
+        return build_langchain_lean_extract_chain(llm, max_tokens=max_tokens)
+    return build_langchain_extract_chain(llm)
+
+
+def get_output_parser(mode: str = "single"):
+    """按抽取模式返回单文本块输出的解析函数（packed模式使用parse_packed_llm_output）"""
+    if mode == "lean":
+        return parse_lean_llm_output
+    return parse_llm_output
+
+
+def pack_chunks(chunks: List[str], token_budget: int, max_chunks: int = 8) -> List[List[int]]:
+    """
+    将文本块按token预算分组（中文按1字符≈1token估算），返回每组的文本块下标
+    单个文本块超出预算时单独成组
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for idx, chunk in enumerate(chunks):
+        tokens = len(chunk)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_chunks):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def format_packed_text(chunks: List[str]) -> str:
+    """将多个文本块拼接为带编号分隔的打包输入"""
+    return "\n".join(f"【片段{i}】\n{chunk}" for i, chunk in enumerate(chunks, start=1))
+
+
+def parse_packed_llm_output(extract_result: str, chunk_count: int) -> List[Optional[Tuple[List[str], List[str]]]]:
+    """
+    解析打包抽取的LLM输出，按片段编号将实体列表和三元组映射回对应文本块
+    Returns:
+        list: 长度为chunk_count，第i项为第i个文本块的(实体列表, 三元组列表)，输出中缺失的片段为None
+    """
+    sections: Dict[int, List[str]] = {}
+    current = None
+    for line in extract_result.split("\n"):
+        m = PACKED_SECTION_PATTERN.match(line)
+        if m:
+            current = int(m.group(1))
+            sections.setdefault(current, [])
+            continue
+        if current is not None:
+            sections[current].append(line)
+
+    parsed: List[Optional[Tuple[List[str], List[str]]]] = []
+    for i in range(1, chunk_count + 1):
+        if i in sections:
+            parsed.append(parse_llm_output("\n".join(sections[i])))
+        else:
+            parsed.append(None)
+    return parsed
+
+
 
 # ------------------------------
 # 使用示例
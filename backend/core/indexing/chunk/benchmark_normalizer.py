@@ -0,0 +1,81 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+import io
+import time
+import random
+import argparse
+
+from content_split import remove_toc_lines_basic, remove_special_page_tags_with_info, remove_image
+from normalizer import normalize_markdown, iter_lines
+
+
+def old_chain(text: str) -> str:
+    """原三遍处理链"""
+    return remove_image(remove_special_page_tags_with_info(remove_toc_lines_basic(text)))
+
+
+def make_ocr_markdown(size_mb: float, seed: int = 0) -> str:
+    """生成模拟扫描件OCR转换的markdown：标题、正文、目录行、页码标签、图片链接"""
+    rng = random.Random(seed)
+    body = "第{}条 为了规范地方金融组织及其活动，防范化解金融风险，促进本市金融业健康发展，根据有关法律、行政法规，结合本市实际，制定本条例。"
+    lines = []
+    size = 0
+    target = int(size_mb * 1024 * 1024)
+    page = 1
+    while size < target:
+        r = rng.random()
+        if r < 0.05:
+            line = f"## 第{rng.randint(1, 30)}章 总则"
+        elif r < 0.10:
+            line = f"第{rng.randint(1, 30)}章 总则" + "." * rng.randint(6, 40) + str(rng.randint(1, 300))
+        elif r < 0.15:
+            line = f"<special_page_num_tag>{page}</special_page_num_tag>"
+            page += 1
+        elif r < 0.20:
+            line = f"![](images/{rng.randint(0, 10 ** 8):08x}.jpg)"
+        else:
+            line = body.format(rng.randint(1, 200))
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return "# 地方金融条例\n" + "\n".join(lines) + "\n"
+
+
+def bench(name: str, fn, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    size_mb = len(text.encode("utf-8")) / 1024 / 1024
+    print(f"{name:<28}{best * 1000:>10.1f} ms{size_mb / best:>10.1f} MB/s")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="markdown清洗性能对比：原三遍处理链 vs 单次扫描normalizer")
+    parser.add_argument("files", nargs="*", help="待测markdown文件，未指定时生成模拟OCR文本")
+    parser.add_argument("--size-mb", type=float, default=50, help="模拟文本大小（MB）")
+    parser.add_argument("--repeat", type=int, default=3, help="每种实现的重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    if args.files:
+        texts = []
+        for file_path in args.files:
+            with open(file_path, "r", encoding="utf-8") as f:
+                texts.append((file_path, f.read()))
+    else:
+        texts = [(f"模拟OCR文本 {args.size_mb}MB", make_ocr_markdown(args.size_mb))]
+
+    for name, text in texts:
+        print(f"\n{name}")
+        expected = old_chain(text)
+        assert normalize_markdown(text) == expected, "normalize_markdown 结果与原处理链不一致"
+        assert list(iter_lines(io.StringIO(text))) == expected.splitlines(), "iter_lines 结果与原处理链不一致"
+        old = bench("原处理链", old_chain, text, args.repeat)
+        new = bench("normalize_markdown", normalize_markdown, text, args.repeat)
+        bench("iter_lines（流式）", lambda t: sum(1 for _ in iter_lines(io.StringIO(t))), text, args.repeat)
+        print(f"加速比：{old / new:.2f}x")
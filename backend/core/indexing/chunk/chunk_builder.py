@@ -1,5 +1,5 @@
 # chunk_builder.py
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List
 from segments import Segment
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
@@ -17,13 +17,21 @@ class ChunkBuilder:
             "header_chain": [...], # 该 chunk 的基础 header 链（首段的 header_chain）
         }
         """
-        chunks: List[Dict] = []
+        return list(self.iter_chunks(segments))
+
+    def iter_chunks(self, segments: Iterable[Segment]) -> Iterator[Dict]:
+        """
+        流式构建 chunk：segments 可以是生成器（如 MarkdownParser.iter_segments），
+        只预读一个 segment，结果与 build_chunks 完全相同
+        """
+        it = iter(segments)
+        # 预读的下一个 segment，None 表示已读完
+        pending = next(it, None)
         chunk_id = 0
-        i = 0
-        n = len(segments)
 
-        while i < n:
-            seg = segments[i]
+        while pending is not None:
+            seg = pending
+            pending = next(it, None)
             base_chain = seg.header_chain  # 这个 chunk 的基础 header 链（previous headers + 当前标题）
 
             # 先把基础 header 链写到文本顶部
@@ -48,23 +56,20 @@ class ChunkBuilder:
                     for p in parts:
                         chunk_lines = base_chain + [p]
                         chunk_text = "\n".join(chunk_lines).rstrip("\n")
-                        chunks.append({
+                        yield {
                             "chunk_id": chunk_id,
                             "text": chunk_text,
                             "header_chain": base_chain
-                        })
+                        }
                         chunk_id += 1
-
-                    i += 1
                     continue
 
                 # 否则可以正常塞入当前 chunk
                 lines.append(seg.text)
                 cur_len += len(seg.text) + 1
-            i += 1
             # 尝试继续塞后面的 segments
-            while i < n:
-                next_seg = segments[i]
+            while pending is not None:
+                next_seg = pending
                 # 计算 next_seg 写入时需要增加的 header 行 + 正文长度
 
                 # 计算与 last_chain 的公共前缀长度
@@ -95,14 +100,12 @@ class ChunkBuilder:
 
                 cur_len += extra_total
                 last_chain = next_seg.header_chain
-                i += 1
+                pending = next(it, None)
 
             chunk_text = "\n".join(lines).rstrip("\n")
-            chunks.append({
+            yield {
                 "chunk_id": chunk_id,
                 "text": chunk_text,
                 "header_chain": base_chain
-            })
+            }
             chunk_id += 1
-
-        return chunks
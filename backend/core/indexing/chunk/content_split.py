@@ -13,6 +13,8 @@ sys.path.insert(0, pre_parent_dir)
 
 from markdown_parser import MarkdownParser
 from chunk_builder import ChunkBuilder
+from normalizer import normalize_markdown, iter_lines, DEFAULT_MAX_BUFFER_CHARS
+from typing import Iterator, Optional
 import re
 
 def read_markdown(file_path):
@@ -61,7 +63,8 @@ def remove_special_page_tags_with_info(content: str):
     return result
 
 def content_split_run(text: str, chunk_size: int = 500, chunk_overlap: int = 100):
-    text = remove_image(remove_special_page_tags_with_info(remove_toc_lines_basic(text)))
+    # 单次扫描完成目录行、页码标签、图片链接的清洗（等价于 remove_toc_lines_basic -> remove_special_page_tags_with_info -> remove_image）
+    text = normalize_markdown(text)
 
     parser = MarkdownParser()
     segments = parser.parse_to_segments(text)
@@ -75,9 +78,24 @@ def content_split_run(text: str, chunk_size: int = 500, chunk_overlap: int = 100
 
     return chunks_array
 
+def iter_content_split_file(file_path: str, chunk_size: int = 500, chunk_overlap: int = 100, max_buffer_chars: Optional[int] = DEFAULT_MAX_BUFFER_CHARS) -> Iterator[str]:
+    """
+    流式读取markdown文件并分块：逐行清洗 -> 逐个产出 Segment -> 逐个产出 chunk，
+    内存占用与文件大小无关（单个标题下的正文、未闭合的图片链接不超过 max_buffer_chars），
+    结果与 content_split_run(读取整个文件) 相同
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        parser = MarkdownParser()
+        segments = parser.iter_segments(iter_lines(f, max_buffer_chars), max_segment_chars=max_buffer_chars)
+        builder = ChunkBuilder(max_len=chunk_size)
+        for item in builder.iter_chunks(segments):
+            yield item["text"]
+
+
 def test_run(md_path, output_path):
     text = read_markdown(md_path)
-    text = remove_image(remove_special_page_tags_with_info(remove_toc_lines_basic(text)))
+    # 清洗目录行、页码标签、图片链接
+    text = normalize_markdown(text)
 
     parser = MarkdownParser()
     segments = parser.parse_to_segments(text)
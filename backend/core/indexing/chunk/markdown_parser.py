@@ -1,6 +1,6 @@
 # markdown_parser.py
 import re
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 from segments import Segment
 
 HEADER_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
@@ -12,19 +12,27 @@ class MarkdownParser:
     """
 
     def parse_to_segments(self, text: str) -> List[Segment]:
-        lines = text.splitlines()
+        return list(self.iter_segments(text.splitlines()))
 
+    def iter_segments(self, lines: Iterable[str], max_segment_chars: Optional[int] = None) -> Iterator[Segment]:
+        """
+        流式解析：逐行读取，每遇到新标题产出上一个 Segment
+        lines 为逻辑行（与 text.splitlines() 的结果一致，不含换行符），
+        结果与 parse_to_segments 完全相同
+
+        Args:
+            max_segment_chars: 单个 Segment 正文的缓冲上限（字符数），超过时抛出 ValueError
+        """
         header_chain: List[str] = []  # 当前 header 栈
         current_text_lines: List[str] = []
-        segments: List[Segment] = []
+        current_chars = 0
 
-        def flush_segment():
-            """把当前 header_chain + text_lines 推成一个 Segment"""
-            nonlocal current_text_lines
-            if header_chain:
-                body = "\n".join(current_text_lines).rstrip("\n")
-                segments.append(Segment(header_chain=header_chain.copy(), text=body))
-            current_text_lines = []
+        def make_segment() -> Optional[Segment]:
+            """把当前 header_chain + text_lines 组成一个 Segment"""
+            if not header_chain:
+                return None
+            body = "\n".join(current_text_lines).rstrip("\n")
+            return Segment(header_chain=header_chain.copy(), text=body)
 
         for line in lines:
             m = HEADER_PATTERN.match(line)
@@ -34,8 +42,12 @@ class MarkdownParser:
                 title_text = m.group(2).strip()
                 header = f"{'#' * level} {title_text}"
 
-                # 在遇到新标题前，先把之前的正文段刷新为一个 segment
-                flush_segment()
+                # 在遇到新标题前，先把之前的正文段产出为一个 segment
+                segment = make_segment()
+                if segment is not None:
+                    yield segment
+                current_text_lines = []
+                current_chars = 0
 
                 # 调整 header 栈长度到 level-1，然后压入新 header
                 # 例：遇到 ### 时，header_chain 应为 [#, ##]，再 append ###。
@@ -44,12 +56,18 @@ class MarkdownParser:
                 header_chain.append(header)
 
             else:
-                # 普通正文行
+                # 普通正文行；文首不带标题的内容会被丢弃，无需缓冲
+                if not header_chain:
+                    continue
                 current_text_lines.append(line)
+                current_chars += len(line) + 1
+                if max_segment_chars is not None and current_chars > max_segment_chars:
+                    raise ValueError(f"标题「{header_chain[-1]}」下的正文超过缓冲上限 {max_segment_chars} 字符")
 
         # 处理最后残留的正文
-        flush_segment()
+        segment = make_segment()
+        if segment is not None:
+            yield segment
 
         # 注意：如果文首有不带标题的内容，会被丢弃（因为没有 header_chain）。
         # 你目前的文件是从 # 开始的，不会有问题。
-        return segments
@@ -0,0 +1,92 @@
+# normalizer.py
+import re
+from typing import Iterable, Iterator, Optional
+
+# 流式清洗的缓冲上限（字符数）：未闭合的图片链接超过该长度时报错
+DEFAULT_MAX_BUFFER_CHARS = 8 * 1024 * 1024
+
+# 目录行：以点或空格开头，包含多个点，以数字结尾
+TOC_LINE_PATTERN = re.compile(r'^[\s.]*\.{3,}[\s\d]*\d+\s*$')
+PAGE_TAG_PATTERN = re.compile(r'<special_page_num_tag>\d+</special_page_num_tag>')
+IMAGE_PATTERN = re.compile(r'!\[.*?]\([^)]*\)')
+# 块末尾存在未闭合的图片链接（「![...](」之后没有「)」），需要与后续行合并后再清洗
+UNCLOSED_IMAGE_PATTERN = re.compile(r'!\[.*?]\([^)]*\Z')
+
+# 注：页码标签和图片链接也可以合并为一个「A|B」正则一次扫描，但实测在CPython中
+# 分支正则无法使用字面量前缀快速定位，反而比两个带字面量前缀的正则各扫描一次更慢
+
+
+def is_toc_line(line: str) -> bool:
+    """目录行判断；两种目录行都包含「...」，先做子串预筛选"""
+    return "..." in line and ("......" in line or TOC_LINE_PATTERN.match(line.strip()) is not None)
+
+
+def normalize_markdown(text: str) -> str:
+    """
+    清洗markdown：删除目录行、页码标签替换为换行、删除图片链接
+    结果与 remove_image(remove_special_page_tags_with_info(remove_toc_lines_basic(text))) 相同；
+    目录行只对含「...」的行做正则匹配，不含页码标签/图片链接的文本跳过对应扫描
+    """
+    lines = text.split("\n")
+    kept = [line for line in lines if "..." not in line or not is_toc_line(line)]
+    if len(kept) != len(lines):
+        text = "\n".join(kept)
+    if "<special_page_num_tag>" in text:
+        text = PAGE_TAG_PATTERN.sub("\n", text)
+    if "![" in text:
+        text = IMAGE_PATTERN.sub("", text)
+    return text
+
+
+def _iter_blocks(lines: Iterable[str], max_buffer_chars: Optional[int] = None) -> Iterator[str]:
+    """
+    逐行删除目录行、替换页码标签、删除图片链接，产出清洗后的块（整篇结果 = 各块以换行符连接）
+    图片链接的括号部分可能跨行，遇到未闭合的图片链接时与后续行合并为一个块
+    """
+    pending = None
+    for line in lines:
+        if "..." in line and is_toc_line(line):
+            continue
+        if "<special_page_num_tag>" in line:
+            line = PAGE_TAG_PATTERN.sub("\n", line)
+        block = line if pending is None else pending + "\n" + line
+        if "![" not in block:
+            yield block
+            continue
+        if UNCLOSED_IMAGE_PATTERN.search(block):
+            if max_buffer_chars is not None and len(block) > max_buffer_chars:
+                raise ValueError(f"未闭合的图片链接超过缓冲上限 {max_buffer_chars} 字符")
+            pending = block
+            continue
+        pending = None
+        yield IMAGE_PATTERN.sub("", block)
+    if pending is not None:
+        yield IMAGE_PATTERN.sub("", pending)
+
+
+def iter_lines(lines: Iterable[str], max_buffer_chars: Optional[int] = DEFAULT_MAX_BUFFER_CHARS) -> Iterator[str]:
+    """
+    流式清洗：输入物理行（如文件对象，可带行尾换行符），产出清洗后的逻辑行，
+    结果与 normalize_markdown(整篇文本).splitlines() 相同，可直接传给 MarkdownParser.iter_segments
+
+    Args:
+        max_buffer_chars: 未闭合图片链接的缓冲上限，超过时抛出 ValueError
+    """
+    # 整篇结果 = 各块以换行符连接，因此每个块的行尾换行要等到后续还有块时才输出
+    prev = None
+    for block in _iter_blocks(_iter_physical_lines(lines), max_buffer_chars):
+        if prev is not None:
+            yield from (prev + "\n").splitlines()
+        prev = block
+    if prev is not None:
+        yield from prev.splitlines()
+
+
+def _iter_physical_lines(lines: Iterable[str]) -> Iterator[str]:
+    """去掉行尾换行符；以换行符结尾的文本额外产出一个空行，与 text.split('\\n') 一致"""
+    ends_with_newline = True
+    for raw_line in lines:
+        ends_with_newline = raw_line.endswith("\n")
+        yield raw_line[:-1] if ends_with_newline else raw_line
+    if ends_with_newline:
+        yield ""
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_EXTRACT_CACHE_PATH = "./data/extract_cache.db"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_chain_prompt_hash(extract_chain) -> str:
+    """
+    获取抽取链提示词模板的哈希（prompt | llm | parser 结构中第一个环节的template）
+    """
+    template = getattr(getattr(extract_chain, "first", None), "template", "")
+    return text_hash(template)
+
+
+class ExtractCache:
+    """
+    实体抽取结果的本地持久化缓存（SQLite）
+    缓存键 = (文本块内容哈希, 提示词模板哈希, LLM模型名)，缓存值为解析后的实体列表和三元组
+    """
+
+    def __init__(self, path: str = DEFAULT_EXTRACT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS extract_cache (
+            cache_key TEXT PRIMARY KEY,
+            entities TEXT NOT NULL,
+            triples TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """)
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(chunk: str, prompt_hash: str, model: str) -> str:
+        return text_hash(f"{model}\x1f{prompt_hash}\x1f{text_hash(chunk)}")
+
+    def get(self, key: str) -> Optional[Tuple[List[str], List[str]]]:
+        """查询缓存，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT entities, triples FROM extract_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key: str, entity_list: List[str], triples: List[str]) -> None:
+        """写入缓存（已存在则覆盖）"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extract_cache (cache_key, entities, triples, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entity_list, ensure_ascii=False), json.dumps(triples, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """进程启动以来的累计命中统计（所有文档、所有入库任务）"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def view(self) -> "ExtractCacheView":
+        """创建单独计数的缓存视图，用于统计单个文档（单次入库）的命中情况"""
+        return ExtractCacheView(self)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ExtractCacheView:
+    """
+    共享抽取缓存的计数视图：读写委托给ExtractCache，命中/未命中只统计经由本视图的查询，
+    并发入库的其他文档不影响本视图的统计
+    """
+
+    def __init__(self, cache: ExtractCache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[List[str], List[str]]]:
+        result = self.cache.get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key: str, entity_list: List[str], triples: List[str]) -> None:
+        self.cache.put(key, entity_list, triples)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# 同一缓存文件在进程内只打开一个连接
+_extract_caches: Dict[str, ExtractCache] = {}
+_extract_caches_lock = threading.Lock()
+
+
+def get_extract_cache(path: str = DEFAULT_EXTRACT_CACHE_PATH) -> ExtractCache:
+    key = os.path.abspath(path)
+    with _extract_caches_lock:
+        if key not in _extract_caches:
+            _extract_caches[key] = ExtractCache(path)
+        return _extract_caches[key]
@@ -1,3 +1,19 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+pre_parent_dir = os.path.dirname(parent_dir)
+sys.path.insert(0, current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, pre_parent_dir)
+
+import time
+import queue
+import atexit
+import asyncio
+import threading
+from concurrent.futures import Future
 import numpy as np
 import networkx as nx
 import requests
@@ -6,6 +22,7 @@ from dataclasses import dataclass
 import torch
 from sentence_transformers import SentenceTransformer
 from abc import ABC, abstractmethod
+from core.tools.embed_cache import EmbeddingCache, get_embed_cache, DEFAULT_EMBED_CACHE_MAX_BYTES
 
 # -------------------------- 模型配置常量（可扩展） --------------------------
 # 内置支持的模型配置，key为model_name，value包含默认参数
@@ -184,6 +201,233 @@ class RemoteEmbedModel(BaseEmbedModel):
     def get_embedding_dim(self) -> int:
         return self.embedding_dim
 
+# -------------------------- 动态微批适配器 --------------------------
+@dataclass
+class _EncodeRequest:
+    texts: List[str]
+    kwargs: Dict
+    future: Future
+
+
+class MicroBatchEmbedModel(BaseEmbedModel):
+    """
+    动态微批推理前端：并发的encode请求先进入队列，后台线程最多等待max_wait_ms或凑满max_batch_texts个文本后
+    合并为一次推理，结果按请求拆分返回
+    - 推理参数（归一化、提示词等）不同的请求分组推理
+    - 合并后的文本按长度排序，按batch_size分桶推理，相近长度的文本同批，减少padding浪费的计算
+    """
+    # 不影响向量结果的参数，不参与分组
+    _IGNORED_KWARGS = ("batch_size", "show_progress_bar")
+
+    def __init__(self, embed_model: BaseEmbedModel, max_batch_texts: int = 64, max_wait_ms: float = 5, batch_size: int = 32):
+        """
+        :param embed_model: 内层模型（通常为LocalEmbedModel）
+        :param max_batch_texts: 一次合并推理的文本数上限
+        :param max_wait_ms: 收到第一个请求后等待更多请求的最长时间（毫秒）
+        :param batch_size: 合并后每个长度分桶的文本数
+        """
+        super().__init__(embed_model.model_name)
+        self.embed_model = embed_model
+        self.embedding_dim = embed_model.get_embedding_dim()
+        self.max_batch_texts = max(max_batch_texts, 1)
+        self.max_wait = max(max_wait_ms, 0) / 1000
+        self.batch_size = max(batch_size, 1)
+        self._queue: "queue.Queue[Optional[_EncodeRequest]]" = queue.Queue()
+        # submit与close互斥：关闭后不再有请求排在停止标记之后
+        self._state_lock = threading.Lock()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.request_count = 0
+        self.batch_count = 0
+        self.text_count = 0
+        self._worker = threading.Thread(target=self._run, name=f"micro-batch-{self.model_name}", daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """提交到微批队列并等待结果"""
+        return self.submit(texts, **kwargs).result()
+
+    async def aencode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """异步版本：等待结果时不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(texts, **kwargs))
+
+    def submit(self, texts: List[str], **kwargs) -> Future:
+        """提交encode请求，返回结果Future"""
+        future = Future()
+        with self._state_lock:
+            if self._closed or not self._worker.is_alive():
+                raise RuntimeError("微批推理线程已停止")
+            self._queue.put(_EncodeRequest(texts=list(texts), kwargs=kwargs, future=future))
+        return future
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        finally:
+            # 后台线程退出后仍在队列中的请求直接失败，避免调用方永久等待
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None and not request.future.done():
+                    request.future.set_exception(RuntimeError("微批推理线程已停止"))
+
+    def _serve(self) -> None:
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            requests_batch = [request]
+            text_count = len(request.texts)
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            # 凑批：直到文本数达到上限或等待超时
+            while text_count < self.max_batch_texts:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                requests_batch.append(request)
+                text_count += len(request.texts)
+
+            groups: Dict[Tuple, List[_EncodeRequest]] = {}
+            for request in requests_batch:
+                key = tuple(sorted((k, repr(v)) for k, v in request.kwargs.items() if k not in self._IGNORED_KWARGS))
+                groups.setdefault(key, []).append(request)
+            for group in groups.values():
+                self._encode_group(group)
+            with self._stats_lock:
+                self.request_count += len(requests_batch)
+                self.batch_count += 1
+                self.text_count += text_count
+            if stop:
+                return
+
+    def _encode_group(self, group: List[_EncodeRequest]) -> None:
+        texts = [text for request in group for text in request.texts]
+        kwargs = {k: v for k, v in group[0].kwargs.items() if k not in self._IGNORED_KWARGS}
+        try:
+            embeddings = None
+            # 按长度排序分桶推理，再按原顺序写回
+            order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+            for start in range(0, len(order), self.batch_size):
+                bucket = order[start:start + self.batch_size]
+                bucket_embeddings = np.asarray(self.embed_model.encode(
+                    [texts[idx] for idx in bucket],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                    **kwargs
+                ))
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), bucket_embeddings.shape[1]), dtype=bucket_embeddings.dtype)
+                embeddings[bucket] = bucket_embeddings
+            if embeddings is None:
+                embeddings = np.empty((0, self.embedding_dim), dtype=np.float32)
+        except Exception as e:
+            for request in group:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for request in group:
+            request.future.set_result(embeddings[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return {
+                "requests": self.request_count,
+                "batches": self.batch_count,
+                "avg_batch_texts": round(self.text_count / self.batch_count, 2) if self.batch_count else 0.0,
+                "avg_requests_per_batch": round(self.request_count / self.batch_count, 2) if self.batch_count else 0.0
+            }
+
+    def close(self) -> None:
+        """处理完队列中已提交的请求后停止后台线程，之后的submit直接报错"""
+        with self._state_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._worker.join()
+
+    def get_embedding_dim(self) -> int:
+        return self.embedding_dim
+
+# 进程级微批推理前端，按配置共享：并发的build_graph调用共用同一后台线程才能合并推理，
+# 模型只加载一次，进程退出时关闭后台线程
+_micro_batch_models: Dict[Tuple, MicroBatchEmbedModel] = {}
+_micro_batch_lock = threading.Lock()
+
+
+def get_micro_batch_model(
+    model_name: str,
+    model_path: Optional[str] = None,
+    device: str = "auto",
+    max_batch_texts: int = 64,
+    max_wait_ms: float = 5,
+    batch_size: int = 32
+) -> MicroBatchEmbedModel:
+    """获取（首次调用时加载本地模型并创建）共享的微批推理前端"""
+    key = (model_name, model_path, device, max_batch_texts, max_wait_ms, batch_size)
+    with _micro_batch_lock:
+        if key not in _micro_batch_models:
+            model = LocalEmbedModel(model_name=model_name, model_path=model_path, device=device)
+            _micro_batch_models[key] = MicroBatchEmbedModel(model, max_batch_texts=max_batch_texts, max_wait_ms=max_wait_ms, batch_size=batch_size)
+        return _micro_batch_models[key]
+
+
+def close_micro_batch_models() -> None:
+    """关闭所有共享的微批推理前端（处理完已提交的请求后停止后台线程）"""
+    with _micro_batch_lock:
+        models = list(_micro_batch_models.values())
+        _micro_batch_models.clear()
+    for model in models:
+        model.close()
+
+
+atexit.register(close_micro_batch_models)
+
+# -------------------------- 缓存适配器 --------------------------
+class CachedEmbedModel(BaseEmbedModel):
+    """带embedding磁盘缓存的模型包装：已缓存的文本直接读取向量，未命中的文本去重后交给内层模型"""
+    def __init__(self, embed_model: BaseEmbedModel, cache: EmbeddingCache, deploy_type: str = "local"):
+        """
+        :param embed_model: 内层模型
+        :param cache: embedding缓存
+        :param deploy_type: 部署类型（local/remote），同名模型的本地与远程部署分别缓存
+        """
+        super().__init__(embed_model.model_name)
+        self.embed_model = embed_model
+        self.cache = cache
+        self.embedding_dim = embed_model.get_embedding_dim()
+        # 模型来源（本地模型路径或远程API地址）
+        inner = embed_model
+        while isinstance(inner, MicroBatchEmbedModel):
+            inner = inner.embed_model
+        source = getattr(inner, "model_path", None) or getattr(inner, "api_url", None) or ""
+        self.cache_identity = f"deploy={deploy_type};model={self.model_name};source={source}"
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """生成嵌入向量：部署方式、模型来源、归一化和提示词（含默认提示词）影响向量结果，作为缓存键的一部分"""
+        normalize = kwargs.get("normalize", self.builtin_config.get("normalize", True))
+        prompt = kwargs.get("prompt_name", self.builtin_config.get("default_prompt", ""))
+        normalization = f"{self.cache_identity};normalize={normalize};prompt={prompt}"
+        return self.cache.get_or_compute(
+            list(texts),
+            self.model_name,
+            normalization,
+            lambda miss_texts: self.embed_model.encode(miss_texts, **kwargs)
+        )
+
+    def get_embedding_dim(self) -> int:
+        return self.embedding_dim
+
 # -------------------------- 模型工厂（核心：动态适配） --------------------------
 class EmbedModelFactory:
     """模型工厂：根据model_name和配置动态创建对应模型实例"""
@@ -198,7 +442,8 @@ class EmbedModelFactory:
         :param model_name: 模型名称（如bge-m3、bge-large-zh-v1.5）
         :param deploy_type: 部署类型（local/remote）
         :param kwargs: 其他参数
-            - local模式：model_path（可选）、device（可选）
+            - local模式：model_path（可选）、device（可选）、
+              micro_batch（可选，启用动态微批）、micro_batch_max_texts、micro_batch_wait_ms、batch_size
             - remote模式：api_url（必填）、api_key（可选）、embedding_dim（可选）
         :return: 统一的嵌入模型实例
         """
@@ -208,6 +453,16 @@ class EmbedModelFactory:
         
         # 创建对应模型
         if deploy_type == "local":
+            if kwargs.get("micro_batch"):
+                # 并发调用时合并为一次推理：同一配置在进程内共享一个实例
+                return get_micro_batch_model(
+                    model_name=model_name,
+                    model_path=kwargs.get("model_path"),
+                    device=kwargs.get("device", "auto"),
+                    max_batch_texts=kwargs.get("micro_batch_max_texts", 64),
+                    max_wait_ms=kwargs.get("micro_batch_wait_ms", 5),
+                    batch_size=kwargs.get("batch_size", 32)
+                )
             return LocalEmbedModel(
                 model_name=model_name,
                 model_path=kwargs.get("model_path"),
@@ -284,6 +539,8 @@ def build_graph(
     :param model_name: 嵌入模型名称（如bge-m3、bge-large-zh-v1.5）
     :param deploy_config: 部署配置
         - type: local/remote
+        - cache_path（可选）：embedding磁盘缓存目录，指定时复用已缓存的节点嵌入
+        - cache_max_bytes（可选）：缓存容量上限
         - 其他参数：根据部署类型不同，见EmbedModelFactory
     :return: 构建好的图对象
     """
@@ -306,6 +563,9 @@ def build_graph(
         deploy_type=deploy_type,
         **deploy_config
     )
+    if deploy_config.get("cache_path"):
+        cache = get_embed_cache(deploy_config["cache_path"], max_bytes=deploy_config.get("cache_max_bytes", DEFAULT_EMBED_CACHE_MAX_BYTES))
+        embed_model = CachedEmbedModel(embed_model, cache, deploy_type=deploy_type)
 
     # 3. 生成节点嵌入
     node_names = [graph.graph.nodes[node_id]["name"] for node_id in graph.node_ids]
@@ -316,6 +576,9 @@ def build_graph(
         normalize=deploy_config.get("normalize", True)
     )
 
+    if isinstance(embed_model, CachedEmbedModel):
+        print(f"embedding缓存统计：{embed_model.cache.stats()}")
+
     # 4. 设置嵌入并返回
     graph.set_node_embeddings(embeddings)
     print(f"图构建完成：节点数={len(graph.node_ids)}, 边数={graph.graph.number_of_edges()}, 嵌入维度={graph.embedding_dim}")
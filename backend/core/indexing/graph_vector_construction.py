@@ -11,155 +11,193 @@ sys.path.insert(0, current_dir)
 sys.path.insert(0, parent_dir)
 sys.path.insert(0, pre_parent_dir)
 
-from typing import List
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import hashlib
 import uuid
-from chunking import kps_text_splitter
 from config import Settings
-from langchain_milvus import Milvus
-from langchain_community.graphs import Neo4jGraph
-from core.tools.init_llm import get_llm
-from core.tools.init_embed import get_embedding
-from core.tools.init_vector_db import get_vector_db
-from core.tools.init_graph_db import get_graph_db
-from core.indexing.build_entity_extract_chain import build_langchain_extract_chain, parse_llm_output
-
-def build_vector(chunk: str, chunk_id: str, vector_db: Milvus,file_params:dict) -> None:
+from core.indexing.build_entity_extract_chain import parse_llm_output, pack_chunks, format_packed_text, parse_packed_llm_output, StreamingExtractParser
+from core.indexing.graph_writer import GraphBatchWriter
+from core.indexing.extract_cache import ExtractCache, get_chain_prompt_hash
+
+def extract_chunks(extract_chain, chunks: List[str], max_concurrency: int = 16, cache: Optional[ExtractCache] = None, model_name: str = "", pack_token_budget: int = 0, pack_max_chunks: int = 8, parse_fn: Callable[[str], Tuple[List[str], List[str]]] = parse_llm_output) -> List[Optional[Tuple[List[str], List[str]]]]:
     """
-    从文本块中提取实体关系并构建知识图谱向量
+    并发调用抽取链，提取多个文本块的实体和三元组
     Args:
+        extract_chain: 实体关系抽取链
         chunks: 文本块列表
-        vector_db: 向量数据库实例
+        max_concurrency: 最大并发请求数
+        cache: 抽取结果缓存，命中的文本块不再请求LLM
+        model_name: LLM模型名（缓存键的一部分）
+        pack_token_budget: 大于0时启用打包模式（需配合打包抽取链），每次请求打包不超过该token预算的多个文本块
+        pack_max_chunks: 打包模式下每次请求最多包含的文本块数
+        parse_fn: 单文本块输出的解析函数（见 get_output_parser）
     Returns:
-        None
+        list: 与chunks顺序一一对应的(实体列表, 三元组列表)，抽取失败的文本块为None
     """
-    metadata = {
-        "file_tag1": file_params.get("file_tag1", ""), 
-        "file_tag2": file_params.get("file_tag2", "")
-    }
-    metadatas = [metadata]
-    vector_db.add_texts(texts=[chunk], ids=[chunk_id], metadatas=metadatas)
-
-def build_graph(settings: Settings,graph: Neo4jGraph, chunk: str, chunk_id: str,extract_chain) -> None:
+    results, keys, pending = _lookup_extract_cache(extract_chain, chunks, cache, model_name)
+    if pending:
+        requests = _build_extract_requests(chunks, pending, pack_token_budget, pack_max_chunks)
+        inputs = [{"text": text} for indices, text in requests]
+        raw_results = extract_chain.batch(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+        _fill_extract_results(results, requests, raw_results, cache, keys, packed=pack_token_budget > 0, parse_fn=parse_fn)
+    return results
+
+
+async def astream_extract_to_graph(extract_chain, chunks: List[str], chunk_ids: List[str], graph_writer: GraphBatchWriter, max_concurrency: int = 16, cache: Optional[ExtractCache] = None, model_name: str = "") -> List[Optional[Tuple[List[str], List[str]]]]:
     """
-    从文本块中提取实体关系并构建知识图谱向量
+    流式实体抽取并写入图数据库：消费抽取链的astream输出，每解析完一行即送入graph_writer的写入批次，
+    批次写满时的flush在线程中执行，与其余文本块的LLM解码重叠
+    仅适用于single模式的抽取链（输出为逐行的实体列表和三元组）
     Args:
         chunks: 文本块列表
-        vector_db: 向量数据库实例
+        chunk_ids: 与chunks一一对应的文本块ID
+        graph_writer: 图数据库批量写入器（调用方负责最终flush）
+        max_concurrency: 最大并发流式请求数
+        cache: 抽取结果缓存，命中的文本块直接写入，未命中的文本块完成后写入缓存
+        model_name: LLM模型名（缓存键的一部分）
     Returns:
-        None
+        list: 与chunks顺序一一对应的(实体列表, 三元组列表)，抽取失败的文本块为None
     """
-    extract_result = extract_chain.invoke({"text": chunk}).strip()
-
-    # # 解析实体列表
-    # entity_list_line = [line for line in extract_result.split("\n") if "实体列表：" in line][0]
-    # entity_list = [e.strip() for e in entity_list_line.replace("实体列表：", "").split(",") if e.strip()]
-    # # 解析三元组
-    # triples = [
-    #     line.strip() for line in extract_result.split("\n") 
-    #     if "|" in line and not line.startswith("实体列表：")
-    # ]
-
-    entity_list, triples = parse_llm_output(extract_result)
-    # 知识库标签，区分不同知识库
-    biz_label = settings.graph_store.biz_label
-    # 3.3 图数据库入库 - 创建Chunk节点（文本块→实体）
-    graph.query(f"""
-    MERGE (c:Chunk {{chunk_id: $chunk_id}})
-    SET c.content = $content, c.entities = $entities
-    SET c:{biz_label};
-    """, params={
-        "chunk_id": chunk_id,
-        "content": chunk[:20] + "...",
-        "entities": entity_list
-    })
-
-    # 图数据库入库 - 创建Entity节点 (实体->文本块)
-    for entity_name in entity_list:
-        # 实体→文本块：更新Entity的chunk_ids（去重）
-        # graph.query("""
-        # MERGE (e:Entity {name: $entity_name})
-        # SET e.chunk_ids = apoc.coll.addUnique(coalesce(e.chunk_ids, []), $chunk_id);
-        # """, params={"entity_name": entity_name, "chunk_id": chunk_id})
-        # add_unique_chunk_id(graph, entity_name, chunk_id)
-        query = f"""
-        MERGE (e:Entity {{name: $entity_name}})
-        SET e:{biz_label}
-        SET e.chunk_ids = CASE 
-            WHEN e.chunk_ids IS NULL THEN [$chunk_id]
-            WHEN NOT $chunk_id IN e.chunk_ids THEN e.chunk_ids + $chunk_id
-            ELSE e.chunk_ids
-        END
-        RETURN e
-        """
-        graph.query(query, params={"entity_name": entity_name, "chunk_id": chunk_id})
-
-    # 图数据库入库 - 文本块→实体：创建CONTAINS关系
-    for entity_name in entity_list: 
-        graph.query("""
-        MATCH (c:Chunk {chunk_id: $chunk_id}), (e:Entity {name: $entity_name})
-        MERGE (c)-[:CONTAINS]->(e);
-        """, params={"chunk_id": chunk_id, "entity_name": entity_name})
-        print(f"创建[文本块→实体]CONTAINS关系：{chunk_id} -> {entity_name}")
-
-    # 图数据库入库 - 实体->实体: 实体间关系（RELATION）
-    for triple in triples:
-        if len(triple.split("|")) != 3:
+    results, keys, pending = _lookup_extract_cache(extract_chain, chunks, cache, model_name)
+    for idx, result in enumerate(results):
+        if result is not None:
+            await asyncio.to_thread(graph_writer.add, chunks[idx], chunk_ids[idx], result[0], result[1])
+
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+    async def stream_one(idx: int) -> None:
+        chunk, chunk_id = chunks[idx], chunk_ids[idx]
+        parser = StreamingExtractParser()
+
+        async def handle(events) -> None:
+            for kind, value in events:
+                if kind == "entities":
+                    # 可能触发flush（图数据库I/O），放到线程中执行，不阻塞其他流的解码
+                    await asyncio.to_thread(graph_writer.add_chunk, chunk, chunk_id, value)
+                else:
+                    graph_writer.add_triples([value])
+
+        async with semaphore:
+            try:
+                async for token in extract_chain.astream({"text": chunk}):
+                    await handle(parser.feed(token))
+                await handle(parser.close())
+            except Exception as e:
+                # 已进入批次的部分记录照常写入（MERGE幂等），该文本块记为失败以便重试
+                print(f"文本块{idx}流式实体抽取失败：{e.__class__.__name__} - {e}")
+                return
+        results[idx] = parser.result()
+        if cache is not None and _is_cacheable(results[idx]):
+            cache.put(keys[idx], results[idx][0], results[idx][1])
+
+    await asyncio.gather(*(stream_one(idx) for idx in pending))
+    return results
+
+
+def _lookup_extract_cache(extract_chain, chunks: List[str], cache: Optional[ExtractCache], model_name: str):
+    """查询抽取缓存，返回(结果列表, 缓存键列表, 未命中的文本块下标)"""
+    results: List[Optional[Tuple[List[str], List[str]]]] = [None] * len(chunks)
+    if cache is None:
+        return results, [], list(range(len(chunks)))
+    prompt_hash = get_chain_prompt_hash(extract_chain)
+    keys = [ExtractCache.make_key(chunk, prompt_hash, model_name) for chunk in chunks]
+    pending = []
+    for idx, key in enumerate(keys):
+        results[idx] = cache.get(key)
+        if results[idx] is None:
+            pending.append(idx)
+    return results, keys, pending
+
+
+def _build_extract_requests(chunks: List[str], pending: List[int], pack_token_budget: int, pack_max_chunks: int) -> List[Tuple[List[int], str]]:
+    """构造抽取请求，返回(请求包含的文本块下标, 请求文本)列表"""
+    if pack_token_budget <= 0:
+        return [([idx], chunks[idx]) for idx in pending]
+    groups = pack_chunks([chunks[idx] for idx in pending], pack_token_budget, pack_max_chunks)
+    requests = []
+    for group in groups:
+        indices = [pending[i] for i in group]
+        requests.append((indices, format_packed_text([chunks[idx] for idx in indices])))
+    print(f"打包抽取：{len(pending)}个文本块合并为{len(requests)}次请求")
+    return requests
+
+
+def _fill_extract_results(results: list, requests: List[Tuple[List[int], str]], raw_results: list, cache: Optional[ExtractCache], keys: List[str], packed: bool = False, parse_fn: Callable = parse_llm_output) -> None:
+    """解析批量抽取结果并写入缓存，单个请求失败不影响其余文本块"""
+    for (indices, text), result in zip(requests, raw_results):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            if packed:
+                parsed = parse_packed_llm_output(result.strip(), len(indices))
+            else:
+                parsed = [parse_fn(result.strip())]
+        except Exception as e:
+            print(f"文本块{indices}实体抽取失败：{e.__class__.__name__} - {e}")
             continue
-        e1, rel, e2 = triple.split("|")
-        e1, rel, e2 = e1.strip(), rel.strip(), e2.strip()
-        if not e1 or not rel or not e2:
-            continue
-        # 入库实体关系
-        graph.query("""
-        MATCH (a:Entity {name: $e1}), (b:Entity {name: $e2})
-        MERGE (a)-[r:RELATION {name: $rel}]->(b);
-        """, params={"e1": e1, "rel": rel, "e2": e2})
-        print(f"创建[实体→实体]RELATION关系：{e1} -> {rel} -> {e2}")
+        for idx, item in zip(indices, parsed):
+            if item is None:
+                print(f"文本块{idx}在打包抽取输出中缺失")
+                continue
+            results[idx] = item
+            if cache is not None and _is_cacheable(item):
+                cache.put(keys[idx], item[0], item[1])
+
+
+def _is_cacheable(result: Tuple[List[str], List[str]]) -> bool:
+    """
+    抽取结果是否写入缓存：实体和三元组都为空的结果（多为截断或无法解析的LLM输出）不缓存，重新入库时再次抽取
+    """
+    entity_list, triples = result
+    return bool(entity_list or triples)
 
 
-# def add_unique_chunk_id(graph, entity_name, chunk_id):
-#     query = """
-#         MERGE (e:Entity {name: $entity_name})
-#         SET e.chunk_ids = CASE 
-#             WHEN e.chunk_ids IS NULL THEN [$chunk_id]
-#             WHEN NOT $chunk_id IN e.chunk_ids THEN e.chunk_ids + $chunk_id
-#             ELSE e.chunk_ids
-#         END
-#         RETURN e
-#     """
-#     return graph.query(query, params={"entity_name": entity_name, "chunk_id": chunk_id})
+# 文本块ID命名空间：相同知识库、相同文档、相同内容的文本块始终得到相同ID
+CHUNK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "graph-rag/chunk")
 
 
+def make_chunk_id(kb_name: str, doc_id: str, chunk: str) -> str:
+    """
+    根据知识库、来源文档和文本块内容哈希生成确定性的文本块ID（UUID格式，兼容已有ID）
+    """
+    chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{kb_name}\x1f{doc_id}\x1f{chunk_hash}"))
 
 
-def build_graph2vector(settings: Settings,chunks: List[str], vector_db, graph_db, extract_chain,file_params:dict)-> None:
-    for chunk in chunks:
-        # 生成唯一Chunk ID（跨库关联键）
-        chunk_id = str(uuid.uuid4())
-        print(f"处理文本块ID: {chunk_id}")
-        print(f"处理文本块标签: ",file_params)
-        # 向量库入库
-        build_vector(chunk=chunk, chunk_id=chunk_id, vector_db=vector_db, file_params=file_params) 
-        # 图数据库入库
-        build_graph(settings=settings,graph=graph_db, chunk=chunk, chunk_id=chunk_id,extract_chain=extract_chain)
+def delete_chunks(settings: Settings, vector_db, graph_db, chunk_ids: List[str]) -> None:
+    """
+    从向量库和图数据库删除文本块，并清理不再被任何文本块包含的实体
+    """
+    if not chunk_ids:
+        return
+    vector_db.delete(ids=chunk_ids)
+    biz_label = settings.graph_store.biz_label
+    graph_db.query(f"""
+    MATCH (c:Chunk:{biz_label})
+    WHERE c.chunk_id IN $chunk_ids
+    OPTIONAL MATCH (c)-[:CONTAINS]->(e:Entity)
+    WITH collect(DISTINCT c) AS chunks, collect(DISTINCT e) AS entities
+    FOREACH (c IN chunks | DETACH DELETE c)
+    WITH entities
+    UNWIND entities AS e
+    WITH e WHERE NOT (e)<-[:CONTAINS]-(:Chunk)
+    DETACH DELETE e
+    """, params={"chunk_ids": chunk_ids})
+    print(f"已删除{len(chunk_ids)}个文本块：{chunk_ids}")
 
 
 # ------------------------------
 # 测试示例
 # ------------------------------
 if __name__ == "__main__":
-    settings = Settings()
-    embeddings = get_embedding(settings)
-    vector_db = get_vector_db(settings,embeddings)
-    graph_db = get_graph_db(settings)
+    from service.index_service import IndexService
 
-    llm = get_llm(settings)
-    extract_chain = build_langchain_extract_chain(llm)
+    settings = Settings()
+    index_service = IndexService(settings)
 
-    # 1. 读取文档内容（替换为实际文档文本）
-    with open("./temp/出口食品检验检疫240523.txt", "r", encoding="utf-8") as f:
+    # 读取文档内容（替换为实际文档文本），通过入库流水线分块、向量化/实体抽取并写入向量库和图数据库
+    file_path = "./temp/出口食品检验检疫240523.txt"
+    with open(file_path, "r", encoding="utf-8") as f:
         doc_content = f.read()
-    
-    # 2. 拆分文档为文本块
-    chunks = kps_text_splitter(doc_content, chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
-    build_graph2vector(settings=settings,chunks=chunks, vector_db=vector_db, graph_db=graph_db, extract_chain=extract_chain)
+    index_service.process_text(doc_content, doc_id=os.path.basename(file_path))
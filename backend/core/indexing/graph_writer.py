@@ -0,0 +1,158 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+pre_parent_dir = os.path.dirname(parent_dir)
+sys.path.insert(0, current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, pre_parent_dir)
+
+import threading
+from typing import List, Dict, Optional, Tuple
+from langchain_community.graphs import Neo4jGraph
+
+
+def split_triple(triple: str) -> Optional[Tuple[str, str, str]]:
+    """
+    将「实体1|关系|实体2」格式的三元组拆分为(实体1, 关系, 实体2)，格式错误返回None
+    """
+    parts = triple.split("|")
+    if len(parts) != 3:
+        return None
+    e1, rel, e2 = parts[0].strip(), parts[1].strip(), parts[2].strip()
+    if not e1 or not rel or not e2:
+        return None
+    return e1, rel, e2
+
+
+class GraphBatchWriter:
+    """
+    图数据库批量写入器：
+    累积多个文本块的Chunk/Entity/三元组记录，达到batch_size个文本块后
+    通过少量 UNWIND $rows 语句在一个事务内批量写入，替代逐实体的Cypher往返
+    """
+
+    def __init__(self, graph: Neo4jGraph, biz_label: str, batch_size: int = 50):
+        """
+        Args:
+            graph: Neo4jGraph实例
+            biz_label: 知识库标签，区分不同知识库
+            batch_size: 每次flush包含的文本块数量
+        """
+        self.graph = graph
+        self.biz_label = biz_label
+        self.batch_size = max(batch_size, 1)
+        self._lock = threading.Lock()
+        # 多线程同时flush时串行写入，保证批次按累积顺序提交
+        self._flush_lock = threading.Lock()
+        self._chunk_rows: List[Dict] = []
+        self._entity_rows: List[Dict] = []
+        self._triple_rows: List[Dict] = []
+
+    def add(self, chunk: str, chunk_id: str, entity_list: List[str], triples: List[str]) -> None:
+        """
+        添加一个文本块的抽取结果，累积的文本块数达到batch_size时自动flush
+        """
+        with self._lock:
+            self._append_chunk(chunk, chunk_id, entity_list)
+            self._append_triples(triples)
+            should_flush = len(self._chunk_rows) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def add_chunk(self, chunk: str, chunk_id: str, entity_list: List[str]) -> None:
+        """
+        流式写入：先添加文本块及其实体，三元组随后通过add_triples逐条追加
+        累积的文本块数达到batch_size时自动flush
+        """
+        with self._lock:
+            self._append_chunk(chunk, chunk_id, entity_list)
+            should_flush = len(self._chunk_rows) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def add_triples(self, triples: List[str]) -> None:
+        """
+        流式写入：追加三元组（不触发flush）
+        需在对应文本块的add_chunk之后调用；flush按顺序串行执行，
+        三元组所在批次写入时，其实体已在同一事务或更早的事务中写入
+        """
+        with self._lock:
+            self._append_triples(triples)
+
+    def _append_chunk(self, chunk: str, chunk_id: str, entity_list: List[str]) -> None:
+        self._chunk_rows.append({
+            "chunk_id": chunk_id,
+            "content": chunk[:20] + "...",
+            "entities": entity_list
+        })
+        self._entity_rows.extend({"name": name, "chunk_id": chunk_id} for name in entity_list)
+
+    def _append_triples(self, triples: List[str]) -> None:
+        for triple in triples:
+            parts = split_triple(triple)
+            if parts:
+                self._triple_rows.append({"e1": parts[0], "rel": parts[1], "e2": parts[2]})
+
+    def pending(self) -> int:
+        """未写入的文本块数量"""
+        with self._lock:
+            return len(self._chunk_rows)
+
+    def flush(self) -> int:
+        """
+        将累积的记录在一个事务内写入图数据库
+        写入失败时记录放回缓冲区（排在期间新加入的记录之前）并抛出异常，由下一次flush重新写入，
+        不会丢失同一批次中其他文本块的记录
+        Returns:
+            int: 本次写入的文本块数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                chunk_rows, entity_rows, triple_rows = self._chunk_rows, self._entity_rows, self._triple_rows
+                self._chunk_rows, self._entity_rows, self._triple_rows = [], [], []
+            if not chunk_rows and not triple_rows:
+                return 0
+
+            try:
+                with self.graph._driver.session(database=self.graph._database) as session:
+                    session.execute_write(self._write_tx, chunk_rows, entity_rows, triple_rows)
+            except Exception:
+                with self._lock:
+                    self._chunk_rows = chunk_rows + self._chunk_rows
+                    self._entity_rows = entity_rows + self._entity_rows
+                    self._triple_rows = triple_rows + self._triple_rows
+                raise
+        print(f"批量写入图数据库：{len(chunk_rows)}个文本块，{len(entity_rows)}条CONTAINS关系，{len(triple_rows)}条RELATION关系")
+        return len(chunk_rows)
+
+    def _write_tx(self, tx, chunk_rows: List[Dict], entity_rows: List[Dict], triple_rows: List[Dict]) -> None:
+        biz_label = self.biz_label
+        # 文本块节点
+        if chunk_rows:
+            tx.run(f"""
+            UNWIND $rows AS row
+            MERGE (c:Chunk {{chunk_id: row.chunk_id}})
+            SET c.content = row.content, c.entities = row.entities
+            SET c:{biz_label}
+            """, rows=chunk_rows).consume()
+
+        # 实体节点 + 文本块→实体 CONTAINS关系（文本块归属只记录在关系上，不再维护 e.chunk_ids 列表）
+        if entity_rows:
+            tx.run(f"""
+            UNWIND $rows AS row
+            MERGE (e:Entity {{name: row.name}})
+            SET e:{biz_label}
+            WITH e, row
+            MATCH (c:Chunk {{chunk_id: row.chunk_id}})
+            MERGE (c)-[:CONTAINS]->(e)
+            """, rows=entity_rows).consume()
+
+        # 实体→实体 RELATION关系
+        if triple_rows:
+            tx.run("""
+            UNWIND $rows AS row
+            MATCH (a:Entity {name: row.e1}), (b:Entity {name: row.e2})
+            MERGE (a)-[r:RELATION {name: row.rel}]->(b)
+            """, rows=triple_rows).consume()
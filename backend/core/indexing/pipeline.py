@@ -0,0 +1,391 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+pre_parent_dir = os.path.dirname(parent_dir)
+sys.path.insert(0, current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, pre_parent_dir)
+
+import time
+import queue
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import Settings, StageConfig
+from core.indexing.build_entity_extract_chain import get_output_parser
+from core.indexing.graph_vector_construction import extract_chunks, astream_extract_to_graph
+from core.indexing.graph_writer import GraphBatchWriter
+from core.indexing.vector_writer import VectorBatchWriter
+from core.indexing.extract_cache import get_extract_cache
+
+# 阶段输入队列的结束标记
+_STOP = object()
+
+
+@dataclass
+class ChunkTask:
+    """流水线中流转的单个文本块"""
+    chunk_id: str
+    text: str
+    embedding: Optional[List[float]] = None
+    extract_result: Optional[Tuple[List[str], List[str]]] = None
+    # 流式抽取时图数据库记录已在抽取阶段进入写入批次
+    graph_written: bool = False
+
+
+class Stage:
+    """
+    流水线阶段：独立的工作线程池 + 有界输入队列
+    每个工作线程从队列中取出最多batch_size个元素调用handler，
+    handler返回的元素依次放入所有下游阶段的队列（队列满时阻塞，形成背压）
+    """
+
+    def __init__(self, name: str, handler: Callable[[List[Any]], List[Any]], config: StageConfig,
+                 on_error: Optional[Callable[[str, List[Any], Exception], None]] = None,
+                 on_finish: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            name: 阶段名称
+            handler: 批处理函数，输入一批元素，返回需传给下游的元素
+            config: 阶段配置（工作线程数、批大小、队列容量）
+            on_error: handler抛出异常时的回调(阶段名, 当前批次, 异常)
+            on_finish: 所有工作线程退出后调用（如写入剩余缓冲）
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(config.workers, 1)
+        self.batch_size = max(config.batch_size, 1)
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(config.queue_size, 1))
+        self.on_error = on_error
+        self.on_finish = on_finish
+        self.downstream: List["Stage"] = []
+        self._upstream_count = 0
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._running_workers = 0
+        # 统计指标
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def connect(self, stage: "Stage") -> "Stage":
+        """添加下游阶段，返回下游阶段以便链式调用"""
+        self.downstream.append(stage)
+        stage._upstream_count += 1
+        return stage
+
+    def start(self) -> None:
+        self._running_workers = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item: Any) -> None:
+        self.queue.put(item)
+
+    def close_input(self) -> None:
+        """一个上游（或流水线输入端）结束输入；全部上游结束后通知本阶段的工作线程退出"""
+        with self._lock:
+            self._upstream_count -= 1
+            if self._upstream_count > 0:
+                return
+        for _ in range(self.workers):
+            self.queue.put(_STOP)
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _next_batch(self) -> Tuple[List[Any], bool]:
+        """取出一批元素：阻塞等待第一个元素，其余元素不等待；返回(批次, 是否收到结束标记)"""
+        item = self.queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = self._next_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            with self._lock:
+                if self.started_at is None:
+                    self.started_at = time.time()
+            try:
+                outputs = self.handler(batch)
+            except Exception as e:
+                outputs = []
+                with self._lock:
+                    self.errors += 1
+                print(f"流水线阶段[{self.name}]处理失败：{e.__class__.__name__} - {e}")
+                if self.on_error is not None:
+                    self.on_error(self.name, batch, e)
+            with self._lock:
+                self.processed += len(batch)
+                self.batches += 1
+                self.busy_seconds += time.perf_counter() - start
+            for output in outputs or []:
+                for stage in self.downstream:
+                    stage.put(output)
+
+        with self._lock:
+            self._running_workers -= 1
+            last_worker = self._running_workers == 0
+        if not last_worker:
+            return
+        if self.on_finish is not None:
+            try:
+                self.on_finish()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"流水线阶段[{self.name}]收尾失败：{e.__class__.__name__} - {e}")
+                if self.on_error is not None:
+                    self.on_error(self.name, [], e)
+        with self._lock:
+            self.finished_at = time.time()
+        for stage in self.downstream:
+            stage.close_input()
+
+    def stats(self) -> Dict[str, Any]:
+        """阶段指标：队列深度、已处理数量、吞吐量（条/秒，按阶段运行时长计算）"""
+        with self._lock:
+            elapsed = 0.0
+            if self.started_at is not None:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                "queue_depth": self.queue.qsize(),
+                "workers": self.workers,
+                "batch_size": self.batch_size,
+                "processed": self.processed,
+                "batches": self.batches,
+                "errors": self.errors,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "throughput": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0
+            }
+
+
+class IngestionPipeline:
+    """
+    分阶段入库流水线：
+        chunk -> embed -> vector_write
+              -> extract -> graph_write
+    分块结果同时进入向量化和实体抽取两个分支，两个分支使用不同后端（嵌入模型/LLM），并行执行；
+    文本块在向量库和图数据库都写入完成后视为完成（on_chunk_done回调）
+    """
+
+    def __init__(self, settings: Settings, embeddings, vector_db, graph_db, extract_chain,
+                 file_params: Optional[dict] = None, replace_vectors: bool = False,
+                 on_chunk_done: Optional[Callable[[str, bool], None]] = None):
+        """
+        Args:
+            settings: 全局配置（使用 settings.pipeline 的各阶段配置）
+            embeddings: 嵌入模型（embed_documents接口）
+            vector_db: 向量库实例（add_embeddings接口）
+            graph_db: Neo4jGraph实例
+            extract_chain: 实体关系抽取链（见 build_extract_chain）
+            file_params: 文件标签（file_tag1/file_tag2），写入向量库元数据
+            replace_vectors: 写入前先删除同ID向量（重新入库上次未完成的文本块时使用）
+            on_chunk_done: 文本块完成回调(chunk_id, 是否成功)
+        """
+        self.settings = settings
+        self.embeddings = embeddings
+        self.vector_db = vector_db
+        self.extract_chain = extract_chain
+        self.file_params = file_params or {}
+        self.replace_vectors = replace_vectors
+        self.on_chunk_done = on_chunk_done
+
+        pipeline_config = settings.pipeline
+        index_config = settings.index
+        # 缓存视图单独统计本次入库的命中情况
+        self.extract_cache = get_extract_cache(index_config.extract_cache_path).view() if index_config.extract_cache_enabled else None
+        self.pack_token_budget = index_config.extract_pack_token_budget if index_config.extract_mode == "packed" else 0
+        self.stream_extract = index_config.stream_extract and index_config.extract_mode == "single"
+        self.parse_fn = get_output_parser(index_config.extract_mode)
+        self.graph_writer = GraphBatchWriter(graph_db, settings.graph_store.biz_label, batch_size=pipeline_config.graph_write.batch_size)
+        # 向量库写入跨阶段批次累积，满batch_size写入一次，文档结束（阶段收尾）时写入剩余部分
+        self.vector_writer = VectorBatchWriter(vector_db, batch_size=pipeline_config.vector_write.batch_size,
+                                               replace=replace_vectors, on_flush=self._vector_flushed)
+
+        # 每个文本块需要完成的分支数（向量分支 + 图分支）及失败标记
+        self._pending: Dict[str, int] = {}
+        self._failed: Dict[str, bool] = {}
+        self._failed_chunk_ids: List[str] = []
+        self._chunk_ids: List[str] = []
+        self._track_lock = threading.Lock()
+
+        self.chunk_stage = Stage("chunk", self._chunk_batch, pipeline_config.chunk, on_error=self._on_error)
+        self.embed_stage = Stage("embed", self._embed_batch, pipeline_config.embed, on_error=self._on_error)
+        self.vector_write_stage = Stage("vector_write", self._vector_write_batch, pipeline_config.vector_write,
+                                        on_error=self._on_error, on_finish=self._vector_finish)
+        # LLM并发上限 extract_concurrency 由抽取阶段的各工作线程均分，所有线程同时在途的请求数不超过该上限
+        extract_config = pipeline_config.extract
+        extract_workers = max(1, min(extract_config.workers, index_config.extract_concurrency))
+        self.extract_call_concurrency = max(1, index_config.extract_concurrency // extract_workers)
+        self.extract_stage = Stage("extract", self._extract_batch, extract_config.model_copy(update={"workers": extract_workers}),
+                                   on_error=self._on_error)
+        self.graph_write_stage = Stage("graph_write", self._graph_write_batch, pipeline_config.graph_write,
+                                       on_error=self._on_error, on_finish=self._graph_finish)
+        self.chunk_stage.connect(self.embed_stage).connect(self.vector_write_stage)
+        self.chunk_stage.connect(self.extract_stage).connect(self.graph_write_stage)
+        self.stages = [self.chunk_stage, self.embed_stage, self.vector_write_stage, self.extract_stage, self.graph_write_stage]
+        # 流水线输入端视为分块阶段的上游
+        self.chunk_stage._upstream_count += 1
+
+    def run(self, documents: Iterable[Any], chunk_fn: Callable[[Any], List[Tuple[str, str]]]) -> List[str]:
+        """
+        运行流水线直到全部文档处理完成
+        Args:
+            documents: 输入文档（任意对象，由chunk_fn解释）
+            chunk_fn: 分块函数，输入一个文档，返回需入库的(文本块ID, 文本块)列表
+        Returns:
+            list: 入库失败的文本块ID
+        """
+        self._chunk_fn = chunk_fn
+        start = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        for document in documents:
+            self.chunk_stage.put(document)
+        self.chunk_stage.close_input()
+        for stage in self.stages:
+            stage.join()
+
+        print(f"入库流水线完成：{len(self._chunk_ids)}个文本块，失败{len(self._failed_chunk_ids)}个，耗时{time.perf_counter() - start:.2f}s")
+        for name, stage_stats in self.stats().items():
+            print(f"  阶段[{name}]：{stage_stats}")
+        if self.extract_cache is not None:
+            print(f"抽取缓存统计（本次入库）：{self.extract_cache.stats()}，进程累计：{self.extract_cache.cache.stats()}")
+        return list(self._failed_chunk_ids)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段指标（运行中也可调用）"""
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    # ---------------- 阶段处理函数 ----------------
+
+    def _chunk_batch(self, documents: List[Any]) -> List[ChunkTask]:
+        tasks = []
+        for document in documents:
+            for chunk_id, text in self._chunk_fn(document):
+                tasks.append(ChunkTask(chunk_id=chunk_id, text=text))
+        with self._track_lock:
+            for task in tasks:
+                self._pending[task.chunk_id] = 2
+                self._failed[task.chunk_id] = False
+                self._chunk_ids.append(task.chunk_id)
+        return tasks
+
+    def _embed_batch(self, tasks: List[ChunkTask]) -> List[ChunkTask]:
+        embeddings = self.embeddings.embed_documents([task.text for task in tasks])
+        for task, embedding in zip(tasks, embeddings):
+            task.embedding = embedding
+        return tasks
+
+    def _vector_write_batch(self, tasks: List[ChunkTask]) -> List[ChunkTask]:
+        # 文本块在所在批次写入向量库后由_vector_flushed标记完成
+        for task in tasks:
+            self.vector_writer.add(chunk=task.text, chunk_id=task.chunk_id, file_params=self.file_params, embedding=task.embedding)
+        return []
+
+    def _vector_flushed(self, chunk_ids: List[str], ok: bool) -> None:
+        for chunk_id in chunk_ids:
+            self._finish(chunk_id, ok)
+
+    def _vector_finish(self) -> None:
+        self.vector_writer.flush()
+
+    def _extract_batch(self, tasks: List[ChunkTask]) -> List[ChunkTask]:
+        texts = [task.text for task in tasks]
+        if self.stream_extract:
+            # 流式抽取：解析出的记录直接进入图数据库写入批次
+            results = asyncio.run(astream_extract_to_graph(
+                self.extract_chain,
+                texts,
+                [task.chunk_id for task in tasks],
+                self.graph_writer,
+                max_concurrency=min(len(tasks), self.extract_call_concurrency),
+                cache=self.extract_cache,
+                model_name=self.settings.llm.model
+            ))
+        else:
+            results = extract_chunks(
+                self.extract_chain,
+                texts,
+                max_concurrency=min(len(tasks), self.extract_call_concurrency),
+                cache=self.extract_cache,
+                model_name=self.settings.llm.model,
+                pack_token_budget=self.pack_token_budget,
+                pack_max_chunks=self.settings.index.extract_pack_max_chunks,
+                parse_fn=self.parse_fn
+            )
+        outputs = []
+        for task, result in zip(tasks, results):
+            if result is None:
+                self._finish(task.chunk_id, False)
+                continue
+            task.extract_result = result
+            task.graph_written = self.stream_extract
+            outputs.append(task)
+        return outputs
+
+    def _graph_write_batch(self, tasks: List[ChunkTask]) -> List[ChunkTask]:
+        for task in tasks:
+            if not task.graph_written:
+                entity_list, triples = task.extract_result
+                self.graph_writer.add(chunk=task.text, chunk_id=task.chunk_id, entity_list=entity_list, triples=triples)
+        # 每个阶段批次对应一次图数据库事务，失败时可准确标记该批文本块
+        self.graph_writer.flush()
+        for task in tasks:
+            self._finish(task.chunk_id, True)
+        return []
+
+    def _graph_finish(self) -> None:
+        self.graph_writer.flush()
+
+    # ---------------- 完成状态跟踪 ----------------
+
+    def _on_error(self, stage_name: str, items: List[Any], error: Exception) -> None:
+        if stage_name == "chunk":
+            return
+        for item in items:
+            self._finish(item.chunk_id, False)
+
+    def _finish(self, chunk_id: str, ok: bool) -> None:
+        """记录文本块一个分支完成；两个分支都完成时触发on_chunk_done"""
+        with self._track_lock:
+            if chunk_id not in self._pending:
+                return
+            self._pending[chunk_id] -= 1
+            if not ok:
+                self._failed[chunk_id] = True
+                # 失败的文本块不再等待另一分支
+                self._pending[chunk_id] = 0
+            if self._pending[chunk_id] > 0:
+                return
+            del self._pending[chunk_id]
+            failed = self._failed.pop(chunk_id)
+            if failed:
+                self._failed_chunk_ids.append(chunk_id)
+        if self.on_chunk_done is not None:
+            self.on_chunk_done(chunk_id, not failed)
@@ -0,0 +1,98 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+pre_parent_dir = os.path.dirname(parent_dir)
+sys.path.insert(0, current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, pre_parent_dir)
+
+import threading
+from typing import Callable, List, Dict, Optional
+from langchain_milvus import Milvus
+
+
+def make_vector_metadata(file_params: dict) -> Dict[str, str]:
+    """文本块写入向量库的元数据（文件标签）"""
+    return {
+        "file_tag1": file_params.get("file_tag1", ""),
+        "file_tag2": file_params.get("file_tag2", "")
+    }
+
+
+class VectorBatchWriter:
+    """
+    向量库批量写入器：
+    累积文本块、ID和元数据，达到batch_size个文本块后一次写入：
+    - 未提供向量时通过 add_texts 写入，一批文本块只产生一次embedding调用（由embedding客户端按其批大小分批并发请求）和一次Milvus插入
+    - 已提供向量（如入库流水线的embed阶段）时通过 add_embeddings 写入
+    替代逐文本块的embedding请求和插入往返
+    """
+
+    def __init__(self, vector_db: Milvus, batch_size: int = 128, replace: bool = False,
+                 on_flush: Optional[Callable[[List[str], bool], None]] = None):
+        """
+        Args:
+            vector_db: 向量数据库实例
+            batch_size: 每次flush包含的文本块数量
+            replace: 写入前先删除同ID向量（重新入库上次未完成的文本块时使用）
+            on_flush: 每批写入完成（或失败）后的回调(文本块ID列表, 是否成功)
+        """
+        self.vector_db = vector_db
+        self.batch_size = max(batch_size, 1)
+        self.replace = replace
+        self.on_flush = on_flush
+        self._lock = threading.Lock()
+        # 多线程同时flush时串行写入，保证批次按累积顺序提交
+        self._flush_lock = threading.Lock()
+        self._texts: List[str] = []
+        self._ids: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._embeddings: List[Optional[List[float]]] = []
+
+    def add(self, chunk: str, chunk_id: str, file_params: dict, embedding: Optional[List[float]] = None) -> None:
+        """
+        添加一个文本块（可附带已计算的向量），累积的文本块数达到batch_size时自动flush
+        """
+        with self._lock:
+            self._texts.append(chunk)
+            self._ids.append(chunk_id)
+            self._metadatas.append(make_vector_metadata(file_params))
+            self._embeddings.append(embedding)
+            should_flush = len(self._texts) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def pending(self) -> int:
+        """未写入的文本块数量"""
+        with self._lock:
+            return len(self._texts)
+
+    def flush(self) -> int:
+        """
+        将累积的文本块写入向量库（未提供向量的先embedding）
+        Returns:
+            int: 本次写入的文本块数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                texts, ids, metadatas, embeddings = self._texts, self._ids, self._metadatas, self._embeddings
+                self._texts, self._ids, self._metadatas, self._embeddings = [], [], [], []
+            if not texts:
+                return 0
+            try:
+                if self.replace:
+                    self.vector_db.delete(ids=ids)
+                if all(embedding is not None for embedding in embeddings):
+                    self.vector_db.add_embeddings(texts=texts, embeddings=embeddings, metadatas=metadatas, ids=ids)
+                else:
+                    self.vector_db.add_texts(texts=texts, ids=ids, metadatas=metadatas)
+            except Exception:
+                if self.on_flush is not None:
+                    self.on_flush(ids, False)
+                raise
+        print(f"批量写入向量库：{len(texts)}个文本块")
+        if self.on_flush is not None:
+            self.on_flush(ids, True)
+        return len(texts)
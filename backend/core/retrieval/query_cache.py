@@ -0,0 +1,111 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """查询文本归一化：全角转半角（NFKC）、合并连续空白、去除首尾空白"""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    进程内查询向量缓存（LRU + TTL）
+    缓存键 = (模型名, 归一化后的查询文本)，超过max_size时淘汰最久未使用的条目，超过ttl秒的条目视为未命中
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        """
+        Args:
+            max_size: 最多缓存的查询数，0表示不缓存
+            ttl: 条目有效期（秒），0表示不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """查询缓存（query需已归一化），未命中或已过期返回None"""
+        key = (model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, query: str, embedding: List[float]) -> None:
+        if self.max_size <= 0:
+            return
+        key = (model, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def get_or_embed(self, embeddings, model: str, query: str) -> List[float]:
+        """
+        返回查询向量：命中缓存时直接返回，否则调用 embeddings.embed_query 并写入缓存
+        归一化后的查询文本只作为缓存键，向量由原始查询文本生成，与未启用缓存时的检索结果一致
+        """
+        key = normalize_query(query)
+        embedding = self.get(model, key)
+        if embedding is None:
+            embedding = embeddings.embed_query(query)
+            self.put(model, key, embedding)
+        return embedding
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
+
+
+# 进程级查询向量缓存，按(容量, 有效期)配置复用，各知识库共享（同一模型的查询向量与知识库无关）
+_query_caches: Dict[Tuple[int, float], QueryEmbeddingCache] = {}
+_query_caches_lock = threading.Lock()
+
+
+def get_query_cache(max_size: int = 1024, ttl: float = 3600) -> QueryEmbeddingCache:
+    key = (max_size, ttl)
+    with _query_caches_lock:
+        if key not in _query_caches:
+            _query_caches[key] = QueryEmbeddingCache(max_size=max_size, ttl=ttl)
+        return _query_caches[key]
+
+
+def query_cache_stats() -> List[Dict[str, float]]:
+    """所有查询向量缓存的统计"""
+    with _query_caches_lock:
+        caches = list(_query_caches.values())
+    return [cache.stats() for cache in caches]
@@ -1,32 +1,208 @@
 from sentence_transformers import CrossEncoder
+import threading
+import time
+import httpx
 import torch
+from typing import Dict, List, Optional, Tuple
 
-def rerank_candidates(query: str, candidates: list, model_path: str = "./backend/model/local_models/BAAI/bge-reranker-base",top_k:int=3) -> list:
+DEFAULT_RERANK_MODEL_PATH = "./backend/model/local_models/BAAI/bge-reranker-base"
+
+# 进程级重排模型注册表：(模型路径, 设备) -> (CrossEncoder, 推理锁)
+# 模型只加载一次；tokenizer并发调用不安全，同一模型的推理串行执行
+_rerank_models: Dict[Tuple[str, str], Tuple[CrossEncoder, threading.Lock]] = {}
+_rerank_models_lock = threading.Lock()
+
+
+def get_rerank_model(model_path: str = DEFAULT_RERANK_MODEL_PATH, device: Optional[str] = None, warmup: bool = False) -> Tuple[CrossEncoder, threading.Lock]:
+    """
+    获取（或首次加载）重排模型
+
+    Args:
+        model_path: 重排模型路径
+        device: 运行设备，默认自动适配GPU/CPU
+        warmup: 首次加载后是否执行一次预热推理
+
+    Returns:
+        (CrossEncoder模型, 该模型的推理锁)
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    key = (model_path, device)
+    entry = _rerank_models.get(key)
+    if entry is not None:
+        return entry
+    with _rerank_models_lock:
+        entry = _rerank_models.get(key)
+        if entry is None:
+            print(f"加载重排模型：{model_path}（设备：{device}）")
+            model = CrossEncoder(model_path, device=device)
+            if warmup:
+                model.predict([("预热", "预热文本")], batch_size=1, show_progress_bar=False)
+            entry = (model, threading.Lock())
+            _rerank_models[key] = entry
+    return entry
+
+
+def rerank_candidates(query: str, candidates: list, model_path: str = DEFAULT_RERANK_MODEL_PATH,top_k:int=3, batch_size: int = 32) -> list:
     """
     使用重排模型对候选文本列表进行重新排序
-    
+
     Args:
         query: 查询语句（如用户问题）
-        candidates: 待重排的候选文本列表
-        model_name: 重排模型名称，默认使用BGE-reranker-large（效果好），也可选择轻量版BAAI/bge-reranker-base
-    
+        candidates: 待重排的候选列表，每个元素为 (chunkid, 文本, 得分)
+        model_path: 重排模型路径，默认使用轻量版BAAI/bge-reranker-base
+        top_k: 返回的结果数量
+        batch_size: 模型推理批大小
+
     Returns:
-        排序后的候选列表（按相关性从高到低），每个元素为 (文本, 得分)
+        排序后的候选列表（按相关性从高到低），每个元素为 (候选, 得分)
     """
-    # 1. 加载重排模型，自动适配GPU/CPU
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = CrossEncoder(model_path, device=device)
-    
+    if not candidates:
+        return []
+
+    # 1. 获取已加载的重排模型（进程内复用，自动适配GPU/CPU）
+    model, infer_lock = get_rerank_model(model_path)
+
     # 2. 构造模型输入：(查询, 候选文本) 对
     pairs = [(query, candidate) for chunkid, candidate, score in candidates]
-    
-    # 3. 计算相关性得分（得分越高，相关性越强）
-    scores = model.predict(pairs)
-    
+
+    # 3. 按批计算相关性得分（得分越高，相关性越强）
+    with infer_lock:
+        scores = model.predict(pairs, batch_size=batch_size, show_progress_bar=False)
+
     # 4. 结合文本和得分，按得分降序排序
     ranked_results = list(zip(candidates, scores))
     ranked_results.sort(key=lambda x: x[1], reverse=True)
 
     # 取相关性最强的top_k个
     top_k_results = ranked_results[:top_k]
-    return top_k_results
\ No newline at end of file
+    return top_k_results
+
+
+class RemoteReranker:
+    """
+    远程重排服务客户端（/v1/rerank 接口），基于连接池复用HTTP连接
+    兼容两种常见响应格式：
+    - {"results": [{"index": 0, "relevance_score": 0.9}, ...]}
+    - [{"index": 0, "score": 0.9}, ...]
+    """
+
+    def __init__(self, model: str, base_url: str, timeout: float = 3.0, batch_size: int = 32, max_connections: int = 16):
+        self.model = model
+        self.base_url = base_url
+        self.batch_size = max(batch_size, 1)
+        self.client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._stats_lock = threading.Lock()
+        self.call_count = 0
+        self.total_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """按批请求远程服务，返回与texts顺序一致的相关性得分"""
+        start = time.perf_counter()
+        scores: List[float] = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            response = self.client.post(self.base_url, json={
+                "model": self.model,
+                "query": query,
+                "documents": batch
+            })
+            response.raise_for_status()
+            scores.extend(self._parse_scores(response.json(), len(batch)))
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.call_count += 1
+            self.total_latency_ms += latency_ms
+            self.last_latency_ms = latency_ms
+        print(f"远程重排完成：{len(texts)}个候选，耗时{latency_ms:.1f}ms")
+        return scores
+
+    @staticmethod
+    def _parse_scores(result, size: int) -> List[float]:
+        items = result.get("results", result.get("data")) if isinstance(result, dict) else result
+        if not isinstance(items, list):
+            raise ValueError(f"重排服务响应格式不支持: {result}")
+        scores: List[Optional[float]] = [None] * size
+        for item in items:
+            # 格式错误统一抛出ValueError，由调用方回退到本地模型
+            if not isinstance(item, dict):
+                raise ValueError(f"重排服务响应的结果项格式不支持: {item}")
+            index = item.get("index")
+            score = item.get("relevance_score", item.get("score"))
+            if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < size:
+                raise ValueError(f"重排服务响应的索引无效: {item}")
+            if isinstance(score, bool) or not isinstance(score, (int, float)):
+                raise ValueError(f"重排服务响应的分数无效: {item}")
+            scores[index] = float(score)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            # 缺少的候选不能按0分处理，否则会被静默排到最后
+            raise ValueError(f"重排服务响应缺少{len(missing)}个候选的分数（索引 {missing[:10]}）")
+        return scores
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            avg = self.total_latency_ms / self.call_count if self.call_count else 0.0
+            return {
+                "call_count": self.call_count,
+                "last_latency_ms": round(self.last_latency_ms, 1),
+                "avg_latency_ms": round(avg, 1)
+            }
+
+
+# 远程重排客户端按(模型, 地址)在进程内复用
+_remote_rerankers: Dict[Tuple[str, str], RemoteReranker] = {}
+
+
+def get_remote_reranker(rerank_settings) -> RemoteReranker:
+    """根据rerankConfig获取（或创建）远程重排客户端"""
+    key = (rerank_settings.model, rerank_settings.base_url)
+    with _rerank_models_lock:
+        if key not in _remote_rerankers:
+            _remote_rerankers[key] = RemoteReranker(
+                model=rerank_settings.model,
+                base_url=rerank_settings.base_url,
+                timeout=rerank_settings.timeout,
+                batch_size=rerank_settings.batch_size
+            )
+        return _remote_rerankers[key]
+
+
+def rerank(query: str, candidates: list, rerank_settings, top_k: int = 3) -> list:
+    """
+    按rerankConfig选择重排后端：
+    - backend="remote"：调用远程重排服务，超时或请求失败时回退到本地模型
+    - backend="local"：使用本地CrossEncoder
+
+    Returns:
+        排序后的候选列表（按相关性从高到低），每个元素为 (候选, 得分)
+    """
+    if not candidates:
+        return []
+
+    if rerank_settings.backend == "remote":
+        try:
+            reranker = get_remote_reranker(rerank_settings)
+            scores = reranker.score(query, [candidate for chunkid, candidate, score in candidates])
+            ranked_results = list(zip(candidates, scores))
+            ranked_results.sort(key=lambda x: x[1], reverse=True)
+            return ranked_results[:top_k]
+        except (httpx.HTTPError, ValueError, KeyError, IndexError) as e:
+            if not rerank_settings.fallback_local:
+                raise
+            print(f"远程重排失败，回退到本地模型：{e.__class__.__name__} - {e}")
+
+    start = time.perf_counter()
+    results = rerank_candidates(
+        query,
+        candidates,
+        model_path=rerank_settings.local_model_path,
+        top_k=top_k,
+        batch_size=rerank_settings.batch_size
+    )
+    print(f"本地重排完成：{len(candidates)}个候选，耗时{(time.perf_counter() - start) * 1000:.1f}ms")
+    return results
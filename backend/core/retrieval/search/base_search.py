@@ -12,6 +12,7 @@ sys.path.insert(0, pre_parent_dir)
 
 from deprecation import deprecated
 from core.tools.init_vector_db import query_by_ids
+from core.retrieval.query_cache import get_query_cache
 from config import Settings
 
 class BaseSearch:
@@ -43,7 +44,12 @@ class BaseSearch:
             list: 包含文本块ID和相似度分数的元组列表
         """
         print("\n=== 向量检索召回文本块 ===")
-        vector_results = vector_db.similarity_search_with_score(query, k=top_k)
+        # 查询向量先查进程内缓存，重复的查询不再请求embedding服务
+        search_settings = self.settings.search
+        query_cache = get_query_cache(search_settings.query_cache_size, search_settings.query_cache_ttl)
+        query_embedding = query_cache.get_or_embed(vector_db.embeddings, self.settings.embed.model, query)
+        vector_results = vector_db.similarity_search_with_score_by_vector(query_embedding, k=top_k)
+        print(f"查询向量缓存统计：{query_cache.stats()}")
         vector_chunk_ids = []
 
         for doc,score in vector_results:
@@ -69,11 +75,19 @@ class BaseSearch:
         """
         print("\n=== 回查vectordb获取扩展文本内容 ===")
         extended_chunks_results = []
+        if not extend_sorted_result:
+            print(f"扩展文本块内容：{extended_chunks_results}")
+            return extended_chunks_results
+        # 一次批量查询取回全部文本块，再按原关联度顺序组装
+        chunk_ids = [chunkid for chunkid, score in extend_sorted_result]
+        vector_db_res = query_by_ids(self.settings, ids=chunk_ids)
+        docs_by_id = {doc.metadata.get("pk"): doc for doc in vector_db_res}
         for chunkid, score in extend_sorted_result:
-            vector_db_res = query_by_ids(self.settings, ids=[chunkid])
-            for doc in vector_db_res:
-                clean_content = doc.page_content.replace('\r\n', '').replace('\n', '').replace('\r', '')
-                extended_chunks_results.append((chunkid, clean_content, score))
+            doc = docs_by_id.get(chunkid)
+            if doc is None:
+                continue
+            clean_content = doc.page_content.replace('\r\n', '').replace('\n', '').replace('\r', '')
+            extended_chunks_results.append((chunkid, clean_content, score))
 
         print(f"扩展文本块内容：{extended_chunks_results}")
         return extended_chunks_results
@@ -90,14 +104,16 @@ class BaseSearch:
             list: 包含实体名称的列表
         """
         print("\n=== 图查询关联实体 ===")
-        related_entities = []
-        for chunk_id in vector_chunk_ids:
-            res = graph_db.query(f"""
-            MATCH (c:Chunk:{self.biz_label} {{chunk_id: $chunk_id}})-[:CONTAINS]->(e:Entity)
-            RETURN e.name AS entity_name;
-            """, params={"chunk_id": chunk_id})
-            related_entities.extend([item["entity_name"] for item in res])
-        related_entities = list(set(related_entities))
+        if not vector_chunk_ids:
+            print("关联实体：[]")
+            return []
+        # 一次查询取回所有文本块的关联实体
+        res = graph_db.query(f"""
+        UNWIND $chunk_ids AS chunk_id
+        MATCH (c:Chunk:{self.biz_label} {{chunk_id: chunk_id}})-[:CONTAINS]->(e:Entity)
+        RETURN DISTINCT e.name AS entity_name;
+        """, params={"chunk_ids": list(vector_chunk_ids)})
+        related_entities = list(set(item["entity_name"] for item in res))
         print(f"关联实体：{related_entities}")
         return related_entities
     
@@ -110,51 +126,50 @@ class BaseSearch:
             related_entities: 关联实体名称列表
             expand_depth: 实体扩展深度，默认1（仅直接关联），2表示两跳关联，以此类推
             vector_chunk_ids: 原始向量检索得到的chunk_id列表，用于去重
+            top_k: 返回的扩展文本块数量
         
         Returns:
-            list: 扩展得到的文本块ID列表（已去除原始ID）
+            list: 按关联度降序的(文本块ID, 关联度)列表（已去除原始ID）
         """
         print("\n=== 从关联实体扩展文本块ID ===")
         
         # 校验扩展深度的合法性
         if not isinstance(expand_depth, int) or expand_depth < 1:
             raise ValueError("expand_depth必须是大于等于1的整数")
-        
 
-        temp_extended_chunk_ids = []
+        if not related_entities:
+            return []
+
+        # 单次查询完成扩展：UNWIND全部关联实体 → 多跳扩展实体 → 候选文本块 → 服务端统计候选文本块包含的关联实体数
         cypher_query = f"""
-            MATCH (e:Entity {{name: $entity_name}})-[*1..{expand_depth}]-(related_e:Entity:{self.biz_label})
-            RETURN collect(DISTINCT related_e.chunk_ids) AS all_chunk_ids;
+            UNWIND $entity_names AS entity_name
+            MATCH (e:Entity {{name: entity_name}})-[*1..{expand_depth}]-(related_e:Entity:{self.biz_label})
+            WITH DISTINCT related_e
+            MATCH (c:Chunk:{self.biz_label})-[:CONTAINS]->(related_e)
+            WHERE NOT c.chunk_id IN $exclude_chunk_ids
+            WITH DISTINCT c
+            OPTIONAL MATCH (c)-[:CONTAINS]->(overlap_e:Entity)
+            WHERE overlap_e.name IN $entity_names
+            WITH c, count(DISTINCT overlap_e.name) AS overlap
+            RETURN c.chunk_id AS chunk_id, overlap
+            ORDER BY overlap DESC, chunk_id
+            LIMIT $top_k;
             """
-        
-        for entity in related_entities:
-            try:
-                res = graph_db.query(cypher_query, params={"entity_name": entity})
-                # 提取并处理返回的chunk_ids
-                if res and res[0]["all_chunk_ids"] and isinstance(res[0]["all_chunk_ids"], list):
-                    chunk_ids = res[0]["all_chunk_ids"]
-                    temp_extended_chunk_ids.extend(chunk_ids)
-            except Exception as e:
-                print(f"从实体 {entity} 扩展chunk_id时出错：{str(e)}")
-                continue
-        
-        print(f"扩展文本块ID（扩展深度{expand_depth}）获取的所有文本块ID：{temp_extended_chunk_ids}")
-
-
-        # 去重并移除原始vector_chunk_ids中的ID
-        extended_chunk_ids = []
-        extended_chunk_ids = list(set(self.flatten_nested_list(temp_extended_chunk_ids)) - set(vector_chunk_ids))
-        print(f"扩展文本块ID（扩展深度{expand_depth}）去重后：{extended_chunk_ids}")
+        try:
+            res = graph_db.query(cypher_query, params={
+                "entity_names": list(related_entities),
+                "exclude_chunk_ids": list(vector_chunk_ids),
+                "top_k": top_k
+            })
+        except Exception as e:
+            print(f"从关联实体扩展chunk_id时出错：{str(e)}")
+            return []
 
-        # 统计文档被实体匹配的次数（关联度）
+        # 关联度 = 候选文本块包含的关联实体数 / 关联实体总数，保留小数位，默认5位
         doc_count = {}
-        for chunk_id in extended_chunk_ids:
-            chunk_entities = self.get_graph_entity(graph_db, [chunk_id])
-            common_elements = set(related_entities) & set(chunk_entities)    
-            count = len(common_elements)
-            raw_value = (doc_count.get(chunk_id, 0) + count) / len(related_entities)
-            # 保留小数位，默认5位
-            doc_count[chunk_id] = round(raw_value, 5) 
+        for item in res:
+            doc_count[item["chunk_id"]] = round(item["overlap"] / len(related_entities), 5)
+        print(f"扩展文本块ID（扩展深度{expand_depth}）及关联度：{doc_count}")
 
         # 按关联度降序排序，取top_k
         sorted_docs = sorted(doc_count.items(), key=lambda x: x[1], reverse=True)
@@ -226,25 +241,6 @@ class BaseSearch:
         print("融合后上下文：", merged_context)
         return merged_context
 
-    def flatten_nested_list(self, nested_list):
-            """
-            递归展平任意深度的嵌套列表
-            参数:
-                nested_list: 可能包含多层嵌套列表的列表（如 [[1, [2, 3]], [4, [5, [6]]]]）
-            返回:
-                展平后的单层列表（如 [1, 2, 3, 4, 5, 6]）
-            """
-            flattened = []
-            for item in nested_list:
-                # 如果当前元素是列表，递归展平；否则直接添加
-                if isinstance(item, list):
-                    flattened.extend(self.flatten_nested_list(item))
-                else:
-                    # 过滤空值（可选，根据你的业务需求调整）
-                    if item is not None and item != "":
-                        flattened.append(item)
-            return flattened
-
     @deprecated(deprecated_in="1.0", removed_in="2.0", current_version="1.5", details="请使用 new_function 替代")
     def double_layer_retrieval(vector_db, graph_db, query, top_k=3, expand_depth=2):
         """
@@ -285,8 +281,8 @@ class BaseSearch:
         extended_chunk_ids = []
         for entity in related_entities:
             res = graph_db.query("""
-            MATCH (e:Entity {name: $entity_name})
-            RETURN e.chunk_ids AS chunk_ids;
+            MATCH (c:Chunk)-[:CONTAINS]->(e:Entity {name: $entity_name})
+            RETURN collect(DISTINCT c.chunk_id) AS chunk_ids;
             """, params={"entity_name": entity})
             if res and res[0]["chunk_ids"]:
                 extended_chunk_ids.extend(res[0]["chunk_ids"])
@@ -0,0 +1,421 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有fcntl，使用msvcrt的字节锁
+    fcntl = None
+    import msvcrt
+
+DEFAULT_EMBED_CACHE_PATH = "./data/embed_cache"
+DEFAULT_EMBED_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# 超过容量上限时压缩到上限的该比例，避免每次写入都触发压缩
+COMPACT_TARGET_RATIO = 0.8
+# SQLite单条语句的参数个数上限为999
+_SQL_BATCH = 500
+# 压缩时每次拷贝的向量行数
+_COMPACT_BATCH = 65536
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _ProcessLock:
+    """跨进程排他文件锁（同一进程内的线程互斥由调用方的threading.Lock保证）"""
+
+    def __init__(self, path: str):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT)
+
+    def acquire(self) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                # LK_LOCK 重试约10秒后抛出OSError，持续等待直到获得锁
+                msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def release(self) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            return
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _VectorFile:
+    """
+    只追加的float32向量文件：每行一个dim维向量，行号即slot
+    读取时通过内存映射按slot取行，热进程不需要把全部向量加载到内存
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        size = os.path.getsize(path)
+        self.rows = size // self.row_bytes
+        if size != self.rows * self.row_bytes:
+            # 写入中断留下的不完整行，截断后再追加，保证行对齐
+            with open(path, "r+b") as f:
+                f.truncate(self.rows * self.row_bytes)
+        self._mmap: Optional[np.memmap] = None
+
+    def refresh(self) -> None:
+        """按文件大小更新行数（其他进程可能已追加）"""
+        self.rows = os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, vectors: np.ndarray) -> int:
+        """追加向量，返回第一行的slot（需持有进程锁，slot按当前文件大小计算）"""
+        self.refresh()
+        start = self.rows
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self.rows += len(vectors)
+        return start
+
+    def read(self, slots: Sequence[int]) -> np.ndarray:
+        """按slot读取向量（返回拷贝，不持有映射的视图）"""
+        if self._mmap is None or self._mmap.shape[0] < self.rows:
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return np.array(self._mmap[np.asarray(slots, dtype=np.int64)])
+
+    def size_bytes(self) -> int:
+        return self.rows * self.row_bytes
+
+    def close(self) -> None:
+        self._mmap = None
+
+
+class EmbeddingCache:
+    """
+    按内容寻址的embedding磁盘缓存
+    - 缓存键 = (模型名, 归一化/提示词等影响向量的参数, 文本内容哈希)
+    - 向量存放在按维度区分的只追加float32文件中，通过内存映射读取；SQLite索引记录 缓存键 -> (维度, slot, 最近访问时间)
+    - 向量文件总大小超过max_bytes时按最近访问时间淘汰，并把保留的向量重写到新一代文件（压缩），
+      索引中的代号在同一事务内切换，压缩中断不会损坏缓存
+    支持多进程共享同一缓存目录：索引与向量文件的读写、压缩都在跨进程文件锁内进行，
+    每次访问前按索引中的代号和文件大小刷新本进程打开的向量文件
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBED_CACHE_PATH, max_bytes: int = DEFAULT_EMBED_CACHE_MAX_BYTES):
+        """
+        Args:
+            path: 缓存目录（索引 index.db + 向量文件 vectors_{维度}_{代号}.f32）
+            max_bytes: 向量文件总大小上限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._process_lock = _ProcessLock(os.path.join(path, "cache.lock"))
+        self._conn = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS embed_index (
+            cache_key TEXT PRIMARY KEY,
+            dim INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """)
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS embed_files (
+            dim INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL
+        )
+        """)
+        self._conn.commit()
+        self._files: Dict[int, _VectorFile] = {}
+        self._generations: Dict[int, int] = {}
+        with self._locked():
+            for dim, generation in self._generations.items():
+                self._remove_stale_files(dim, generation)
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(text: str, model: str, normalization: str) -> str:
+        return text_hash(f"{model}\x1f{normalization}\x1f{text_hash(text)}")
+
+    def _file_path(self, dim: int, generation: int) -> str:
+        return os.path.join(self.path, f"vectors_{dim}_{generation}.f32")
+
+    @contextmanager
+    def _locked(self):
+        """获取线程锁和跨进程锁，并刷新向量文件状态"""
+        with self._lock:
+            self._process_lock.acquire()
+            try:
+                self._refresh()
+                yield
+            finally:
+                self._process_lock.release()
+
+    def _refresh(self) -> None:
+        """其他进程可能已压缩（切换代号）或追加向量，按索引重新打开/刷新向量文件"""
+        # 结束当前读事务，读取其他进程已提交的数据
+        self._conn.commit()
+        generations = dict(self._conn.execute("SELECT dim, generation FROM embed_files").fetchall())
+        for dim, generation in generations.items():
+            vector_file = self._files.get(dim)
+            if vector_file is None or self._generations.get(dim) != generation:
+                if vector_file is not None:
+                    vector_file.close()
+                self._files[dim] = _VectorFile(self._file_path(dim, generation), dim)
+            else:
+                vector_file.refresh()
+        self._generations = generations
+
+    def _remove_stale_files(self, dim: int, generation: int) -> None:
+        """删除压缩中断或压缩后遗留的其他代号的向量文件（需持有进程锁，此时非当前代号的文件都已不再使用）"""
+        current = os.path.basename(self._file_path(dim, generation))
+        prefix = f"vectors_{dim}_"
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name.endswith(".f32") and name != current:
+                _try_remove(os.path.join(self.path, name))
+
+    def _get_file(self, dim: int) -> _VectorFile:
+        vector_file = self._files.get(dim)
+        if vector_file is None:
+            self._conn.execute("INSERT OR IGNORE INTO embed_files (dim, generation) VALUES (?, 0)", (dim,))
+            self._conn.commit()
+            vector_file = _VectorFile(self._file_path(dim, 0), dim)
+            self._files[dim] = vector_file
+            self._generations[dim] = 0
+        return vector_file
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询缓存，未命中的位置为None"""
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        if not keys:
+            return results
+        positions: Dict[str, List[int]] = {}
+        for idx, key in enumerate(keys):
+            positions.setdefault(key, []).append(idx)
+        unique_keys = list(positions)
+        with self._locked():
+            rows = []
+            for i in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[i:i + _SQL_BATCH]
+                rows.extend(self._conn.execute(
+                    f"SELECT cache_key, dim, slot FROM embed_index WHERE cache_key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            by_dim: Dict[int, List[Tuple[str, int]]] = {}
+            for key, dim, slot in rows:
+                by_dim.setdefault(dim, []).append((key, slot))
+            for dim, entries in by_dim.items():
+                vectors = self._files[dim].read([slot for _, slot in entries])
+                for (key, _), vector in zip(entries, vectors):
+                    for idx in positions[key]:
+                        results[idx] = vector
+            if rows:
+                now = time.time()
+                self._conn.executemany("UPDATE embed_index SET last_access = ? WHERE cache_key = ?", [(now, row[0]) for row in rows])
+                self._conn.commit()
+            hit_count = sum(len(positions[row[0]]) for row in rows)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return results
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        """批量写入缓存（已存在的缓存键跳过），写入后超过容量上限时压缩"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not keys:
+            return
+        if vectors.ndim != 2 or len(vectors) != len(keys):
+            raise ValueError(f"向量形状{vectors.shape}与缓存键数量{len(keys)}不匹配")
+        dim = vectors.shape[1]
+        with self._locked():
+            existing = set()
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                existing.update(row[0] for row in self._conn.execute(
+                    f"SELECT cache_key FROM embed_index WHERE cache_key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            new_rows = {}
+            for idx, key in enumerate(keys):
+                if key not in existing and key not in new_rows:
+                    new_rows[key] = idx
+            if not new_rows:
+                return
+            vector_file = self._get_file(dim)
+            start = vector_file.append(vectors[list(new_rows.values())])
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embed_index (cache_key, dim, slot, last_access) VALUES (?, ?, ?, ?)",
+                [(key, dim, start + offset, now) for offset, key in enumerate(new_rows)]
+            )
+            self._conn.commit()
+            if self._total_bytes() > self.max_bytes:
+                self._compact(int(self.max_bytes * COMPACT_TARGET_RATIO))
+
+    def get_or_compute(self, texts: List[str], model: str, normalization: str, compute_fn: Callable[[List[str]], Sequence]) -> np.ndarray:
+        """
+        查询缓存，未命中的文本（去重后）调用compute_fn计算并写入缓存
+        Returns:
+            np.ndarray: 与texts顺序一致的float32向量矩阵
+        """
+        if not texts:
+            return np.asarray(compute_fn([]), dtype=np.float32)
+        keys, results, miss_texts = self._lookup(texts, model, normalization)
+        if miss_texts:
+            self._fill(keys, results, miss_texts, compute_fn(miss_texts), model, normalization)
+        return np.stack(results)
+
+    async def aget_or_compute(self, texts: List[str], model: str, normalization: str, compute_fn: Callable[[List[str]], Awaitable[Sequence]]) -> np.ndarray:
+        """get_or_compute 的异步版本，compute_fn为异步函数"""
+        if not texts:
+            return np.asarray(await compute_fn([]), dtype=np.float32)
+        keys, results, miss_texts = self._lookup(texts, model, normalization)
+        if miss_texts:
+            self._fill(keys, results, miss_texts, await compute_fn(miss_texts), model, normalization)
+        return np.stack(results)
+
+    def _lookup(self, texts: List[str], model: str, normalization: str):
+        keys = [self.make_key(text, model, normalization) for text in texts]
+        results = self.get_many(keys)
+        miss_texts = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+        return keys, results, miss_texts
+
+    def _fill(self, keys: List[str], results: List[Optional[np.ndarray]], miss_texts: List[str], miss_vectors: Sequence, model: str, normalization: str) -> None:
+        miss_vectors = np.asarray(miss_vectors, dtype=np.float32)
+        miss_keys = [self.make_key(text, model, normalization) for text in miss_texts]
+        self.put_many(miss_keys, miss_vectors)
+        computed = dict(zip(miss_keys, miss_vectors))
+        for idx, key in enumerate(keys):
+            if results[idx] is None:
+                results[idx] = computed[key]
+
+    def _total_bytes(self) -> int:
+        return sum(vector_file.size_bytes() for vector_file in self._files.values())
+
+    def compact(self, target_bytes: Optional[int] = None) -> None:
+        """
+        手动压缩：按最近访问时间保留不超过target_bytes的向量（默认max_bytes），其余淘汰，
+        同时回收写入中断等原因产生的无索引向量行
+        """
+        with self._locked():
+            self._compact(self.max_bytes if target_bytes is None else target_bytes)
+
+    def _compact(self, target_bytes: int) -> None:
+        start = time.perf_counter()
+        # 按最近访问时间从新到旧保留，直到达到目标大小
+        keep: Dict[int, List[Tuple[str, int]]] = {}
+        evict_keys = []
+        kept_bytes = 0
+        for key, dim, slot in self._conn.execute("SELECT cache_key, dim, slot FROM embed_index ORDER BY last_access DESC"):
+            if kept_bytes + dim * 4 <= target_bytes:
+                kept_bytes += dim * 4
+                keep.setdefault(dim, []).append((key, slot))
+            else:
+                evict_keys.append(key)
+
+        # 保留的向量按原slot顺序拷贝到新一代文件
+        new_files: Dict[int, Tuple[int, _VectorFile]] = {}
+        slot_updates = []
+        generations = dict(self._conn.execute("SELECT dim, generation FROM embed_files").fetchall())
+        for dim, vector_file in self._files.items():
+            generation = generations.get(dim, 0) + 1
+            new_path = self._file_path(dim, generation)
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            new_file = _VectorFile(new_path, dim)
+            entries = sorted(keep.get(dim, []), key=lambda entry: entry[1])
+            for i in range(0, len(entries), _COMPACT_BATCH):
+                batch = entries[i:i + _COMPACT_BATCH]
+                new_start = new_file.append(vector_file.read([slot for _, slot in batch]))
+                slot_updates.extend((new_start + offset, key) for offset, (key, _) in enumerate(batch))
+            new_files[dim] = (generation, new_file)
+
+        # 索引和文件代号在同一事务内切换
+        try:
+            for i in range(0, len(evict_keys), _SQL_BATCH):
+                batch = evict_keys[i:i + _SQL_BATCH]
+                self._conn.execute(f"DELETE FROM embed_index WHERE cache_key IN ({','.join('?' * len(batch))})", batch)
+            self._conn.executemany("UPDATE embed_index SET slot = ? WHERE cache_key = ?", slot_updates)
+            self._conn.executemany(
+                "UPDATE embed_files SET generation = ? WHERE dim = ?",
+                [(generation, dim) for dim, (generation, _) in new_files.items()]
+            )
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            for _, new_file in new_files.values():
+                new_file.close()
+                _try_remove(new_file.path)
+            raise
+
+        before_bytes = self._total_bytes()
+        for dim, (generation, new_file) in new_files.items():
+            old_file = self._files[dim]
+            old_file.close()
+            self._files[dim] = new_file
+            self._generations[dim] = generation
+            # 其他进程在下次加锁访问时切换到新文件；删除失败（如Windows下仍被映射）时由后续启动清理
+            _try_remove(old_file.path)
+        self.compactions += 1
+        self.evicted += len(evict_keys)
+        print(f"embedding缓存压缩：淘汰{len(evict_keys)}条，{before_bytes / 1024 / 1024:.1f}MB -> {self._total_bytes() / 1024 / 1024:.1f}MB，耗时{time.perf_counter() - start:.2f}s")
+
+    def stats(self) -> Dict[str, float]:
+        with self._locked():
+            total = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM embed_index").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": entries,
+                "size_mb": round(self._total_bytes() / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "compactions": self.compactions,
+                "evicted": self.evicted
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            for vector_file in self._files.values():
+                vector_file.close()
+            self._conn.close()
+            self._process_lock.close()
+
+
+def _try_remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"删除embedding缓存文件失败：{path} - {e}")
+
+
+# 同一缓存目录在进程内只打开一次
+_embed_caches: Dict[str, EmbeddingCache] = {}
+_embed_caches_lock = threading.Lock()
+
+
+def get_embed_cache(path: str = DEFAULT_EMBED_CACHE_PATH, max_bytes: int = DEFAULT_EMBED_CACHE_MAX_BYTES) -> EmbeddingCache:
+    key = os.path.abspath(path)
+    with _embed_caches_lock:
+        if key not in _embed_caches:
+            _embed_caches[key] = EmbeddingCache(path, max_bytes=max_bytes)
+        return _embed_caches[key]
@@ -11,23 +11,29 @@ sys.path.insert(0, current_dir)
 sys.path.insert(0, parent_dir)
 sys.path.insert(0, pre_parent_dir)
 
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from langchain.embeddings.base import Embeddings
-import requests
+import httpx
 from typing import List, Optional
 from config import Settings
+from core.tools.embed_cache import EmbeddingCache, get_embed_cache
 
 class init_Embedding(Embeddings):
     """
     通过URL访问公司内部bge-m3模型服务
+    基于连接池复用HTTP连接，多个批次并发请求，结果按输入顺序拼接
     """
-    
+
     def __init__(
-        self, 
+        self,
         api_url: str,
         model_name: str,
         api_key: Optional[str] = None,
-        timeout: int = 30,
-        batch_size: int = 32
+        timeout: float = 30,
+        batch_size: int = 32,
+        max_concurrency: int = 4
     ):
         """
         Args:
@@ -36,13 +42,20 @@ class init_Embedding(Embeddings):
             api_key: API认证密钥（如果需要）
             timeout: API请求超时时间（秒）
             batch_size: 批处理大小，根据API限制调整
+            max_concurrency: 同时在途的批次请求数
         """
         self.api_url = api_url.rstrip("/")
         self.model_name = model_name
         self.api_key = api_key
         self.timeout = timeout
-        self.batch_size = batch_size
-        
+        self.batch_size = max(batch_size, 1)
+        self.max_concurrency = max(max_concurrency, 1)
+        self._limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        self.client = httpx.Client(timeout=timeout, limits=self._limits, headers=self._get_headers())
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") if self.max_concurrency > 1 else None
+        # 异步客户端绑定事件循环，按事件循环分别创建
+        self._async_clients = weakref.WeakKeyDictionary()
+
         # 验证API可用性
         self._validate_connection()
     
@@ -104,62 +117,149 @@ class init_Embedding(Embeddings):
         #     raise ConnectionError(f"无法连接到服务: {e}")
 
 
-    def _call_api(self, texts: List[str]) -> List[List[float]]:
-        """调用embedding API"""
+    def _payload(self, texts: List[str]) -> dict:
+        return {
+            "model": self.model_name,
+            "input": texts,
+            "normalize": True  # 确保向量归一化，对Milvus COSINE相似度很重要
+        }
+
+    @staticmethod
+    def _parse_response(result) -> List[List[float]]:
+        """解析响应（兼容OpenAI格式）"""
         try:
-            payload = {
-                "model": self.model_name,
-                "input": texts,
-                "normalize": True  # 确保向量归一化，对Milvus COSINE相似度很重要
-            }
-            
-            response = requests.post(
-                f"{self.api_url}",
-                json=payload,
-                headers=self._get_headers(),
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            
-            # 解析响应（兼容OpenAI格式）
-            result = response.json()
-            
             if "data" in result:
                 # OpenAI格式: {"data": [{"embedding": [...]}, ...]}
-                embeddings = [item["embedding"] for item in sorted(result["data"], key=lambda x: x["index"])]
-            elif "embeddings" in result:
+                return [item["embedding"] for item in sorted(result["data"], key=lambda x: x["index"])]
+            if "embeddings" in result:
                 # 自定义格式: {"embeddings": [[...], ...]}
-                embeddings = result["embeddings"]
-            else:
-                raise ValueError(f"API响应格式不支持: {result}")
-            
-            return embeddings
-            
-        except requests.exceptions.RequestException as e:
-            raise RuntimeError(f"API调用失败: {e}")
+                return result["embeddings"]
         except (KeyError, TypeError) as e:
             raise ValueError(f"API响应解析错误: {e}")
-    
+        raise ValueError(f"API响应格式不支持: {result}")
+
+    def _call_api(self, texts: List[str]) -> List[List[float]]:
+        """调用embedding API"""
+        try:
+            response = self.client.post(self.api_url, json=self._payload(texts))
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API调用失败: {e}")
+        return self._parse_response(result)
+
+    async def _acall_api(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, texts: List[str]) -> List[List[float]]:
+        """异步调用embedding API，由semaphore限制同时在途的请求数"""
+        async with semaphore:
+            try:
+                response = await client.post(self.api_url, json=self._payload(texts))
+                response.raise_for_status()
+                result = response.json()
+            except httpx.HTTPError as e:
+                raise RuntimeError(f"API调用失败: {e}")
+        return self._parse_response(result)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self._limits, headers=self._get_headers())
+            self._async_clients[loop] = client
+        return client
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
-        批量文档embedding
+        批量文档embedding：分批后最多max_concurrency个批次并发请求，结果按输入顺序拼接
         """
-        all_embeddings = []
-        
         # 分批处理，避免请求过大
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            batch_embeddings = self._call_api(batch)
+        batches = self._split_batches(texts)
+        if len(batches) <= 1 or self._executor is None:
+            results = [self._call_api(batch) for batch in batches]
+        else:
+            # executor.map 按提交顺序返回结果
+            results = self._executor.map(self._call_api, batches)
+        all_embeddings = []
+        for batch_embeddings in results:
             all_embeddings.extend(batch_embeddings)
-        
         return all_embeddings
-    
+
     def embed_query(self, text: str) -> List[float]:
         """
         单个查询embedding
         """
         return self.embed_documents([text])[0]
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        异步批量文档embedding：各批次并发请求（最多max_concurrency个在途），结果按输入顺序拼接
+        """
+        client = self._get_async_client()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self._acall_api(client, semaphore, batch) for batch in self._split_batches(texts)))
+        all_embeddings = []
+        for batch_embeddings in results:
+            all_embeddings.extend(batch_embeddings)
+        return all_embeddings
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        异步单个查询embedding
+        """
+        return (await self.aembed_documents([text]))[0]
+
+    def close(self) -> None:
+        """关闭连接池（异步客户端需在所属事件循环中通过 aclose 关闭）"""
+        self.client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的异步客户端"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带embedding磁盘缓存的Embeddings包装：已缓存的文本直接读取向量，未命中的文本去重后交给内层模型
+    命中与未命中返回的都是float32精度的向量，结果与缓存状态无关
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str, normalization: str = "normalize=True"):
+        """
+        Args:
+            embeddings: 内层embedding模型
+            cache: embedding缓存
+            model_name: 模型名称（缓存键的一部分）
+            normalization: 影响向量结果的参数（缓存键的一部分），init_Embedding 总是请求归一化向量
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.normalization = normalization
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(texts, self.model_name, self.normalization, self.embeddings.embed_documents).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查询向量可能与文档向量的计算方式不同（如查询指令前缀），单独缓存
+        vectors = self.cache.get_or_compute([text], self.model_name, f"{self.normalization};query", lambda texts: [self.embeddings.embed_query(texts[0])])
+        return vectors[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = await self.cache.aget_or_compute(texts, self.model_name, self.normalization, self.embeddings.aembed_documents)
+        return vectors.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def compute(texts: List[str]) -> List[List[float]]:
+            return [await self.embeddings.aembed_query(texts[0])]
+        vectors = await self.cache.aget_or_compute([text], self.model_name, f"{self.normalization};query", compute)
+        return vectors[0].tolist()
+
 
 def get_embedding(settings: Settings) -> Embeddings:
     """
@@ -174,11 +274,18 @@ def get_embedding(settings: Settings) -> Embeddings:
     Returns:
         Embeddings: 初始化后的embedding模型实例
     """
-    return init_Embedding(
+    embeddings = init_Embedding(
         api_url=settings.embed.base_url,
         model_name=settings.embed.model,
-        api_key="None"
+        api_key="None",
+        timeout=settings.embed.timeout,
+        batch_size=settings.embed.batch_size,
+        max_concurrency=settings.embed.max_concurrency
     )
+    if not settings.embed.cache_enabled:
+        return embeddings
+    cache = get_embed_cache(settings.embed.cache_path, max_bytes=settings.embed.cache_max_mb * 1024 * 1024)
+    return CachedEmbeddings(embeddings, cache, model_name=settings.embed.model)
 
 if __name__ == "__main__":
     settings = Settings()
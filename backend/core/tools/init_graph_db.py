@@ -8,6 +8,7 @@ sys.path.insert(0, current_dir)
 sys.path.insert(0, parent_dir)
 sys.path.insert(0, pre_parent_dir)
 
+from typing import List, Optional, Set, Tuple
 from langchain_community.graphs import Neo4jGraph
 from config import Settings
 
@@ -19,12 +20,83 @@ def init_neo4j_graph(url: str, user: str, password: str,database: str) -> Neo4jG
         database=database
     )
 
-def get_graph_db(settings: Settings) -> Neo4jGraph:
+def get_graph_db(settings: Settings, ensure_schema: bool = True) -> Neo4jGraph:
     url = settings.graph_store.uri
     user = settings.graph_store.user
     password = settings.graph_store.password
     database = settings.graph_store.database
-    return init_neo4j_graph(url, user, password,database)
+    graph_db = init_neo4j_graph(url, user, password,database)
+    if ensure_schema:
+        ensure_graph_schema(graph_db, settings.graph_store.biz_label)
+    return graph_db
+
+def graph_schema_statements(biz_label: str) -> List[Tuple[str, str]]:
+    """
+    图数据库约束和索引定义，返回(名称, 创建语句)列表
+    - Entity.name / Chunk.chunk_id 唯一约束：支撑 MERGE (e:Entity {name}) / MERGE (c:Chunk {chunk_id})
+    - biz_label 上的 name / chunk_id 索引：支撑检索时 (:Chunk:biz_label) / (:Entity:biz_label) 的查找
+    - RELATION.name 关系索引：支撑 MERGE (a)-[:RELATION {name}]->(b)
+    """
+    return [
+        ("entity_name_unique",
+         "CREATE CONSTRAINT entity_name_unique IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE"),
+        ("chunk_id_unique",
+         "CREATE CONSTRAINT chunk_id_unique IF NOT EXISTS FOR (c:Chunk) REQUIRE c.chunk_id IS UNIQUE"),
+        (f"{biz_label}_name_index",
+         f"CREATE INDEX `{biz_label}_name_index` IF NOT EXISTS FOR (n:`{biz_label}`) ON (n.name)"),
+        (f"{biz_label}_chunk_id_index",
+         f"CREATE INDEX `{biz_label}_chunk_id_index` IF NOT EXISTS FOR (n:`{biz_label}`) ON (n.chunk_id)"),
+        ("relation_name_index",
+         "CREATE INDEX relation_name_index IF NOT EXISTS FOR ()-[r:RELATION]-() ON (r.name)"),
+    ]
+
+def _schema_names(graph_db: Neo4jGraph) -> Optional[Set[str]]:
+    """读取图数据库中已有的约束和索引名称，读取失败返回None"""
+    names = set()
+    for show_query in ["SHOW CONSTRAINTS YIELD name RETURN name", "SHOW INDEXES YIELD name RETURN name"]:
+        try:
+            names.update(item["name"] for item in graph_db.query(show_query))
+        except Exception as e:
+            print(f"读取图数据库schema失败：{e}")
+            return None
+    return names
+
+def ensure_graph_schema(graph_db: Neo4jGraph, biz_label: str) -> List[str]:
+    """
+    幂等地创建约束和索引（已存在的跳过）
+    是否新建以执行前后的 SHOW CONSTRAINTS/INDEXES 为准：已有其他名称的等价约束/索引时，
+    IF NOT EXISTS 不会创建，不计入新建
+    
+    Args:
+        graph_db: 图数据库实例
+        biz_label: 知识库标签
+        
+    Returns:
+        list: 本次新创建的约束/索引名称
+    """
+    existing = _schema_names(graph_db) or set()
+    statements = [(name, statement) for name, statement in graph_schema_statements(biz_label) if name not in existing]
+    if not statements:
+        return []
+
+    for name, statement in statements:
+        try:
+            graph_db.query(statement)
+        except Exception as e:
+            # 例如已有重复数据导致唯一约束无法创建，不影响后续流程
+            print(f"创建图数据库约束/索引 {name} 失败：{e}")
+
+    after = _schema_names(graph_db)
+    if after is None:
+        print("无法确认图数据库schema的创建结果")
+        return []
+    created = [name for name, statement in statements if name in after]
+    skipped = [name for name, statement in statements if name not in after]
+    if created:
+        print(f"图数据库schema初始化完成，新建约束/索引：{created}")
+    if skipped:
+        print(f"未新建约束/索引（已有等价的约束/索引或创建失败）：{skipped}")
+    return created
 
 def check_neo4j_details(graph_db):
     """适配多种 Neo4jGraph 实现的检查函数"""
@@ -1,5 +1,6 @@
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.extras import execute_values, Json
 
 import sys
 import os
@@ -11,6 +12,8 @@ sys.path.insert(0, current_dir)
 sys.path.insert(0, parent_dir)
 sys.path.insert(0, pre_parent_dir)
 
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 from config import Settings
 
 class PostgresDB:
@@ -117,6 +120,269 @@ class PostgresDB:
         self.conn.close()
         print("\n🔌 数据库连接已关闭")
 
+class PgTaskQueue:
+    """
+    基于Postgres任务表的文本块入库队列，供多个worker进程/机器并行领取：
+    - 领取使用 SELECT ... FOR UPDATE SKIP LOCKED，并发领取互不阻塞、不会重复
+    - 领取后持有租约（lease_expires_at），worker崩溃时租约过期，任务可被重新领取
+    - 每次领取计一次尝试，超过 max_attempts 的任务标记为failed
+    每个线程应使用独立的PgTaskQueue实例（独立连接）
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.conn = psycopg2.connect(
+            host=settings.pg.host,
+            port=settings.pg.port,
+            user=settings.pg.user,
+            password=settings.pg.password,
+            database=settings.pg.database
+        )
+
+    def create_tables(self) -> None:
+        """创建任务表（已存在则跳过）"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_tasks (
+                id BIGSERIAL PRIMARY KEY,
+                kb_name VARCHAR(200) NOT NULL,
+                doc_id VARCHAR(500) NOT NULL,
+                chunk_id VARCHAR(64) NOT NULL,
+                chunk_text TEXT NOT NULL,
+                file_params JSONB NOT NULL DEFAULT '{}'::jsonb,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                max_attempts INT NOT NULL DEFAULT 3,
+                lease_owner VARCHAR(200),
+                lease_expires_at TIMESTAMPTZ,
+                last_error TEXT,
+                created_at TIMESTAMPTZ DEFAULT now(),
+                updated_at TIMESTAMPTZ DEFAULT now(),
+                UNIQUE (kb_name, chunk_id)
+            );
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS ingest_tasks_claim_idx
+            ON ingest_tasks (kb_name, status, id)
+            WHERE status IN ('pending', 'leased');
+            """)
+            # 文档版本：当前版本的文本块ID及内容指纹，written_chunk_ids为上次收尾时已写入知识库的文本块ID，
+            # 文档的全部任务结束后由一个worker收尾（删除旧文本块、登记文档）并标记finalized
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_documents (
+                kb_name VARCHAR(200) NOT NULL,
+                doc_id VARCHAR(500) NOT NULL,
+                content_hash VARCHAR(64) NOT NULL,
+                chunk_ids TEXT[] NOT NULL,
+                written_chunk_ids TEXT[] NOT NULL DEFAULT '{}',
+                finalized BOOLEAN NOT NULL DEFAULT false,
+                updated_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (kb_name, doc_id)
+            );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS ingest_tasks_doc_idx ON ingest_tasks (kb_name, doc_id)")
+        self.conn.commit()
+
+    @staticmethod
+    def _insert_tasks(cur, kb_name: str, doc_id: str, chunks: List[Tuple[str, str]], file_params: Optional[dict], max_attempts: int) -> Tuple[int, int]:
+        """插入文本块任务（已失败的任务重置为待处理），返回(新加入数, 重新加入数)，不提交事务"""
+        if not chunks:
+            return 0, 0
+        rows = [(kb_name, doc_id, chunk_id, text, Json(file_params or {}), max_attempts) for chunk_id, text in chunks]
+        # xmax = 0 表示本次插入的新行，否则为冲突后更新的行
+        results = execute_values(cur, """
+        INSERT INTO ingest_tasks AS t (kb_name, doc_id, chunk_id, chunk_text, file_params, max_attempts)
+        VALUES %s
+        ON CONFLICT (kb_name, chunk_id) DO UPDATE
+        SET status = 'pending', attempts = 0, doc_id = EXCLUDED.doc_id, chunk_text = EXCLUDED.chunk_text,
+            file_params = EXCLUDED.file_params, max_attempts = EXCLUDED.max_attempts,
+            lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, updated_at = now()
+        WHERE t.status = 'failed'
+        RETURNING (t.xmax = 0) AS inserted
+        """, rows, fetch=True)
+        inserted = sum(1 for row in results if row[0])
+        return inserted, len(results) - inserted
+
+    def enqueue_chunks(self, kb_name: str, doc_id: str, chunks: List[Tuple[str, str]], file_params: Optional[dict] = None, max_attempts: int = 3) -> Tuple[int, int]:
+        """
+        批量加入文本块任务：(kb_name, chunk_id) 不存在时新建任务，已失败的任务重置为待处理（重新计数尝试次数），
+        待处理、处理中及已完成的任务保持不变
+        Args:
+            chunks: (文本块ID, 文本块) 列表
+        Returns:
+            (新加入的任务数, 重新加入的失败任务数)
+        """
+        with self.conn.cursor() as cur:
+            counts = self._insert_tasks(cur, kb_name, doc_id, chunks, file_params, max_attempts)
+        self.conn.commit()
+        return counts
+
+    def enqueue_document(self, kb_name: str, doc_id: str, content_hash: str, chunks: List[Tuple[str, str]], file_params: Optional[dict] = None, max_attempts: int = 3) -> Tuple[int, int]:
+        """
+        加入文档的文本块任务并记录文档当前版本（同一事务）：
+        - 删除旧版本中尚未处理的任务
+        - 有新加入或重新加入的任务、或文本块集合变化时，文档回到未收尾状态
+        Returns:
+            (新加入的任务数, 重新加入的失败任务数)
+        """
+        chunk_ids = sorted(chunk_id for chunk_id, text in chunks)
+        with self.conn.cursor() as cur:
+            inserted, requeued = self._insert_tasks(cur, kb_name, doc_id, chunks, file_params, max_attempts)
+            cur.execute("""
+            DELETE FROM ingest_tasks
+            WHERE kb_name = %s AND doc_id = %s AND status = 'pending' AND NOT (chunk_id = ANY(%s))
+            """, (kb_name, doc_id, chunk_ids))
+            # 更新文档行时持有行锁，与 finalize_document 互斥
+            cur.execute("""
+            INSERT INTO ingest_documents AS d (kb_name, doc_id, content_hash, chunk_ids)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (kb_name, doc_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash, chunk_ids = EXCLUDED.chunk_ids,
+                finalized = d.finalized AND d.chunk_ids = EXCLUDED.chunk_ids AND NOT %s,
+                updated_at = now()
+            """, (kb_name, doc_id, content_hash, chunk_ids, inserted + requeued > 0))
+        self.conn.commit()
+        return inserted, requeued
+
+    @contextmanager
+    def finalize_document(self, kb_name: str, doc_id: str):
+        """
+        文档收尾：锁定文档行（SELECT ... FOR UPDATE），文档尚未收尾且其全部任务（含旧版本的任务）已结束时产出
+        {"content_hash", "chunk_ids", "done_chunk_ids", "stale_chunk_ids"}，否则产出None；
+        with块正常结束后删除旧文本块的任务，记录已写入的文本块并标记finalized后提交，异常时回滚。
+        多个worker同时收尾同一文档时只有一个执行
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                SELECT content_hash, chunk_ids, written_chunk_ids, finalized FROM ingest_documents
+                WHERE kb_name = %s AND doc_id = %s
+                FOR UPDATE
+                """, (kb_name, doc_id))
+                row = cur.fetchone()
+                document = None
+                if row is not None and not row[3]:
+                    cur.execute("SELECT chunk_id, status FROM ingest_tasks WHERE kb_name = %s AND doc_id = %s", (kb_name, doc_id))
+                    statuses = dict(cur.fetchall())
+                    if not any(status in ("pending", "leased") for status in statuses.values()):
+                        chunk_ids = list(row[1])
+                        current = set(chunk_ids)
+                        document = {
+                            "content_hash": row[0],
+                            "chunk_ids": chunk_ids,
+                            "done_chunk_ids": [chunk_id for chunk_id in chunk_ids if statuses.get(chunk_id) == "done"],
+                            # 上次收尾时已写入的文本块及旧版本任务写入的文本块中，不属于当前版本的部分
+                            "stale_chunk_ids": sorted((set(row[2]) | set(statuses)) - current)
+                        }
+                yield document
+                if document is not None:
+                    # 删除旧文本块的任务，文档恢复为旧内容后这些文本块可重新加入
+                    cur.execute("DELETE FROM ingest_tasks WHERE kb_name = %s AND chunk_id = ANY(%s)", (kb_name, document["stale_chunk_ids"]))
+                    cur.execute("""
+                    UPDATE ingest_documents SET written_chunk_ids = chunk_ids, finalized = true, updated_at = now()
+                    WHERE kb_name = %s AND doc_id = %s
+                    """, (kb_name, doc_id))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def claim(self, kb_name: str, worker_id: str, batch_size: int = 32, lease_seconds: int = 600) -> List[Dict]:
+        """
+        领取一批任务：待处理的任务，或租约已过期且仍可重试的任务
+        Returns:
+            list: 任务字典（id, doc_id, chunk_id, chunk_text, file_params, attempts）
+        """
+        with self.conn.cursor() as cur:
+            # 租约过期且已达到尝试上限的任务不再领取
+            cur.execute("""
+            UPDATE ingest_tasks
+            SET status = 'failed', lease_owner = NULL, updated_at = now(),
+                last_error = coalesce(last_error, 'lease expired')
+            WHERE kb_name = %s AND status = 'leased' AND lease_expires_at < now() AND attempts >= max_attempts
+            """, (kb_name,))
+            cur.execute("""
+            WITH claimed AS (
+                SELECT id FROM ingest_tasks
+                WHERE kb_name = %s
+                  AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < now()))
+                  AND attempts < max_attempts
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE ingest_tasks t
+            SET status = 'leased', lease_owner = %s, attempts = t.attempts + 1,
+                lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+            FROM claimed
+            WHERE t.id = claimed.id
+            RETURNING t.id, t.doc_id, t.chunk_id, t.chunk_text, t.file_params, t.attempts
+            """, (kb_name, batch_size, worker_id, lease_seconds))
+            rows = cur.fetchall()
+        self.conn.commit()
+        return [
+            {"id": row[0], "doc_id": row[1], "chunk_id": row[2], "chunk_text": row[3], "file_params": row[4], "attempts": row[5]}
+            for row in sorted(rows)
+        ]
+
+    def extend_lease(self, task_ids: List[int], worker_id: str, lease_seconds: int = 600) -> int:
+        """续租仍在处理中的任务，返回续租成功的任务数（租约已被他人接管的任务不续租）"""
+        if not task_ids:
+            return 0
+        with self.conn.cursor() as cur:
+            cur.execute("""
+            UPDATE ingest_tasks
+            SET lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+            WHERE id = ANY(%s) AND status = 'leased' AND lease_owner = %s
+            """, (lease_seconds, list(task_ids), worker_id))
+            count = cur.rowcount
+        self.conn.commit()
+        return count
+
+    def complete(self, task_ids: List[int], worker_id: str) -> int:
+        """标记任务完成"""
+        if not task_ids:
+            return 0
+        with self.conn.cursor() as cur:
+            cur.execute("""
+            UPDATE ingest_tasks
+            SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, updated_at = now()
+            WHERE id = ANY(%s) AND lease_owner = %s
+            """, (list(task_ids), worker_id))
+            count = cur.rowcount
+        self.conn.commit()
+        return count
+
+    def fail(self, task_ids: List[int], worker_id: str, error: str = "") -> int:
+        """标记任务失败：未达到尝试上限的任务回到pending等待重试，否则标记为failed"""
+        if not task_ids:
+            return 0
+        with self.conn.cursor() as cur:
+            cur.execute("""
+            UPDATE ingest_tasks
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                lease_owner = NULL, lease_expires_at = NULL, last_error = %s, updated_at = now()
+            WHERE id = ANY(%s) AND lease_owner = %s
+            """, (error[:2000], list(task_ids), worker_id))
+            count = cur.rowcount
+        self.conn.commit()
+        return count
+
+    def stats(self, kb_name: Optional[str] = None) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self.conn.cursor() as cur:
+            if kb_name:
+                cur.execute("SELECT status, count(*) FROM ingest_tasks WHERE kb_name = %s GROUP BY status", (kb_name,))
+            else:
+                cur.execute("SELECT status, count(*) FROM ingest_tasks GROUP BY status")
+            rows = cur.fetchall()
+        self.conn.commit()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
 # 3. 主程序执行
 if __name__ == "__main__":
     settings = Settings()
@@ -17,7 +17,8 @@ from pymilvus import MilvusClient, settings
 from langchain.embeddings.base import Embeddings
 
 from pymilvus import Collection, utility, connections, FieldSchema, CollectionSchema, DataType
-from typing import Any
+from typing import Any, Dict
+import threading
 
 class VectorDB:
     def __init__(self, settings: Settings, embeddings: Embeddings):
@@ -114,6 +115,22 @@ def quick_verify(settings: Settings, milvus_db: Milvus) -> bool:
         print(f"❌ 验证失败: {e}")
         return False
 
+# 进程级MilvusClient连接池：按uri复用，避免每次查询重建gRPC连接
+_milvus_clients: Dict[str, MilvusClient] = {}
+_milvus_clients_lock = threading.Lock()
+
+def get_milvus_client(settings: Settings) -> MilvusClient:
+    """获取（或创建）与配置uri对应的共享MilvusClient"""
+    uri = f"http://{settings.vector_store.host}:{settings.vector_store.port}"
+    client = _milvus_clients.get(uri)
+    if client is None:
+        with _milvus_clients_lock:
+            client = _milvus_clients.get(uri)
+            if client is None:
+                client = MilvusClient(uri=uri)
+                _milvus_clients[uri] = client
+    return client
+
 # ---------------------- 核心：纯 ID 精确查询方法 ----------------------
 def query_by_ids(settings: Settings, ids: list) -> list[Document]:
     """
@@ -121,12 +138,11 @@ def query_by_ids(settings: Settings, ids: list) -> list[Document]:
     :param ids: 要查询的 ID 列表（如 [1,2,3] 或 ["chunk_1", "chunk_2"]）
     :return: LangChain Document 列表（兼容原有 LangChain 流程）
     """
-    MILVUS_URI = f"http://{settings.vector_store.host}:{settings.vector_store.port}"
     COLLECTION_NAME = settings.vector_store.collection_name
     ID_FIELD = "pk"
     TEXT_FIELD = "text"
     METADATA_FIELD = "metadata"
-    milvus_client = MilvusClient(uri=MILVUS_URI)
+    milvus_client = get_milvus_client(settings)
     # 边界检查
     if not isinstance(ids, list) or len(ids) == 0:
         return []
@@ -0,0 +1,66 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+pre_parent_dir = os.path.dirname(parent_dir)
+sys.path.insert(0, current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, pre_parent_dir)
+
+import argparse
+from langchain_community.graphs import Neo4jGraph
+from config import Settings
+from core.tools.init_graph_db import get_graph_db
+
+
+def migrate_entity_chunk_ids(graph_db: Neo4jGraph, biz_label: str, batch_size: int = 500) -> int:
+    """
+    将旧版 Entity.chunk_ids 列表属性迁移为 (Chunk)-[:CONTAINS]->(Entity) 关系，并删除该属性
+
+    Args:
+        graph_db: 图数据库实例
+        biz_label: 知识库标签
+        batch_size: 每个事务处理的实体数量
+
+    Returns:
+        int: 迁移的实体数量
+    """
+    # 补齐缺失的CONTAINS关系后移除列表属性；找不到对应Chunk的ID直接丢弃
+    migrate_query = f"""
+    MATCH (e:Entity:{biz_label})
+    WHERE e.chunk_ids IS NOT NULL
+    WITH e LIMIT $batch_size
+    OPTIONAL MATCH (c:Chunk)
+    WHERE c.chunk_id IN e.chunk_ids
+    FOREACH (_ IN CASE WHEN c IS NULL THEN [] ELSE [1] END | MERGE (c)-[:CONTAINS]->(e))
+    WITH DISTINCT e
+    REMOVE e.chunk_ids
+    RETURN count(e) AS migrated
+    """
+    total = 0
+    while True:
+        res = graph_db.query(migrate_query, params={"batch_size": batch_size})
+        migrated = res[0]["migrated"] if res else 0
+        if not migrated:
+            break
+        total += migrated
+        print(f"已迁移 {total} 个实体")
+    print(f"知识库 {biz_label} 迁移完成，共迁移 {total} 个实体的chunk_ids")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将Entity.chunk_ids列表属性迁移为CONTAINS关系")
+    parser.add_argument("--biz-label", default=None, help="知识库标签，默认使用配置中的biz_label")
+    parser.add_argument("--uri", default=None, help="Neo4j地址，默认使用配置中的uri")
+    parser.add_argument("--batch-size", type=int, default=500, help="每个事务处理的实体数量")
+    args = parser.parse_args()
+
+    settings = Settings()
+    if args.biz_label:
+        settings.graph_store.biz_label = args.biz_label
+    if args.uri:
+        settings.graph_store.uri = args.uri
+    graph_db = get_graph_db(settings)
+    migrate_entity_chunk_ids(graph_db, settings.graph_store.biz_label, batch_size=args.batch_size)
@@ -8,18 +8,29 @@ from config import Settings
 
 # 导入知识库管理服务
 from service.knowledge_base_manager import KnowledgeBaseManager
-# 导入索引服务
-from service.index_service import IndexService
 # 导入向量数据库管理服务
 from service.vector_db_manager import VectorDBManager
 # 导入图数据库管理服务
 from service.graph_db_manager import GraphDBManager
-# 导入检索服务
-from service.retrieval_service import RetrievalService
+# 导入服务注册表
+from service.service_registry import ServiceRegistry
+# 导入后台入库任务管理
+from service.job_manager import JobManager
+# 导入重排模型注册表
+from core.retrieval.rerank import get_rerank_model
+# 导入查询向量缓存统计
+from core.retrieval.query_cache import query_cache_stats
 
 # 初始化知识库管理器
 kb_manager = KnowledgeBaseManager()
 
+# 全局服务注册表：按知识库复用LLM/Embedding/向量库/图库客户端及服务实例
+_service_settings = Settings().service
+service_registry = ServiceRegistry(max_kbs=_service_settings.max_kbs, idle_ttl=_service_settings.idle_ttl)
+
+# 后台入库任务管理：上传接口立即返回任务ID，入库在后台线程池中执行
+job_manager = JobManager(service_registry, max_workers=_service_settings.job_workers)
+
 # 全局索引服务实例
 # index_service = None
 
@@ -79,7 +90,20 @@ async def startup_event():
     #     }
     # })
     print("IndexService初始化完成")
+
+    # 预加载重排模型，避免首个检索请求承担模型加载耗时
+    rerank_settings = Settings().rerank
+    if rerank_settings.warmup and (rerank_settings.backend == "local" or rerank_settings.fallback_local):
+        try:
+            await asyncio.to_thread(get_rerank_model, rerank_settings.local_model_path, None, True)
+            print("重排模型预加载完成")
+        except Exception as e:
+            print(f"重排模型预加载失败：{e}")
     
+    # 恢复服务重启前未完成的入库任务（从检查点继续）
+    resumed_jobs = await asyncio.to_thread(job_manager.resume_jobs)
+    print(f"恢复入库任务{len(resumed_jobs)}个")
+
     # 初始化检索服务
     # global retrieval_service
     # retrieval_service = RetrievalService()
@@ -108,19 +132,17 @@ async def upload_file(file: UploadFile = File(...)):
         with open(temp_file_path, "r", encoding="utf-8") as f:
             file_content = f.read()
         
-        # 使用索引服务处理文件内容（异步调用）
-        index_service = IndexService(settings=Settings())
-        process_result = await asyncio.to_thread(index_service.process_text, file_content)
+        # 提交后台入库任务，立即返回任务ID
+        job_id = await asyncio.to_thread(job_manager.submit, Settings(), file_content, file.filename)
         
         # 删除临时文件
         Path(temp_file_path).unlink()
         
         return {
             "code": 200, 
-            "msg": f"文件 {file.filename} 上传并处理完成", 
+            "msg": f"文件 {file.filename} 上传成功，已提交入库任务", 
             "data": {
-                "chunks_count": len(process_result['chunks']),
-                "node_count": process_result['graph_info']['node_count']
+                "job_id": job_id
             }
         }
     except Exception as e:
@@ -135,23 +157,31 @@ async def add_text(text: str = Query(...)):
     # if not index_service:
     #     return {"code": 500, "msg": "IndexService未初始化", "data": None}
     try:
-        # 使用索引服务处理文本内容（异步调用）
-        index_service = IndexService(settings=Settings())
-        process_result = await asyncio.to_thread(index_service.process_text, text)
+        # 提交后台入库任务，立即返回任务ID
+        job_id = await asyncio.to_thread(job_manager.submit, Settings(), text)
         
         return {
             "code": 200, 
-            "msg": "文本导入并处理完成", 
+            "msg": "文本已提交入库任务", 
             "data": {
-                "chunks_count": len(process_result['chunks']),
-                # "triples_count": len(process_result['graph_triples']),
-                "node_count": process_result['graph_info']['node_count']
+                "job_id": job_id
             }
         }
     except Exception as e:
         return {"code": 500, "msg": f"文本导入失败：{str(e)}", "data": None}
 
 
+# 3. 入库任务查询接口：任务状态、文本块进度及各阶段统计
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    try:
+        job = await asyncio.to_thread(job_manager.get_job, job_id)
+        if not job:
+            return {"code": 404, "msg": "入库任务不存在", "data": None}
+        return {"code": 200, "msg": "获取入库任务成功", "data": job}
+    except Exception as e:
+        return {"code": 500, "msg": f"获取入库任务失败：{str(e)}", "data": None}
+
 
 # 知识库管理API
 # 1. 创建知识库
@@ -302,7 +332,8 @@ async def get_latest_vectors(limit: int = Query(20, ge=1, le=100)):
 @app.get("/graph-db/nodes")
 async def get_all_graph_nodes():
     try:
-        graph_db_manager = GraphDBManager(settings=Settings())
+        settings = Settings()
+        graph_db_manager = GraphDBManager(settings=settings, graph_db=service_registry.get_graph_db(settings))
         nodes = await asyncio.to_thread(graph_db_manager.get_all_nodes)
         return {
             "code": 200,
@@ -316,7 +347,8 @@ async def get_all_graph_nodes():
 @app.get("/graph-db/relationships")
 async def get_all_graph_relationships():
     try:
-        graph_db_manager = GraphDBManager(settings=Settings())
+        settings = Settings()
+        graph_db_manager = GraphDBManager(settings=settings, graph_db=service_registry.get_graph_db(settings))
         relationships = await asyncio.to_thread(graph_db_manager.get_all_relationships)
         return {
             "code": 200,
@@ -330,7 +362,8 @@ async def get_all_graph_relationships():
 @app.get("/graph-db/all")
 async def get_all_graph_data():
     try:
-        graph_db_manager = GraphDBManager(settings=Settings())
+        settings = Settings()
+        graph_db_manager = GraphDBManager(settings=settings, graph_db=service_registry.get_graph_db(settings))
         graph_data = await asyncio.to_thread(graph_db_manager.get_graph_data)
         return {
             "code": 200,
@@ -344,7 +377,8 @@ async def get_all_graph_data():
 @app.get("/graph-db/stats")
 async def get_graph_stats():
     try:
-        graph_db_manager = GraphDBManager(settings=Settings())
+        settings = Settings()
+        graph_db_manager = GraphDBManager(settings=settings, graph_db=service_registry.get_graph_db(settings))
         stats = await asyncio.to_thread(graph_db_manager.get_graph_stats)
         return {
             "code": 200,
@@ -358,7 +392,8 @@ async def get_graph_stats():
 @app.get("/graph-db/nodesById")
 async def get_graph_nodes_by_id(chunk_id: str = Query(...)):
     try:
-        graph_db_manager = GraphDBManager(settings=Settings())
+        settings = Settings()
+        graph_db_manager = GraphDBManager(settings=settings, graph_db=service_registry.get_graph_db(settings))
         nodes = await asyncio.to_thread(graph_db_manager.get_graph_data_by_id, chunk_id)
         return {
             "code": 200,
@@ -376,7 +411,7 @@ async def retrieval(query: str = Query(...)):
     
     try:
         # 处理查询
-        retrieval_service = RetrievalService(settings=Settings())
+        retrieval_service = await asyncio.to_thread(service_registry.get_retrieval_service, Settings())
         results,vector_chunks,extended_chunks = await asyncio.to_thread(retrieval_service.process_query, query)
         return {
             "code": 200,
@@ -408,7 +443,7 @@ async def kb_search(request: KnowledgeBaseSearchRequest):
         settings.graph_store.biz_label = request.library_name
         settings.vector_store.collection_name = request.library_name
         
-        kb_retrieval_service = RetrievalService(settings)
+        kb_retrieval_service = await asyncio.to_thread(service_registry.get_retrieval_service, settings)
         results, vector_chunks, extended_chunks = kb_retrieval_service.process_query(request.query, request.search_method)
         
         context = []
@@ -437,6 +472,15 @@ async def kb_search(request: KnowledgeBaseSearchRequest):
     except Exception as e:
         return {"code": 500, "msg": f"检索失败：{str(e)}", "data": None}
 
+# 查询向量缓存统计（命中率等）
+@app.get("/kb/search/cache-stats")
+async def get_search_cache_stats():
+    return {
+        "code": 200,
+        "msg": "获取查询向量缓存统计成功",
+        "data": query_cache_stats()
+    }
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,181 @@
+import sys
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional
+
+# 将backend目录添加到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Settings
+from core.indexing.chunking import kps_text_splitter
+from core.indexing.chunk.content_split import content_split_run
+from service.index_service import IndexService, get_file_params
+
+SUPPORTED_EXTENSIONS = (".md", ".txt", ".docx")
+
+
+def iter_files(root_dir: str, extensions=SUPPORTED_EXTENSIONS):
+    """递归遍历目录，按路径顺序返回支持的文件"""
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.startswith("~$"):
+                # 跳过Office临时文件
+                continue
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.join(dirpath, filename)
+
+
+def load_and_chunk(file_path: str, chunk_size: int, chunk_overlap: int) -> Dict:
+    """
+    读取并分块单个文件（在子进程中执行）：
+    .md 按markdown结构分块，.txt/.docx 按文本分块，与 IndexService.process_md/process_text 一致
+    """
+    start = time.perf_counter()
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == ".docx":
+        from docx import Document
+        doc = Document(file_path)
+        text = '\n'.join([para.text for para in doc.paragraphs])
+    else:
+        with open(file_path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+    if file_ext == ".md":
+        split_mode = "md"
+        chunks = content_split_run(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    else:
+        split_mode = "text"
+        chunks = kps_text_splitter(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return {
+        "file_path": file_path,
+        "doc_id": os.path.basename(file_path),
+        "text": text,
+        "chunks": chunks,
+        "split_mode": split_mode,
+        "file_params": get_file_params(file_path),
+        "parse_seconds": time.perf_counter() - start
+    }
+
+
+def bulk_ingest(settings: Settings, root_dir: str, workers: int = 4, max_inflight: Optional[int] = None, dry_run: bool = False) -> Dict:
+    """
+    批量入库目录下的所有文件：
+    子进程池并行读取和分块，主进程按完成顺序逐个文档送入入库流水线；
+    已分块但未入库的文档数不超过max_inflight，内存占用有上界
+    Args:
+        root_dir: 待入库目录
+        workers: 分块子进程数
+        max_inflight: 同时在分块或等待入库的文档数上限，默认 workers*2
+        dry_run: 只分块，不入库
+    Returns:
+        dict: 吞吐统计
+    """
+    max_inflight = max(max_inflight or workers * 2, 1)
+    index_service = None if dry_run else IndexService(settings)
+    split = settings.split
+    summary = {
+        "files": 0,
+        "failed_files": [],
+        "bytes": 0,
+        "chunks": 0,
+        "new_chunks": 0,
+        "failed_chunks": 0,
+        "parse_seconds": 0.0,
+        "index_seconds": 0.0
+    }
+    start = time.perf_counter()
+    files = iter_files(root_dir)
+
+    # 主进程已持有Neo4j驱动线程和Milvus gRPC连接，fork出的子进程可能死锁，子进程改用spawn方式启动
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        inflight = {}
+
+        def submit_next() -> bool:
+            file_path = next(files, None)
+            if file_path is None:
+                return False
+            inflight[executor.submit(load_and_chunk, file_path, split.chunk_size, split.chunk_overlap)] = file_path
+            return True
+
+        while len(inflight) < max_inflight and submit_next():
+            pass
+
+        while inflight:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = inflight.pop(future)
+                try:
+                    document = future.result()
+                except Exception as e:
+                    print(f"文件分块失败：{file_path} - {e}")
+                    summary["failed_files"].append(file_path)
+                    continue
+                summary["files"] += 1
+                summary["bytes"] += len(document["text"].encode("utf-8"))
+                summary["chunks"] += len(document["chunks"])
+                summary["parse_seconds"] += document["parse_seconds"]
+                print(f"[{summary['files']}] {document['doc_id']}：{len(document['chunks'])}个文本块")
+                if index_service is None:
+                    continue
+
+                index_start = time.perf_counter()
+                try:
+                    result = index_service.process_chunks(
+                        document["text"],
+                        document["chunks"],
+                        document["file_params"],
+                        doc_id=document["doc_id"],
+                        split_mode=document["split_mode"]
+                    )
+                    summary["new_chunks"] += result["new_chunks_count"]
+                    summary["failed_chunks"] += result["failed_chunks_count"]
+                except Exception as e:
+                    print(f"文件入库失败：{file_path} - {e}")
+                    summary["failed_files"].append(file_path)
+                summary["index_seconds"] += time.perf_counter() - index_start
+            # 入库完成后再提交新的分块任务，保持在途文档数不超过上限
+            while len(inflight) < max_inflight and submit_next():
+                pass
+
+    elapsed = time.perf_counter() - start
+    summary["elapsed_seconds"] = round(elapsed, 2)
+    summary["files_per_second"] = round(summary["files"] / elapsed, 3) if elapsed > 0 else 0.0
+    summary["chunks_per_second"] = round(summary["chunks"] / elapsed, 2) if elapsed > 0 else 0.0
+    summary["mb_per_second"] = round(summary["bytes"] / 1024 / 1024 / elapsed, 3) if elapsed > 0 else 0.0
+    summary["parse_seconds"] = round(summary["parse_seconds"], 2)
+    summary["index_seconds"] = round(summary["index_seconds"], 2)
+    return summary
+
+
+def print_summary(summary: Dict) -> None:
+    print("\n批量入库完成：")
+    print(f"  文件数：{summary['files']}（失败 {len(summary['failed_files'])}）")
+    print(f"  文本块数：{summary['chunks']}（新增/变化 {summary['new_chunks']}，抽取失败 {summary['failed_chunks']}）")
+    print(f"  总耗时：{summary['elapsed_seconds']}s（分块累计 {summary['parse_seconds']}s，入库累计 {summary['index_seconds']}s）")
+    print(f"  吞吐：{summary['files_per_second']} 文件/s，{summary['chunks_per_second']} 文本块/s，{summary['mb_per_second']} MB/s")
+    for file_path in summary["failed_files"]:
+        print(f"  失败文件：{file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量入库目录下的 .md/.txt/.docx 文件")
+    parser.add_argument("root_dir", help="待入库目录（递归遍历）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="分块子进程数")
+    parser.add_argument("--max-inflight", type=int, default=None, help="同时在途的文档数上限，默认 workers*2")
+    parser.add_argument("--biz-label", default=None, help="知识库标签，默认使用配置中的biz_label")
+    parser.add_argument("--collection", default=None, help="向量库集合名，默认使用配置中的collection_name")
+    parser.add_argument("--dry-run", action="store_true", help="只分块，不入库")
+    args = parser.parse_args()
+
+    settings = Settings()
+    if args.biz_label:
+        settings.graph_store.biz_label = args.biz_label
+    if args.collection:
+        settings.vector_store.collection_name = args.collection
+
+    summary = bulk_ingest(settings, args.root_dir, workers=args.workers, max_inflight=args.max_inflight, dry_run=args.dry_run)
+    print_summary(summary)
@@ -0,0 +1,88 @@
+import sys
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Column, String, Integer, DateTime, UniqueConstraint
+
+# 将backend目录添加到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 与知识库管理共用 data/knowledge_base.db
+from service.knowledge_base_manager import Base, SessionLocal, engine
+
+
+# 已入库文档表：记录知识库中每个文档的内容指纹
+class IndexedDocument(Base):
+    __tablename__ = "indexed_documents"
+    __table_args__ = (UniqueConstraint("kb_name", "doc_id", name="uq_indexed_document"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kb_name = Column(String, nullable=False, index=True)
+    doc_id = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    chunk_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# 文档-文本块表：记录每个文档已成功入库的文本块ID
+class IndexedChunk(Base):
+    __tablename__ = "indexed_chunks"
+
+    kb_name = Column(String, primary_key=True)
+    doc_id = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True)
+
+
+# 创建数据库表
+Base.metadata.create_all(bind=engine)
+
+
+class DocumentRegistry:
+    """文档登记表：支持按文档增量重建索引（只处理变化的文本块）"""
+
+    def get_document(self, kb_name: str, doc_id: str) -> Optional[IndexedDocument]:
+        """获取已入库文档记录"""
+        db = SessionLocal()
+        try:
+            return db.query(IndexedDocument).filter(
+                IndexedDocument.kb_name == kb_name, IndexedDocument.doc_id == doc_id
+            ).first()
+        finally:
+            db.close()
+
+    def get_chunk_ids(self, kb_name: str, doc_id: str) -> List[str]:
+        """获取文档已入库的文本块ID"""
+        db = SessionLocal()
+        try:
+            rows = db.query(IndexedChunk.chunk_id).filter(
+                IndexedChunk.kb_name == kb_name, IndexedChunk.doc_id == doc_id
+            ).all()
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+    def save_document(self, kb_name: str, doc_id: str, content_hash: str, chunk_ids: List[str]) -> None:
+        """登记文档及其全部文本块ID（覆盖旧记录）"""
+        db = SessionLocal()
+        try:
+            document = db.query(IndexedDocument).filter(
+                IndexedDocument.kb_name == kb_name, IndexedDocument.doc_id == doc_id
+            ).first()
+            if document is None:
+                document = IndexedDocument(kb_name=kb_name, doc_id=doc_id)
+                db.add(document)
+            document.content_hash = content_hash
+            document.chunk_count = len(chunk_ids)
+
+            db.query(IndexedChunk).filter(
+                IndexedChunk.kb_name == kb_name, IndexedChunk.doc_id == doc_id
+            ).delete(synchronize_session=False)
+            db.add_all([IndexedChunk(kb_name=kb_name, doc_id=doc_id, chunk_id=chunk_id) for chunk_id in chunk_ids])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
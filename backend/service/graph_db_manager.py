@@ -18,7 +18,7 @@ except ImportError as e:
     NEO4J_AVAILABLE = False
 
 class GraphDBManager:
-    def __init__(self, settings: Settings, config=None):
+    def __init__(self, settings: Settings, config=None, graph_db=None):
         # 默认配置（从index_service.py中获取）
         self.default_config = {
             "uri": "bolt://192.168.0.197:7687",
@@ -33,7 +33,7 @@ class GraphDBManager:
         if config:
             self.config.update(config)
         
-        self.graph_db = get_graph_db(self.settings)
+        self.graph_db = graph_db if graph_db is not None else get_graph_db(self.settings)
     
     def __connect(self):
         """连接到Neo4j服务器"""
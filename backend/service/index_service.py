@@ -1,5 +1,6 @@
 import sys
 import os
+import hashlib
 from docx import Document  # 需要先安装 python-docx 库
 
 
@@ -7,90 +8,199 @@ from docx import Document  # 需要先安装 python-docx 库
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.indexing.chunking import kps_text_splitter
-from core.indexing.build_entity_extract_chain import build_langchain_extract_chain
-from core.indexing.graph_vector_construction import build_graph2vector
+from core.indexing.build_entity_extract_chain import build_extract_chain
+from core.indexing.graph_vector_construction import make_chunk_id, delete_chunks
+from core.indexing.pipeline import IngestionPipeline
 from config import Settings
 from core.tools.init_llm import get_llm
 from core.tools.init_embed import get_embedding
 from core.tools.init_vector_db import get_vector_db
 from core.tools.init_graph_db import get_graph_db, check_neo4j_details
 from core.indexing.chunk.content_split import content_split_run
+from service.document_registry import DocumentRegistry
+
+def get_file_params(file_path: str) -> dict:
+    """
+    从文件名解析文件标签：文件名（不含扩展名）按下划线分割，第2、3段分别为 file_tag1、file_tag2
+    如「青岛市金融发展促进条例_地方法规_政策法规.md」-> {"file_tag1": "地方法规", "file_tag2": "政策法规"}
+    缺少的标签为None
+    """
+    parts = os.path.splitext(os.path.basename(file_path))[0].lower().split('_')
+    file_tag_1 = parts[1] if len(parts) > 1 else None
+    file_tag_2 = parts[2] if len(parts) > 2 else None
+    return {
+        "file_tag1": file_tag_1 if file_tag_1 else None,
+        "file_tag2": file_tag_2 if file_tag_2 else None
+    }
+
+
+def make_content_hash(doc_content: str, split_mode: str, chunk_size: int, chunk_overlap: int) -> str:
+    """文档内容指纹：内容及分块参数均未变化时文档无需重新入库"""
+    return hashlib.sha256(f"{split_mode}|{chunk_size}|{chunk_overlap}|{doc_content}".encode("utf-8")).hexdigest()
+
 
 class IndexService:
-    def __init__(self, settings: Settings, config=None):
-        self.llm = get_llm(settings)
-        self.embeddings = get_embedding(settings)
-        self.vector_db = get_vector_db(settings, self.embeddings)
-        self.graph_db = get_graph_db(settings)
+    def __init__(self, settings: Settings, config=None, llm=None, embeddings=None, vector_db=None, graph_db=None):
+        # 允许注入已创建的客户端（见ServiceRegistry），未注入时按配置新建
+        self.llm = llm if llm is not None else get_llm(settings)
+        self.embeddings = embeddings if embeddings is not None else get_embedding(settings)
+        self.vector_db = vector_db if vector_db is not None else get_vector_db(settings, self.embeddings)
+        self.graph_db = graph_db if graph_db is not None else get_graph_db(settings)
         self.index_settings = settings
+        self.document_registry = DocumentRegistry()
     
-    def process_md(self, doc_content, file_params:dict):
+    def process_md(self, doc_content, file_params:dict = None, doc_id: str = None, progress=None, skip_chunk_ids=None, resume: bool = False):
         """
         处理文本的完整流程：分块 -> 提取实体关系 -> 构建图
         
         Args:
-            text: 待处理的长文本
+            doc_content: 待处理的markdown文本
+            file_params: 文件标签（file_tag1/file_tag2）
+            doc_id: 来源文档标识（如文件名），同一文档重复入库时只处理变化的文本块
+            progress: 进度回调对象（见 service.job_manager.JobProgress）
+            skip_chunk_ids: 已入库的文本块ID（如入库任务的检查点），恢复入库时跳过
+            resume: 是否为中断后重新执行的入库任务（上次可能已写入部分向量）
             
         Returns:
             dict: 处理结果，包含chunks、graph_triples、graph_info等信息
         """
-        # 1. 文本分块
-        chunks = content_split_run(doc_content, chunk_size=self.index_settings.split.chunk_size, chunk_overlap=self.index_settings.split.chunk_overlap)
-        print(f"文本分块完成，共得到 {len(chunks)} 个块")
-        
-        # 2. 构建提取实体和关系模版 
-        extract_chain = build_langchain_extract_chain(self.llm)
-        print(f"提取实体和关系模版构建完成")
-
-        # 3. 构建图结构 
-        build_graph2vector(settings=self.index_settings, chunks=chunks, vector_db=self.vector_db, graph_db=self.graph_db, extract_chain=extract_chain,file_params=file_params)
-        print(f"图构建完成")
-        # print(f"图构建完成，包含 {check_neo4j_details(self.graph_db)} 个节点")
-        
-        # 返回处理结果
-        return {
-            "chunks": chunks,
-            "graph_info": {
-                "node_count": check_neo4j_details(self.graph_db)
-            },
-            "status": "success"
-        }
-        # return {
-        #     "chunks": chunks,
-        #     "graph_triples": graph_triples,
-        #     "graph_info": {
-        #         "node_count": len(graph.node_ids),
-        #         "node_embeddings_shape": graph.node_embeddings.shape if graph.node_embeddings is not None else None
-        #     },
-        #     "persist_success": success
-        # }
-
-    def process_text(self, doc_content, file_params:dict):
+        split = self.index_settings.split
+        split_fn = lambda text: content_split_run(text, chunk_size=split.chunk_size, chunk_overlap=split.chunk_overlap)
+        return self._index_document(doc_content, split_fn, file_params or {}, doc_id, split_mode="md", progress=progress, skip_chunk_ids=skip_chunk_ids, resume=resume)
+
+    def process_text(self, doc_content, file_params:dict = None, doc_id: str = None, progress=None, skip_chunk_ids=None, resume: bool = False):
         """
         处理文本的完整流程：分块 -> 提取实体关系 -> 构建图
         
         Args:
-            text: 待处理的长文本
+            doc_content: 待处理的长文本
+            file_params: 文件标签（file_tag1/file_tag2）
+            doc_id: 来源文档标识（如文件名），同一文档重复入库时只处理变化的文本块
+            progress: 进度回调对象（见 service.job_manager.JobProgress）
+            skip_chunk_ids: 已入库的文本块ID（如入库任务的检查点），恢复入库时跳过
+            resume: 是否为中断后重新执行的入库任务（上次可能已写入部分向量）
             
         Returns:
             dict: 处理结果，包含chunks、graph_triples、graph_info等信息
         """
-        # 1. 文本分块
-        chunks = kps_text_splitter(doc_content, chunk_size=self.index_settings.split.chunk_size, chunk_overlap=self.index_settings.split.chunk_overlap)
-        print(f"文本分块完成，共得到 {len(chunks)} 个块")
-        
-        # 2. 构建提取实体和关系模版 
-        extract_chain = build_langchain_extract_chain(self.llm)
-        print(f"提取实体和关系模版构建完成")
-
-        # 3. 构建图结构 
-        build_graph2vector(settings=self.index_settings, chunks=chunks, vector_db=self.vector_db, graph_db=self.graph_db, extract_chain=extract_chain,file_params=file_params)
-        print(f"图构建完成")
-        # print(f"图构建完成，包含 {check_neo4j_details(self.graph_db)} 个节点")
-        
+        split = self.index_settings.split
+        split_fn = lambda text: kps_text_splitter(text, chunk_size=split.chunk_size, chunk_overlap=split.chunk_overlap)
+        return self._index_document(doc_content, split_fn, file_params or {}, doc_id, split_mode="text", progress=progress, skip_chunk_ids=skip_chunk_ids, resume=resume)
+
+    def process_chunks(self, doc_content, chunks, file_params:dict = None, doc_id: str = None, split_mode: str = "text"):
+        """
+        入库已分块的文档（如批量入库时在子进程中完成分块）
+
+        Args:
+            doc_content: 文档原文（用于内容指纹）
+            chunks: 文档的文本块列表
+            split_mode: 分块方式（text/md），与 process_text/process_md 的内容指纹保持一致
+        """
+        return self._index_document(doc_content, lambda text: chunks, file_params or {}, doc_id, split_mode=split_mode)
+
+    def _index_document(self, doc_content, split_fn, file_params: dict, doc_id: str, split_mode: str, progress=None, skip_chunk_ids=None, resume: bool = False):
+        """
+        增量入库：通过入库流水线分块（chunk）-> 向量化/实体抽取并行 -> 向量库/图数据库写入；
+        按内容哈希生成文本块ID，对比文档登记表，只写入新增/变化的文本块，删除文档中已消失的文本块
+        Args:
+            split_fn: 分块函数，输入文档文本，返回文本块列表
+            progress: 进度回调对象，需实现 on_start(pipeline)、on_split(总数, 待处理数)、on_chunk_done(chunk_id, 是否成功)
+            skip_chunk_ids: 视为已入库的文本块ID（入库任务恢复时的检查点）
+            resume: 是否为中断后重新执行的入库任务；上次执行可能在第一个检查点之前已写入部分向量
+        """
+        kb_name = self.index_settings.vector_store.collection_name
+        split = self.index_settings.split
+        content_hash = make_content_hash(doc_content, split_mode, split.chunk_size, split.chunk_overlap)
+        # 未指定文档标识时以内容哈希作为文档标识，重复上传相同内容直接跳过
+        doc_id = doc_id or content_hash
+
+        document = self.document_registry.get_document(kb_name, doc_id)
+        # 内容指纹与上次入库一致（且上次没有失败的文本块，失败时指纹记为空）：文档未变化，不再分块和入库
+        if document is not None and document.content_hash == content_hash:
+            print(f"文档 {doc_id} 内容未变化，跳过入库")
+            if progress is not None:
+                progress.on_split(document.chunk_count or 0, 0)
+            return {
+                "chunks": [],
+                "new_chunks_count": 0,
+                "deleted_chunks_count": 0,
+                "failed_chunks_count": 0,
+                "pipeline_stats": {},
+                "graph_info": {
+                    "node_count": check_neo4j_details(self.graph_db)
+                },
+                "status": "unchanged"
+            }
+        old_chunk_ids = set(self.document_registry.get_chunk_ids(kb_name, doc_id))
+        skip_chunk_ids = set(skip_chunk_ids or [])
+
+        # 分块阶段：生成确定性文本块ID，文档内重复的文本块只保留一个，只向下游传递新增/变化的文本块
+        chunks = []
+        chunk_pairs = {}
+        new_chunk_ids = []
+
+        def chunk_fn(text):
+            chunks.extend(split_fn(text))
+            print(f"文本分块完成，共得到 {len(chunks)} 个块")
+            new_pairs = []
+            for chunk in chunks:
+                chunk_id = make_chunk_id(kb_name, doc_id, chunk)
+                if chunk_id in chunk_pairs:
+                    continue
+                chunk_pairs[chunk_id] = chunk
+                if chunk_id in skip_chunk_ids:
+                    continue
+                if chunk_id not in old_chunk_ids:
+                    new_chunk_ids.append(chunk_id)
+                    new_pairs.append((chunk_id, chunk))
+            if progress is not None:
+                progress.on_split(len(chunk_pairs), len(new_pairs))
+            return new_pairs
+
+        # 2. 构建提取实体和关系模版
+        extract_chain = build_extract_chain(self.llm, self.index_settings.index.extract_mode, max_tokens=self.index_settings.index.extract_max_tokens)
+
+        # 3. 入库流水线；上次入库（或被中断的入库任务）未完成的文本块可能已写入向量库，写入前先清除避免重复
+        pipeline = IngestionPipeline(
+            settings=self.index_settings,
+            embeddings=self.embeddings,
+            vector_db=self.vector_db,
+            graph_db=self.graph_db,
+            extract_chain=extract_chain,
+            file_params=file_params,
+            replace_vectors=resume or document is not None or bool(skip_chunk_ids),
+            on_chunk_done=progress.on_chunk_done if progress is not None else None
+        )
+        if progress is not None:
+            progress.on_start(pipeline)
+        failed_chunk_ids = pipeline.run([doc_content], chunk_fn)
+        if pipeline.chunk_stage.errors:
+            # 分块失败时不能据此判断哪些文本块已消失，终止登记与删除
+            raise RuntimeError(f"文档 {doc_id} 分块失败")
+
+        chunk_ids = list(chunk_pairs.keys())
+        deleted_chunk_ids = [chunk_id for chunk_id in old_chunk_ids if chunk_id not in chunk_pairs]
+        print(f"文档 {doc_id}：新增/变化 {len(new_chunk_ids)} 个文本块，未变化 {len(chunk_ids) - len(new_chunk_ids)} 个，删除 {len(deleted_chunk_ids)} 个")
+
+        # 删除文档中已消失的文本块
+        delete_chunks(self.index_settings, self.vector_db, self.graph_db, deleted_chunk_ids)
+
+        # 登记文档；存在抽取失败的文本块时不记录内容指纹，下次入库会重试这些文本块
+        failed = set(failed_chunk_ids)
+        self.document_registry.save_document(
+            kb_name,
+            doc_id,
+            content_hash if not failed else "",
+            [chunk_id for chunk_id in chunk_ids if chunk_id not in failed]
+        )
+
         # 返回处理结果
         return {
             "chunks": chunks,
+            "new_chunks_count": len(new_chunk_ids),
+            "deleted_chunks_count": len(deleted_chunk_ids),
+            "failed_chunks_count": len(failed_chunk_ids),
+            "pipeline_stats": pipeline.stats(),
             "graph_info": {
                 "node_count": check_neo4j_details(self.graph_db)
             },
@@ -130,27 +240,21 @@ if __name__ == "__main__":
             with open(file_path, "r", encoding="utf-8") as f:
                 text = f.read()
             # 处理文本
-            result = index_service.process_text(text, file_params)
+            result = index_service.process_text(text, file_params, doc_id=os.path.basename(file_path))
         elif file_ext == '.md':
-            full_file_name = os.path.splitext(file_path)[0].lower()
-            file_tag_1 = full_file_name.split('_')[1]
-            file_tag_2 = full_file_name.split('_')[2]
+            file_params = get_file_params(file_path)
             # 读取md文件
-            file_params = {
-                "file_tag1": file_tag_1 if file_tag_1 else None,
-                "file_tag2": file_tag_2 if file_tag_2 else None
-            }
             with open(file_path, "r", encoding="utf-8") as f:
                 text = f.read()
             # 处理文本
-            result = index_service.process_md(text, file_params)
+            result = index_service.process_md(text, file_params, doc_id=os.path.basename(file_path))
         elif file_ext == '.docx':
             # 读取docx文件
             doc = Document(file_path)
             # 拼接docx中所有段落的文本
             text = '\n'.join([para.text for para in doc.paragraphs])
             # 处理文本
-            result = index_service.process_text(text, file_params)
+            result = index_service.process_text(text, file_params, doc_id=os.path.basename(file_path))
         else:
             raise ValueError(f"不支持的文件格式：{file_ext}，仅支持 .txt/.md 和 .docx")
         print(f"成功读取文件：{file_path}")
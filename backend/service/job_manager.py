@@ -0,0 +1,329 @@
+import sys
+import os
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, String, Integer, Text, DateTime
+
+# 将backend目录添加到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Settings
+# 与知识库管理共用 data/knowledge_base.db
+from service.knowledge_base_manager import Base, SessionLocal, engine
+
+# 入库任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+# 入库任务表
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    doc_id = Column(String, nullable=True)
+    # 分块方式：text（kps_text_splitter）/ md（content_split_run）
+    split_mode = Column(String, nullable=False, default="text")
+    # 待入库文本，任务结束（成功或失败）后清空
+    content = Column(Text, nullable=False)
+    file_params = Column(Text, nullable=True)
+    # 目标知识库标识（JSON，见 _kb_identity），不含密码、API密钥等配置；执行时其余配置取当前服务配置
+    settings_json = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default=JOB_PENDING, index=True)
+    total_chunks = Column(Integer, default=0)
+    done_chunks = Column(Integer, default=0)
+    failed_chunks = Column(Integer, default=0)
+    # 各阶段统计（JSON，见 IngestionPipeline.stats）
+    stage_stats = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# 入库任务检查点表：记录任务中已写入向量库和图数据库的文本块
+class IngestCheckpoint(Base):
+    __tablename__ = "ingest_checkpoints"
+
+    job_id = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# 创建数据库表
+Base.metadata.create_all(bind=engine)
+
+
+class JobProgress:
+    """
+    单个入库任务的进度回调（传给 IndexService.process_text/process_md）：
+    每个文本块完成时写入检查点，并记录实时进度
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.pipeline = None
+        self.total_chunks = 0
+        self.done_chunks = 0
+        self.failed_chunks = 0
+        self._lock = threading.Lock()
+
+    def on_start(self, pipeline) -> None:
+        self.pipeline = pipeline
+
+    def on_split(self, total: int, pending: int) -> None:
+        with self._lock:
+            self.total_chunks = total
+            # 无需处理的文本块（未变化或检查点中已完成）计为已完成
+            self.done_chunks = total - pending
+        _update_job(self.job_id, total_chunks=total, done_chunks=total - pending)
+
+    def on_chunk_done(self, chunk_id: str, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.done_chunks += 1
+            else:
+                self.failed_chunks += 1
+        if ok:
+            db = SessionLocal()
+            try:
+                db.merge(IngestCheckpoint(job_id=self.job_id, chunk_id=chunk_id))
+                db.commit()
+            finally:
+                db.close()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            data = {
+                "total_chunks": self.total_chunks,
+                "done_chunks": self.done_chunks,
+                "failed_chunks": self.failed_chunks
+            }
+        if self.pipeline is not None:
+            data["stage_stats"] = self.pipeline.stats()
+        return data
+
+
+# 确定目标知识库的配置项（与 ServiceRegistry.kb_key 一致），任务只持久化这些字段
+_KB_IDENTITY_FIELDS = {
+    "graph_store": ("biz_label", "uri", "database"),
+    "vector_store": ("collection_name", "host", "port"),
+}
+
+
+def _kb_identity(settings_data: Dict) -> Dict:
+    """从配置（Settings.model_dump 的结构）中提取知识库标识字段"""
+    return {
+        section: {name: settings_data.get(section, {}).get(name) for name in names if name in settings_data.get(section, {})}
+        for section, names in _KB_IDENTITY_FIELDS.items()
+    }
+
+
+def _resolve_settings(kb_identity: Dict) -> Settings:
+    """按知识库标识重建配置：以当前服务配置为基础，覆盖知识库标识字段"""
+    settings = Settings()
+    for section, values in kb_identity.items():
+        config = getattr(settings, section)
+        for name, value in values.items():
+            setattr(config, name, value)
+    return settings
+
+
+def _update_job(job_id: str, **fields) -> None:
+    db = SessionLocal()
+    try:
+        db.query(IngestJob).filter(IngestJob.id == job_id).update(fields, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+class JobManager:
+    """
+    后台入库任务管理：
+    - submit 持久化任务后立即返回任务ID，由线程池后台执行
+    - 每个文本块完成后写入检查点；服务重启时 resume_jobs 重新执行未完成的任务，跳过检查点中的文本块
+    """
+
+    def __init__(self, service_registry, max_workers: int = 2):
+        """
+        Args:
+            service_registry: 服务注册表，按任务配置获取IndexService
+            max_workers: 同时执行的入库任务数
+        """
+        self.service_registry = service_registry
+        self.executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="ingest-job")
+        self._progress: Dict[str, JobProgress] = {}
+        self._lock = threading.Lock()
+        self._redact_jobs()
+
+    @staticmethod
+    def _redact_jobs() -> None:
+        """清理历史任务记录：已结束任务的文本内容，以及按完整配置保存的settings_json（含密码、API密钥）"""
+        db = SessionLocal()
+        try:
+            db.query(IngestJob).filter(
+                IngestJob.status.in_([JOB_SUCCEEDED, JOB_FAILED]), IngestJob.content != ""
+            ).update({IngestJob.content: ""}, synchronize_session=False)
+            for job in db.query(IngestJob).filter(IngestJob.settings_json.like('%"password"%')).all():
+                job.settings_json = json.dumps(_kb_identity(json.loads(job.settings_json)), ensure_ascii=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+    def submit(self, settings: Settings, content: str, doc_id: Optional[str] = None, file_params: Optional[dict] = None, split_mode: str = "text") -> str:
+        """创建入库任务并提交到后台执行，返回任务ID"""
+        db = SessionLocal()
+        try:
+            job = IngestJob(
+                doc_id=doc_id,
+                split_mode=split_mode,
+                content=content,
+                file_params=json.dumps(file_params or {}, ensure_ascii=False),
+                settings_json=json.dumps(_kb_identity(settings.model_dump()), ensure_ascii=False),
+                status=JOB_PENDING
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+        self.executor.submit(self._run, job_id)
+        print(f"入库任务已提交：{job_id}（文档：{doc_id}）")
+        return job_id
+
+    def resume_jobs(self) -> List[str]:
+        """重新提交未完成（等待中/执行中被中断）的任务，返回任务ID列表"""
+        db = SessionLocal()
+        try:
+            job_ids = [row[0] for row in db.query(IngestJob.id).filter(
+                IngestJob.status.in_([JOB_PENDING, JOB_RUNNING])
+            ).order_by(IngestJob.created_at).all()]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self.executor.submit(self._run, job_id)
+        if job_ids:
+            print(f"恢复未完成的入库任务：{job_ids}")
+        return job_ids
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """查询任务状态；执行中的任务返回实时进度和各阶段统计"""
+        db = SessionLocal()
+        try:
+            job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+            if job is None:
+                return None
+            data = {
+                "job_id": job.id,
+                "doc_id": job.doc_id,
+                "status": job.status,
+                "total_chunks": job.total_chunks,
+                "done_chunks": job.done_chunks,
+                "failed_chunks": job.failed_chunks,
+                "stage_stats": json.loads(job.stage_stats) if job.stage_stats else None,
+                "error": job.error,
+                "attempts": job.attempts,
+                "created_at": job.created_at.isoformat() if job.created_at else None,
+                "started_at": job.started_at.isoformat() if job.started_at else None,
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None
+            }
+        finally:
+            db.close()
+        with self._lock:
+            progress = self._progress.get(job_id)
+        if progress is not None:
+            data.update(progress.snapshot())
+        return data
+
+    def shutdown(self, wait: bool = False) -> None:
+        self.executor.shutdown(wait=wait)
+
+    def _run(self, job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+            if job is None or job.status not in (JOB_PENDING, JOB_RUNNING):
+                return
+            checkpoint_ids = [row[0] for row in db.query(IngestCheckpoint.chunk_id).filter(IngestCheckpoint.job_id == job_id).all()]
+            job.status = JOB_RUNNING
+            job.started_at = datetime.utcnow()
+            job.attempts = (job.attempts or 0) + 1
+            db.commit()
+            content, doc_id, split_mode = job.content, job.doc_id, job.split_mode
+            # 非首次执行（服务中断后恢复）：上次执行可能已写入向量但尚未记录检查点
+            resume = job.attempts > 1
+            file_params = json.loads(job.file_params) if job.file_params else {}
+            # IndexService按知识库标识从服务注册表获取，只有知识库标识随任务保存
+            settings = _resolve_settings(_kb_identity(json.loads(job.settings_json)))
+        finally:
+            db.close()
+
+        if checkpoint_ids:
+            print(f"入库任务 {job_id} 从检查点恢复，跳过 {len(checkpoint_ids)} 个已完成的文本块")
+        progress = JobProgress(job_id)
+        with self._lock:
+            self._progress[job_id] = progress
+
+        start = time.perf_counter()
+        try:
+            index_service = self.service_registry.get_index_service(settings)
+            process = index_service.process_md if split_mode == "md" else index_service.process_text
+            result = process(content, file_params, doc_id, progress=progress, skip_chunk_ids=checkpoint_ids, resume=resume)
+            snapshot = progress.snapshot()
+            _update_job(
+                job_id,
+                status=JOB_SUCCEEDED,
+                total_chunks=snapshot["total_chunks"],
+                done_chunks=snapshot["done_chunks"],
+                failed_chunks=result["failed_chunks_count"],
+                stage_stats=json.dumps(result["pipeline_stats"], ensure_ascii=False),
+                content="",
+                finished_at=datetime.utcnow()
+            )
+            # 任务完成后文本块已登记到文档登记表，检查点不再需要
+            self._clear_checkpoints(job_id)
+            print(f"入库任务 {job_id} 完成，耗时{time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            snapshot = progress.snapshot()
+            _update_job(
+                job_id,
+                status=JOB_FAILED,
+                done_chunks=snapshot["done_chunks"],
+                failed_chunks=snapshot["failed_chunks"],
+                stage_stats=json.dumps(snapshot.get("stage_stats"), ensure_ascii=False),
+                error=f"{e.__class__.__name__}: {e}",
+                content="",
+                finished_at=datetime.utcnow()
+            )
+            print(f"入库任务 {job_id} 失败：{e}")
+        finally:
+            with self._lock:
+                self._progress.pop(job_id, None)
+
+    @staticmethod
+    def _clear_checkpoints(job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            db.query(IngestCheckpoint).filter(IngestCheckpoint.job_id == job_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,211 @@
+import sys
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+from typing import Dict, List
+
+# 将backend目录添加到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Settings
+from core.indexing.chunking import kps_text_splitter
+from core.indexing.chunk.content_split import content_split_run
+from core.indexing.build_entity_extract_chain import build_extract_chain
+from core.indexing.graph_vector_construction import make_chunk_id, delete_chunks
+from core.indexing.pipeline import IngestionPipeline
+from core.tools.init_llm import get_llm
+from core.tools.init_embed import get_embedding
+from core.tools.init_vector_db import get_vector_db
+from core.tools.init_graph_db import get_graph_db
+from core.tools.init_pg_db import PgTaskQueue
+from service.index_service import get_file_params, make_content_hash
+from service.document_registry import DocumentRegistry
+
+
+def enqueue_file(queue: PgTaskQueue, settings: Settings, file_path: str) -> int:
+    """
+    读取文件并分块，将文本块加入Postgres任务表（.md 按markdown结构分块，其余按文本分块）
+    Returns:
+        int: 新加入及重新加入的任务数
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    split = settings.split
+    split_mode = "md" if os.path.splitext(file_path)[1].lower() == ".md" else "text"
+    if split_mode == "md":
+        chunks = content_split_run(text, chunk_size=split.chunk_size, chunk_overlap=split.chunk_overlap)
+    else:
+        chunks = kps_text_splitter(text, chunk_size=split.chunk_size, chunk_overlap=split.chunk_overlap)
+    kb_name = settings.vector_store.collection_name
+    doc_id = os.path.basename(file_path)
+    pairs = {}
+    for chunk in chunks:
+        pairs.setdefault(make_chunk_id(kb_name, doc_id, chunk), chunk)
+    # 同时记录文档当前版本（内容指纹与IndexService一致），全部任务结束后由worker收尾
+    content_hash = make_content_hash(text, split_mode, split.chunk_size, split.chunk_overlap)
+    inserted, requeued = queue.enqueue_document(kb_name, doc_id, content_hash, list(pairs.items()), file_params=get_file_params(file_path), max_attempts=settings.worker.max_attempts)
+    print(f"文件 {doc_id}：{len(pairs)}个文本块，新加入任务{inserted}个，重新加入失败任务{requeued}个")
+    return inserted + requeued
+
+
+class _LeaseKeeper(threading.Thread):
+    """后台续租：处理期间按租约时长的1/3周期续租当前批次的任务"""
+
+    def __init__(self, settings: Settings, worker_id: str, task_ids: List[int], lease_seconds: int):
+        super().__init__(name=f"lease-{worker_id}", daemon=True)
+        self.settings = settings
+        self.worker_id = worker_id
+        self.task_ids = task_ids
+        self.lease_seconds = lease_seconds
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        queue = PgTaskQueue(self.settings)
+        try:
+            while not self._stop_event.wait(max(self.lease_seconds / 3, 1)):
+                queue.extend_lease(self.task_ids, self.worker_id, self.lease_seconds)
+        finally:
+            queue.close()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def finish_document(settings: Settings, queue: PgTaskQueue, registry: DocumentRegistry, doc_id: str, vector_db, graph_db) -> bool:
+    """
+    文档的全部任务结束（完成或失败）后收尾：删除旧版本中已消失的文本块，并登记到本机的文档登记表，
+    之后IndexService上传同一文档时只处理变化的文本块。
+    旧版本的文本块ID记录在Postgres中，在文档行锁内收尾，多台机器上的worker只有一个执行
+    Returns:
+        bool: 是否由本worker收尾（仍有未结束的任务或已收尾时返回False）
+    """
+    kb_name = settings.vector_store.collection_name
+    with queue.finalize_document(kb_name, doc_id) as document:
+        if document is None:
+            return False
+        stale_chunk_ids = document["stale_chunk_ids"]
+        delete_chunks(settings, vector_db, graph_db, stale_chunk_ids)
+        done_chunk_ids = document["done_chunk_ids"]
+        # 有失败的文本块时不记录内容指纹，下次上传时重新检查
+        failed = len(done_chunk_ids) < len(document["chunk_ids"])
+        registry.save_document(kb_name, doc_id, "" if failed else document["content_hash"], done_chunk_ids)
+    print(f"文档 {doc_id} 入库结束：{len(done_chunk_ids)}/{len(document['chunk_ids'])}个文本块，删除旧文本块{len(stale_chunk_ids)}个")
+    return True
+
+
+def process_tasks(settings: Settings, tasks: List[Dict], worker_id: str, queue: PgTaskQueue, llm, embeddings, vector_db, graph_db) -> None:
+    """通过入库流水线处理一批已领取的任务，逐个文本块标记完成/失败"""
+    task_ids = {task["chunk_id"]: task["id"] for task in tasks}
+    done_ids, failed_ids = [], []
+    lock = threading.Lock()
+
+    def on_chunk_done(chunk_id: str, ok: bool) -> None:
+        with lock:
+            (done_ids if ok else failed_ids).append(task_ids[chunk_id])
+
+    # 文件标签写入向量库元数据，按标签分组运行流水线
+    groups: Dict[str, List[Dict]] = {}
+    for task in tasks:
+        groups.setdefault(json.dumps(task["file_params"] or {}, sort_keys=True, ensure_ascii=False), []).append(task)
+
+    extract_chain = build_extract_chain(llm, settings.index.extract_mode, max_tokens=settings.index.extract_max_tokens)
+    for params_json, group in groups.items():
+        pipeline = IngestionPipeline(
+            settings=settings,
+            embeddings=embeddings,
+            vector_db=vector_db,
+            graph_db=graph_db,
+            extract_chain=extract_chain,
+            file_params=json.loads(params_json),
+            # 重试的任务上次可能已写入部分向量，写入前先清除
+            replace_vectors=any(task["attempts"] > 1 for task in group),
+            on_chunk_done=on_chunk_done
+        )
+        pipeline.run(group, lambda task: [(task["chunk_id"], task["chunk_text"])])
+
+    queue.complete(done_ids, worker_id)
+    # 流水线未回报的任务（如分块阶段异常）同样按失败处理
+    reported = set(done_ids) | set(failed_ids)
+    failed_ids.extend(task["id"] for task in tasks if task["id"] not in reported)
+    queue.fail(failed_ids, worker_id, error="ingestion pipeline failed")
+    print(f"worker {worker_id}：完成{len(done_ids)}个，失败{len(failed_ids)}个")
+
+    registry = DocumentRegistry()
+    for doc_id in sorted({task["doc_id"] for task in tasks}):
+        finish_document(settings, queue, registry, doc_id, vector_db, graph_db)
+
+
+def run_worker(settings: Settings, worker_id: str, once: bool = False) -> None:
+    """
+    worker主循环：领取任务 -> 入库 -> 标记完成/失败；队列为空时按poll_interval轮询
+    Args:
+        once: 队列为空时退出（用于批处理场景）
+    """
+    worker_config = settings.worker
+    kb_name = settings.vector_store.collection_name
+    queue = PgTaskQueue(settings)
+    queue.create_tables()
+    llm = get_llm(settings)
+    embeddings = get_embedding(settings)
+    vector_db = get_vector_db(settings, embeddings)
+    graph_db = get_graph_db(settings)
+    print(f"worker {worker_id} 启动，知识库：{kb_name}")
+    try:
+        while True:
+            tasks = queue.claim(kb_name, worker_id, batch_size=worker_config.batch_size, lease_seconds=worker_config.lease_seconds)
+            if not tasks:
+                if once:
+                    break
+                time.sleep(worker_config.poll_interval)
+                continue
+            lease_keeper = _LeaseKeeper(settings, worker_id, [task["id"] for task in tasks], worker_config.lease_seconds)
+            lease_keeper.start()
+            try:
+                process_tasks(settings, tasks, worker_id, queue, llm, embeddings, vector_db, graph_db)
+            except Exception as e:
+                queue.fail([task["id"] for task in tasks], worker_id, error=f"{e.__class__.__name__}: {e}")
+                print(f"worker {worker_id} 处理失败：{e}")
+            finally:
+                lease_keeper.stop()
+        print(f"队列已空，任务统计：{queue.stats(kb_name)}")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于Postgres任务表的分布式入库worker")
+    parser.add_argument("--biz-label", default=None, help="知识库标签，默认使用配置中的biz_label")
+    parser.add_argument("--collection", default=None, help="向量库集合名，默认使用配置中的collection_name")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="分块并加入任务表")
+    enqueue_parser.add_argument("files", nargs="+", help="待入库文件（.txt/.md）")
+
+    work_parser = subparsers.add_parser("work", help="领取并处理任务")
+    work_parser.add_argument("--worker-id", default=None, help="worker标识，默认 主机名-进程号")
+    work_parser.add_argument("--once", action="store_true", help="队列为空时退出")
+
+    subparsers.add_parser("stats", help="查看任务统计")
+    args = parser.parse_args()
+
+    settings = Settings()
+    if args.biz_label:
+        settings.graph_store.biz_label = args.biz_label
+    if args.collection:
+        settings.vector_store.collection_name = args.collection
+
+    if args.command == "work":
+        run_worker(settings, args.worker_id or f"{socket.gethostname()}-{os.getpid()}", once=args.once)
+    else:
+        queue = PgTaskQueue(settings)
+        try:
+            queue.create_tables()
+            if args.command == "enqueue":
+                total = sum(enqueue_file(queue, settings, file_path) for file_path in args.files)
+                print(f"共加入任务{total}个")
+            print(f"任务统计：{queue.stats(settings.vector_store.collection_name)}")
+        finally:
+            queue.close()
@@ -13,15 +13,16 @@ from core.retrieval.generate import generate_answer
 
 from core.retrieval.search.vector_graph_search import VectorGraphSearch
 from core.retrieval.search.vector_search import VectorSearch
-from core.retrieval.rerank import rerank_candidates
+from core.retrieval.rerank import rerank
 
 
 class RetrievalService:
-    def __init__(self, settings: Settings):
-        self.llm = get_llm(settings)
-        self.embeddings = get_embedding(settings)
-        self.vector_db = get_vector_db(settings, self.embeddings)
-        self.graph_db = get_graph_db(settings)
+    def __init__(self, settings: Settings, llm=None, embeddings=None, vector_db=None, graph_db=None):
+        # 允许注入已创建的客户端（见ServiceRegistry），未注入时按配置新建
+        self.llm = llm if llm is not None else get_llm(settings)
+        self.embeddings = embeddings if embeddings is not None else get_embedding(settings)
+        self.vector_db = vector_db if vector_db is not None else get_vector_db(settings, self.embeddings)
+        self.graph_db = graph_db if graph_db is not None else get_graph_db(settings)
         self.settings = settings
 
     def process_query(self, query, search_method: str = "vector"):
@@ -37,7 +38,7 @@ class RetrievalService:
             VectorSearchClazz = VectorSearch(self.vector_db, query, self.settings);
             vector_results, extended_chunks_results = VectorSearchClazz.process()
         # 后处理结果
-        extended_topk_chunks_results = rerank_candidates(query, extended_chunks_results)
+        extended_topk_chunks_results = rerank(query, extended_chunks_results, self.settings.rerank)
         # 合并上下文
         merged_context = VectorGraphSearchClazz.get_merged_context(vector_results, extended_topk_chunks_results)
         # 生成回答
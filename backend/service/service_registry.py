@@ -0,0 +1,200 @@
+import sys
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 将backend目录添加到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Settings
+from core.tools.init_llm import get_llm
+from core.tools.init_embed import get_embedding
+from core.tools.init_vector_db import get_vector_db
+from core.tools.init_graph_db import get_graph_db, ensure_graph_schema
+from service.retrieval_service import RetrievalService
+from service.index_service import IndexService
+
+
+class _KBEntry:
+    """单个知识库的服务实例缓存"""
+    def __init__(self, settings: Settings, vector_db):
+        self.settings = settings
+        self.vector_db = vector_db
+        self.retrieval_service: Optional[RetrievalService] = None
+        self.index_service: Optional[IndexService] = None
+        self.last_used = time.monotonic()
+        # 创建RetrievalService/IndexService时持有，不阻塞其他知识库
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        """关闭知识库的Milvus连接"""
+        client = getattr(self.vector_db, "client", None)
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception as e:
+            print(f"服务注册表：关闭Milvus连接失败：{e}")
+
+
+class ServiceRegistry:
+    """
+    应用级服务注册表：
+    - LLM、Embedding、Neo4j 客户端按连接配置在进程内共享，只创建一次
+    - 每个知识库（biz_label/collection_name）缓存自己的Milvus实例及RetrievalService/IndexService
+    - 知识库数量超过max_kbs时按LRU淘汰，空闲超过idle_ttl秒的知识库也会被淘汰
+    - 客户端和知识库在按键加锁的情况下创建，全局锁只保护缓存字典，加载一个知识库时不阻塞已加载知识库的请求
+    """
+
+    def __init__(self, max_kbs: int = 8, idle_ttl: int = 1800):
+        self.max_kbs = max(max_kbs, 1)
+        self.idle_ttl = idle_ttl
+        self._lock = threading.RLock()
+        self._shared: Dict[Tuple, Any] = {}
+        self._kbs: "OrderedDict[Tuple, _KBEntry]" = OrderedDict()
+        # 按缓存键的创建锁：同一键只创建一次，不同键并行创建
+        self._build_locks: Dict[Tuple, threading.Lock] = {}
+
+    @staticmethod
+    def kb_key(settings: Settings) -> Tuple:
+        """知识库缓存键：知识库名称 + 所在的图库/向量库地址"""
+        return (
+            settings.graph_store.biz_label,
+            settings.vector_store.collection_name,
+            settings.graph_store.uri,
+            settings.graph_store.database,
+            settings.vector_store.host,
+            settings.vector_store.port,
+        )
+
+    def _build_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _get_shared(self, key: Tuple, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._shared:
+                return self._shared[key]
+        with self._build_lock(("shared",) + key):
+            with self._lock:
+                if key in self._shared:
+                    return self._shared[key]
+            # 在全局锁外创建客户端
+            client = factory()
+            with self._lock:
+                self._shared[key] = client
+            return client
+
+    def get_llm(self, settings: Settings):
+        key = ("llm", settings.llm.model, settings.llm.base_url)
+        return self._get_shared(key, lambda: get_llm(settings))
+
+    def get_embeddings(self, settings: Settings):
+        key = ("embed", settings.embed.model, settings.embed.base_url)
+        return self._get_shared(key, lambda: get_embedding(settings))
+
+    @staticmethod
+    def _graph_key(settings: Settings) -> Tuple:
+        return ("graph", settings.graph_store.uri, settings.graph_store.user, settings.graph_store.database)
+
+    def get_graph_db(self, settings: Settings):
+        """共享Neo4j连接（schema初始化在知识库首次使用时按biz_label执行）"""
+        return self._get_shared(self._graph_key(settings), lambda: get_graph_db(settings, ensure_schema=False))
+
+    def _touch_kb(self, key: Tuple) -> Optional[_KBEntry]:
+        """查找已加载的知识库并更新LRU顺序（需持有self._lock）"""
+        entry = self._kbs.get(key)
+        if entry is not None:
+            self._kbs.move_to_end(key)
+            entry.last_used = time.monotonic()
+        return entry
+
+    def _get_kb(self, settings: Settings) -> _KBEntry:
+        key = self.kb_key(settings)
+        with self._lock:
+            self._evict_idle()
+            entry = self._touch_kb(key)
+        if entry is not None:
+            return entry
+        # 同一知识库只加载一次；Milvus/Neo4j连接和schema初始化在全局锁外进行
+        with self._build_lock(("kb",) + key):
+            with self._lock:
+                entry = self._touch_kb(key)
+            if entry is not None:
+                return entry
+            kb_settings = settings.model_copy(deep=True)
+            graph_db = self.get_graph_db(kb_settings)
+            ensure_graph_schema(graph_db, kb_settings.graph_store.biz_label)
+            vector_db = get_vector_db(kb_settings, self.get_embeddings(kb_settings))
+            entry = _KBEntry(kb_settings, vector_db)
+            with self._lock:
+                self._kbs[key] = entry
+                print(f"服务注册表：加载知识库 {key[0]}")
+                while len(self._kbs) > self.max_kbs:
+                    self._remove_kb(next(iter(self._kbs)), "LRU")
+            return entry
+
+    def _evict_idle(self) -> None:
+        if not self.idle_ttl:
+            return
+        now = time.monotonic()
+        for key in [k for k, e in self._kbs.items() if now - e.last_used > self.idle_ttl]:
+            self._remove_kb(key, "空闲超时")
+
+    def _remove_kb(self, key: Tuple, reason: str) -> None:
+        """
+        淘汰知识库（需持有self._lock）：删除其创建锁，关闭其Milvus连接；
+        同一地址的Milvus连接及共享的Neo4j连接在没有其他已缓存知识库使用时才关闭
+        """
+        entry = self._kbs.pop(key)
+        self._build_locks.pop(("kb",) + key, None)
+        print(f"服务注册表：淘汰知识库 {key[0]}（{reason}）")
+        remaining = list(self._kbs.values())
+        vector_address = (entry.settings.vector_store.host, entry.settings.vector_store.port)
+        if not any((e.settings.vector_store.host, e.settings.vector_store.port) == vector_address for e in remaining):
+            entry.close()
+        graph_key = self._graph_key(entry.settings)
+        if not any(self._graph_key(e.settings) == graph_key for e in remaining):
+            graph_db = self._shared.pop(graph_key, None)
+            self._build_locks.pop(("shared",) + graph_key, None)
+            driver = getattr(graph_db, "_driver", None)
+            if driver is not None:
+                try:
+                    driver.close()
+                except Exception as e:
+                    print(f"服务注册表：关闭Neo4j连接失败：{e}")
+
+    def get_retrieval_service(self, settings: Settings) -> RetrievalService:
+        entry = self._get_kb(settings)
+        with entry.lock:
+            if entry.retrieval_service is None:
+                entry.retrieval_service = RetrievalService(
+                    entry.settings,
+                    llm=self.get_llm(entry.settings),
+                    embeddings=self.get_embeddings(entry.settings),
+                    vector_db=entry.vector_db,
+                    graph_db=self.get_graph_db(entry.settings),
+                )
+            return entry.retrieval_service
+
+    def get_index_service(self, settings: Settings) -> IndexService:
+        entry = self._get_kb(settings)
+        with entry.lock:
+            if entry.index_service is None:
+                entry.index_service = IndexService(
+                    entry.settings,
+                    llm=self.get_llm(entry.settings),
+                    embeddings=self.get_embeddings(entry.settings),
+                    vector_db=entry.vector_db,
+                    graph_db=self.get_graph_db(entry.settings),
+                )
+            return entry.index_service
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "shared_clients": [key[0] for key in self._shared],
+                "knowledge_bases": [key[0] for key in self._kbs],
+            }